@@ -0,0 +1,104 @@
+"""Synthetic, realistically sized inputs for the benchmarks."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import random
+
+# The inputs only need to look real, and to be the same from run to run.
+SEED = 1234
+STACKTRACE_SEPARATOR = '+' + '-' * 40 + 'Release Build Stacktrace' + '-' * 40
+NINJA_TARGETS = 10000
+
+
+def frame(index, rng):
+  """Returns a symbolized ASan frame, linked to the source like on ClusterFuzz
+  and with the HTML escapes it has there."""
+  directory = rng.choice(['third_party/WebKit/Source/core/dom',
+                          'v8/src/compiler', 'base/memory', 'content/browser'])
+  name = 'Function%d' % rng.randint(0, 100000)
+  return (
+      '    #%d 0x%012x in blink::%s&lt;blink::Node&gt;(int, char const*) '
+      '<a href="https://cs.chromium.org/chromium/src/%s/File%d.cpp?l=%d">'
+      '%s/File%d.cpp:%d:%d</a>' % (
+          index % 100, rng.randint(0, 2 ** 48), name, directory, index,
+          index % 1000, directory, index, index % 1000, index % 80))
+
+
+def stacktrace_lines(count):
+  """Returns count lines of stacktrace: two stacktraces, as in a
+  ClusterFuzz report, with the separator half way through."""
+  rng = random.Random(SEED)
+  lines = ['', '==1==ERROR: AddressSanitizer: heap-use-after-free on address '
+           '0x60200000eff0 at pc 0x7f0 bp 0x7ff sp 0x7fe']
+  while len(lines) < count:
+    if len(lines) == count / 2:
+      lines.extend([STACKTRACE_SEPARATOR, ''])
+    lines.append(frame(len(lines), rng))
+  return lines[:count]
+
+
+def testcase_stacktrace(count):
+  """Returns a testcase's stacktrace lines as they come in its JSON. The
+  command is at the end, which is the worst case for finding it."""
+  rng = random.Random(SEED)
+  lines = [
+      '[Environment] ASAN_OPTIONS = %s' % sanitizer_options(40),
+      '[Environment] LSAN_OPTIONS = %s' % sanitizer_options(10),
+      '[Environment] UBSAN_OPTIONS = print_stacktrace=1:symbolize=0']
+  lines.extend(frame(i, rng) for i in xrange(count - len(lines) - 1))
+  lines.append(
+      'Running command: /mnt/scratch0/clusterfuzz/bot/builds/'
+      'chromium-browser-asan_linux-release_4392242b7f59878a2775b4607420a2b37e1'
+      '7ff13/revisions/d8 --random-seed=-1 --expose-gc --allow-natives-syntax '
+      '--turbo --harmony /mnt/scratch0/clusterfuzz/bot/inputs/fuzzer-testcases/'
+      'fuzz-1.js')
+  return [{'content': line} for line in lines]
+
+
+def crash_state(count, offset=0):
+  """Returns count frames of a crash state."""
+  return ['blink::Function%d' % (i + offset) for i in xrange(count)]
+
+
+def libfuzzer_args(count):
+  """Returns count libFuzzer flags, e.g. -rss_limit_mb=2048."""
+  return ' '.join('-flag_%d=%d' % (i, i * 7) for i in xrange(count))
+
+
+def sanitizer_options(count):
+  """Returns count sanitizer options, e.g. symbolize=1:detect_leaks=0."""
+  return ':'.join('option_%d=%d' % (i, i % 2) for i in xrange(count))
+
+
+def ninja_output_lines(size):
+  """Yields lines of ninja output, <size> bytes of them in total.
+
+  A fixed set of lines is cycled through so that generating them costs next to
+  nothing and does not need <size> bytes of memory."""
+  rng = random.Random(SEED)
+  lines = []
+  for i in xrange(NINJA_TARGETS):
+    path = 'obj/third_party/WebKit/Source/core/dom/dom/File%d.o' % i
+    lines.append('[%d/%d] CXX %s' % (i + 1, NINJA_TARGETS, path))
+    if rng.random() < 0.01:
+      lines.append('../../third_party/WebKit/File%d.cpp:10:5: warning: unused '
+                   'variable \'x\' [-Wunused-variable]' % i)
+
+  total = 0
+  for line in itertools.cycle(lines):
+    if total >= size:
+      return
+    total += len(line) + 1
+    yield line
@@ -0,0 +1,279 @@
+"""Microbenchmarks for the pure-Python hot paths of the tool.
+
+Each benchmark runs in a forked process, so that its peak memory is its own.
+Python 2.7 has no tracemalloc, so allocations are reported as the growth of
+the peak RSS while the benchmark runs."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import os
+import sys
+import gc
+import json
+import time
+import logging
+import argparse
+import resource
+import traceback
+import collections
+
+from benchmarks import inputs
+from clusterfuzz import common
+from clusterfuzz import local_logging
+from clusterfuzz import reproducers
+from clusterfuzz import testcase
+
+BASELINE_FILE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_STACKTRACE_LINES = 50000
+DEFAULT_NINJA_LOG_MB = 500
+QUICK_FACTOR = 100
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_THRESHOLD = 0.1
+
+# setup(sizes) builds the input outside of the timed region, and returns it
+# along with the number of operations (e.g. lines) that run(input) processes.
+Benchmark = collections.namedtuple('Benchmark', 'name setup run')
+
+
+def setup_stacktrace(sizes):
+  lines = inputs.stacktrace_lines(sizes['stacktrace_lines'])
+  return lines, len(lines)
+
+
+def setup_testcase(sizes):
+  # Testcase.__init__ needs the whole testcase JSON, which is beside the point.
+  current_testcase = testcase.Testcase.__new__(testcase.Testcase)
+  current_testcase.stacktrace_lines = inputs.testcase_stacktrace(
+      sizes['stacktrace_lines'])
+  return current_testcase, len(current_testcase.stacktrace_lines)
+
+
+def setup_binary_name(sizes):
+  stacktrace = inputs.testcase_stacktrace(sizes['stacktrace_lines'])
+  return stacktrace, len(stacktrace)
+
+
+def setup_is_similar(_):
+  original_state = inputs.crash_state(3)
+  return (inputs.crash_state(3, offset=1), original_state), 1
+
+
+def setup_libfuzzer_args(_):
+  args = inputs.libfuzzer_args(200)
+  return args, 200
+
+
+def setup_serialize_libfuzzer_args(_):
+  args = reproducers.deserialize_libfuzzer_args(inputs.libfuzzer_args(200))
+  return args, 200
+
+
+def setup_sanitizer_options(_):
+  reproducer = reproducers.BaseReproducer.__new__(reproducers.BaseReproducer)
+  return (reproducer, inputs.sanitizer_options(200)), 200
+
+
+def setup_ninja_output(sizes):
+  size = sizes['ninja_log_mb'] * 1024 * 1024
+  # Counting the lines costs a pass over them, but keeps ops/sec per line.
+  count = sum(1 for _ in inputs.ninja_output_lines(size))
+  return size, count
+
+
+def setup_send_output(sizes):
+  # Formats and writes every line like the real log file, but to /dev/null.
+  logger = logging.getLogger('clusterfuzz.benchmark')
+  logger.propagate = False
+  logger.setLevel(logging.DEBUG)
+  handler = logging.FileHandler(os.devnull)
+  handler.setFormatter(logging.Formatter(
+      local_logging.logging_config['formatters']['timestamp']['format']))
+  logger.addHandler(handler)
+  local_logging.logger = logger
+  return setup_ninja_output(sizes)
+
+
+def run_interpret_ninja_output(size):
+  progress = common.NinjaProgress()
+  for line in inputs.ninja_output_lines(size):
+    common.interpret_ninja_output(line, progress)
+
+
+def run_send_output(size):
+  for line in inputs.ninja_output_lines(size):
+    local_logging.send_output(line)
+
+
+BENCHMARKS = [
+    Benchmark('reproducers.strip_html', setup_stacktrace,
+              reproducers.strip_html),
+    Benchmark('reproducers.get_only_first_stacktrace', setup_stacktrace,
+              reproducers.get_only_first_stacktrace),
+    Benchmark('reproducers.is_similar', setup_is_similar,
+              lambda states: reproducers.is_similar(
+                  'Heap-use-after-free', states[0], 'Heap-use-after-free',
+                  states[1])),
+    Benchmark('reproducers.deserialize_libfuzzer_args', setup_libfuzzer_args,
+              reproducers.deserialize_libfuzzer_args),
+    Benchmark('reproducers.serialize_libfuzzer_args',
+              setup_serialize_libfuzzer_args,
+              reproducers.serialize_libfuzzer_args),
+    Benchmark('BaseReproducer.deserialize_sanitizer_options',
+              setup_sanitizer_options,
+              lambda args: args[0].deserialize_sanitizer_options(args[1])),
+    Benchmark('Testcase.get_environment_and_args', setup_testcase,
+              lambda current: current.get_environment_and_args()),
+    Benchmark('common.get_binary_name', setup_binary_name,
+              common.get_binary_name),
+    Benchmark('common.interpret_ninja_output', setup_ninja_output,
+              run_interpret_ninja_output),
+    Benchmark('local_logging.send_output', setup_send_output,
+              run_send_output),
+]
+
+
+def get_peak_rss_kb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(benchmark, sizes, min_time):
+  """Runs benchmark until min_time has passed, at least once, and returns
+  its ops/sec and peak memory growth."""
+  data, ops = benchmark.setup(sizes)
+  gc.collect()
+  rss_before = get_peak_rss_kb()
+
+  runs = 0
+  start_time = time.time()
+  while True:
+    benchmark.run(data)
+    runs += 1
+    elapsed = time.time() - start_time
+    if elapsed >= min_time:
+      break
+
+  return {'ops_per_sec': ops * runs / elapsed,
+          'seconds_per_run': elapsed / runs,
+          'ops': ops,
+          'peak_rss_growth_kb': get_peak_rss_kb() - rss_before}
+
+
+def measure_in_child(benchmark, sizes, min_time):
+  """Measures benchmark in a forked process, and returns the result."""
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(read_fd)
+    status = 0
+    try:
+      # The progress bar would otherwise be the bulk of the output.
+      sys.stdout = open(os.devnull, 'w')
+      result = measure(benchmark, sizes, min_time)
+    except BaseException:  # pylint: disable=broad-except
+      result = {'error': traceback.format_exc()}
+      status = 1
+    with os.fdopen(write_fd, 'w') as f:
+      json.dump(result, f)
+    os._exit(status)  # pylint: disable=protected-access
+
+  os.close(write_fd)
+  with os.fdopen(read_fd) as f:
+    output = f.read()
+  os.waitpid(pid, 0)
+  return json.loads(output)
+
+
+def compare(name, result, baseline, threshold):
+  """Returns how result compares to the baseline, and whether it regressed."""
+  if name not in baseline:
+    return 'no baseline', False
+  change = result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1
+  return '%+.1f%%' % (100 * change), change < -threshold
+
+
+def load_baseline(path):
+  if not os.path.exists(path):
+    return {'sizes': None, 'results': {}}
+  with open(path) as f:
+    return json.load(f)
+
+
+def execute(argv=None):
+  """Runs the benchmarks and compares them against the baseline. Returns 1 if
+  any of them regressed by more than the threshold."""
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('-k', '--filter', default='',
+                      help='Only run benchmarks whose name contains this.')
+  parser.add_argument('--stacktrace-lines', type=int,
+                      default=DEFAULT_STACKTRACE_LINES)
+  parser.add_argument('--ninja-log-mb', type=int, default=DEFAULT_NINJA_LOG_MB)
+  parser.add_argument('--quick', action='store_true', default=False,
+                      help='Use inputs %dx smaller.' % QUICK_FACTOR)
+  parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                      help='Minimum number of seconds to run each benchmark.')
+  parser.add_argument('--baseline', default=BASELINE_FILE_PATH)
+  parser.add_argument('--save-baseline', action='store_true', default=False,
+                      help='Store the results as the new baseline.')
+  parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                      help='The slowdown, as a fraction, that is a regression.')
+  args = parser.parse_args(argv)
+
+  factor = QUICK_FACTOR if args.quick else 1
+  sizes = {'stacktrace_lines': args.stacktrace_lines / factor,
+           'ninja_log_mb': max(1, args.ninja_log_mb / factor)}
+  baseline = load_baseline(args.baseline)
+  if baseline['sizes'] not in (None, sizes):
+    print('Warning: the baseline was measured with other input sizes: %s' %
+          baseline['sizes'])
+
+  print('%-46s %14s %12s %10s' % ('Benchmark', 'ops/sec', 'peak RSS +KB',
+                                  'vs. base'))
+  results = {}
+  regressed = False
+  for benchmark in BENCHMARKS:
+    if args.filter not in benchmark.name:
+      continue
+    result = measure_in_child(benchmark, sizes, args.min_time)
+    if 'error' in result:
+      print('%-46s failed:\n%s' % (benchmark.name, result['error']))
+      regressed = True
+      continue
+    results[benchmark.name] = result
+    change, is_regression = compare(
+        benchmark.name, result, baseline['results'], args.threshold)
+    regressed = regressed or is_regression
+    print('%-46s %14.1f %12d %10s%s' % (
+        benchmark.name, result['ops_per_sec'], result['peak_rss_growth_kb'],
+        change, ' REGRESSION' if is_regression else ''))
+    sys.stdout.flush()
+
+  if args.save_baseline:
+    if baseline['sizes'] == sizes:
+      results = dict(baseline['results'], **results)
+    baseline = {'sizes': sizes, 'results': results}
+    with open(args.baseline, 'w') as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+    print('Baseline written to: %s' % args.baseline)
+
+  return 1 if regressed else 0
+
+
+def main():
+  sys.exit(execute())
+
+
+if __name__ == '__main__':
+  main()
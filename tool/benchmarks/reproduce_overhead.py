@@ -0,0 +1,200 @@
+"""Measures the overhead of `reproduce` end to end, against local stand-ins.
+
+Every scenario runs the real tool in a fresh process, with fake build tools on
+PATH and a local server in place of ClusterFuzz, cr-rev and Cloud Storage, so
+that what is left is the tool's own cost. The time spent in each phase is read
+from the trace of the run."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import collections
+import subprocess
+
+from benchmarks import stand_ins
+
+DEFAULT_PADDING_MB = 32
+
+# (name, home, reproduce arguments, run on which the binary crashes).
+# Scenarios sharing a home run one after the other, so the later ones find the
+# caches the earlier ones left behind.
+Scenario = collections.namedtuple('Scenario', 'name home args crash_after')
+SCENARIOS = [
+    Scenario('download, cold cache', 'download', ['--build', 'download'], 1),
+    Scenario('download, warm cache', 'download', ['--build', 'download'], 1),
+    Scenario('download, 3 iterations', 'download',
+             ['--build', 'download', '-i', '3'], 3),
+    Scenario('build, cold out dir', 'build',
+             ['--build', 'standalone', '--current', '--disable-goma'], 1),
+    Scenario('build, warm out dir', 'build',
+             ['--build', 'standalone', '--current', '--disable-goma'], 1),
+]
+
+
+def run_child(base_url, trace_file, argv):
+  """Runs `reproduce` in this process, talking to the stand-ins."""
+  from clusterfuzz import artifact_store
+  from clusterfuzz import binary_providers
+  from clusterfuzz import downloader
+  from clusterfuzz import main
+  from clusterfuzz import reproducers
+  from clusterfuzz import stackdriver_logging
+  from clusterfuzz.commands import reproduce
+
+  reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL = (
+      base_url + '/v2/testcase-detail/refresh')
+  artifact_store.CLUSTERFUZZ_TESTCASE_URL = (
+      base_url + '/v2/testcase-detail/download-testcase?id=%s')
+  reproducers.CLUSTERFUZZ_PARSE_STACKTRACE_URL = (
+      base_url + '/v2/parse_stacktrace')
+  downloader.GCS_API_URL = base_url + '/gs/'
+  binary_providers.build_revision_to_sha_url = (
+      lambda revision, repo: base_url + '/crrev?number=%s' % revision)
+  # Usage logging would need credentials and the network.
+  stackdriver_logging.send_log = lambda params, stacktrace=None: None
+
+  main.execute(['reproduce', str(stand_ins.TESTCASE_ID)] + argv +
+               ['--trace-file', trace_file])
+
+
+def prepare_home(home, source_dir):
+  """Creates a home directory with a stored auth header, and the checkout."""
+  cache_dir = os.path.join(home, '.clusterfuzz', 'cache')
+  os.makedirs(cache_dir)
+  auth_header_file = os.path.join(cache_dir, 'auth_header')
+  with open(auth_header_file, 'w') as f:
+    f.write('Bearer benchmark')
+  os.chmod(auth_header_file, 0600)
+  os.makedirs(source_dir)
+  stand_ins.create_source_checkout(source_dir)
+
+
+def get_phase_times(trace_file):
+  """Returns the seconds spent in each span of a trace, in the order the spans
+  first started. Nested spans are included in their parents' times."""
+  with open(trace_file) as f:
+    events = [e for e in json.load(f)['traceEvents'] if e['ph'] == 'X']
+  events.sort(key=lambda e: e['ts'])
+  times = collections.OrderedDict()
+  for event in events:
+    times[event['name']] = times.get(event['name'], 0) + event['dur'] / 1e6
+  return times
+
+
+def run_scenario(scenario, work_dir, base_url, bin_dir, crashing_binary):
+  """Runs a scenario in a child process, and returns its phase times."""
+  home = os.path.join(work_dir, scenario.home)
+  source_dir = os.path.join(home, 'v8')
+  if not os.path.exists(home):
+    prepare_home(home, source_dir)
+  runs_file = os.path.join(home, '.crash_runs')
+  if os.path.exists(runs_file):
+    os.remove(runs_file)
+
+  trace_file = os.path.join(work_dir, 'trace.json')
+  env = dict(
+      os.environ, HOME=home, V8_SRC=source_dir, CHROMIUM_SRC=source_dir,
+      PATH=os.pathsep.join([bin_dir, os.environ.get('PATH', '')]),
+      PYTHONPATH=os.pathsep.join(sys.path), CF_BENCHMARK_URL=base_url,
+      CF_BENCHMARK_CRASHING_BINARY=crashing_binary,
+      CF_BENCHMARK_CRASH_AFTER=str(scenario.crash_after))
+  command = [sys.executable, '-c',
+             'import sys; from benchmarks import reproduce_overhead; '
+             'reproduce_overhead.run_child(*sys.argv[1:3], argv=sys.argv[3:])',
+             base_url, trace_file] + scenario.args
+
+  log_path = os.path.join(work_dir, 'output.log')
+  start_time = time.time()
+  with open(log_path, 'a') as log:
+    returncode = subprocess.call(command, env=env, stdout=log,
+                                 stderr=subprocess.STDOUT)
+  wall_time = time.time() - start_time
+  if returncode != 0:
+    raise Exception('%s failed (%d), see: %s' % (scenario.name, returncode,
+                                                 log_path))
+
+  times = get_phase_times(trace_file)
+  times['total (process)'] = wall_time
+  # What the process spends before and after the command: imports and such.
+  times['startup and exit'] = wall_time - times['reproduce']
+  return times
+
+
+def print_table(results):
+  names = []
+  for times in results.itervalues():
+    names.extend(name for name in times if name not in names)
+
+  width = max(len(name) for name in names)
+  print('%-*s %s' % (width, 'Phase (seconds)',
+                     ' '.join('%24s' % s for s in results)))
+  for name in names:
+    print('%-*s %s' % (width, name, ' '.join(
+        '%24s' % ('%.3f' % times[name] if name in times else '-')
+        for times in results.itervalues())))
+
+
+def execute(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('-k', '--filter', default='',
+                      help='Only run scenarios whose name contains this.')
+  parser.add_argument('--padding-mb', type=int, default=DEFAULT_PADDING_MB,
+                      help='How much incompressible data the build archive '
+                           'holds besides the binary.')
+  parser.add_argument('--output', default=None,
+                      help='Also write the phase times to this file as JSON.')
+  parser.add_argument('--keep', action='store_true', default=False,
+                      help='Keep the working directory, for investigating.')
+  args = parser.parse_args(argv)
+
+  work_dir = tempfile.mkdtemp(prefix='cf-reproduce-overhead-')
+  bin_dir = os.path.join(work_dir, 'bin')
+  crashing_binary = stand_ins.install_tools(bin_dir)
+  archive = stand_ins.create_build_archive(
+      crashing_binary, args.padding_mb * 1024 * 1024)
+
+  results = collections.OrderedDict()
+  try:
+    with stand_ins.Server(archive) as server:
+      for scenario in SCENARIOS:
+        if args.filter not in scenario.name:
+          continue
+        results[scenario.name] = run_scenario(
+            scenario, work_dir, server.base_url, bin_dir, crashing_binary)
+  finally:
+    if args.keep:
+      print('Working directory: %s' % work_dir)
+    else:
+      shutil.rmtree(work_dir, ignore_errors=True)
+
+  print_table(results)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+def main():
+  execute()
+
+
+if __name__ == '__main__':
+  main()
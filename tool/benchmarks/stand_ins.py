@@ -0,0 +1,254 @@
+"""Local stand-ins for everything `reproduce` talks to: the ClusterFuzz
+endpoints, cr-rev, Cloud Storage and the build tools."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import sys
+import json
+import stat
+import base64
+import hashlib
+import zipfile
+import urlparse
+import StringIO
+import threading
+import SocketServer
+import subprocess
+import BaseHTTPServer
+
+TESTCASE_ID = 5
+JOB_TYPE = 'linux_asan_d8'
+REVISION = 400000
+BUILD_NAME = 'd8-linux-release-v8-component-%d' % REVISION
+BUILD_BUCKET = 'clusterfuzz-builds'
+TESTCASE_FILENAME = 'fuzz-1.js'
+GIT_SHA = '1a2b3c4d5e6f1a2b3c4d5e6f1a2b3c4d5e6f1a2b'
+CRASH_TYPE = 'Heap-use-after-free\nREAD 8'
+CRASH_STATE = 'v8::internal::Heap::Scavenge\nv8::internal::Heap::Collect\n'
+CRASH_FRAMES = [
+    '    #0 0x55d1c9 in v8::internal::Heap::Scavenge() heap.cc:1720:3',
+    '    #1 0x55d2ca in v8::internal::Heap::Collect() heap.cc:1420:5',
+    '    #2 0x55d3cb in v8::internal::Heap::Perform() heap.cc:1120:7']
+ASAN_ERROR = ('==1==ERROR: AddressSanitizer: heap-use-after-free on address '
+              '0x60200000eff0 at pc 0x55d1c9 bp 0x7ffd sp 0x7ffc')
+
+# The tiny crashing binary. It only crashes from the CRASH_AFTER'th run on, to
+# make the tool go through more than one iteration.
+CRASHING_BINARY = """#!/bin/sh
+runs_file="$HOME/.crash_runs"
+runs=$(( $(cat "$runs_file" 2>/dev/null || echo 0) + 1 ))
+echo $runs > "$runs_file"
+if [ $runs -lt ${CF_BENCHMARK_CRASH_AFTER:-1} ]; then
+  echo "No crash this time."
+  exit 0
+fi
+cat <<'EOF'
+%s
+EOF
+exit 1
+""" % '\n'.join([ASAN_ERROR] + CRASH_FRAMES)
+
+# Fake tools. gsutil and wget fetch from the stand-in server, ninja "links"
+# the crashing binary into the out dir and logs it like ninja would.
+FAKE_GSUTIL = """#!%(python)s
+import os, shutil, sys, urllib2
+source = sys.argv[2].replace('gs://', os.environ['CF_BENCHMARK_URL'] + '/gs/')
+destination = os.path.join(sys.argv[3], os.path.basename(sys.argv[2]))
+with open(destination, 'wb') as f:
+  shutil.copyfileobj(urllib2.urlopen(source), f, 1024 * 1024)
+"""
+FAKE_WGET = """#!%(python)s
+import cgi, shutil, sys, urllib2
+url = sys.argv[-1]
+headers = dict(a[len('--header='):].split(': ', 1)
+               for a in sys.argv[1:-1] if a.startswith('--header='))
+response = urllib2.urlopen(urllib2.Request(url, headers=headers))
+_, params = cgi.parse_header(response.info().get('Content-Disposition', ''))
+with open(params.get('filename', 'download'), 'wb') as f:
+  shutil.copyfileobj(response, f)
+"""
+FAKE_NINJA = """#!%(python)s
+import os, shutil, sys
+build_dir = sys.argv[sys.argv.index('-C') + 1]
+target = sys.argv[-1]
+output = os.path.join(build_dir, target)
+shutil.copy(os.environ['CF_BENCHMARK_CRASHING_BINARY'], output)
+log_path = os.path.join(build_dir, '.ninja_log')
+new_log = not os.path.exists(log_path)
+with open(log_path, 'a') as f:
+  if new_log:
+    f.write('# ninja log v5\\n')
+  f.write('0\\t10\\t0\\t%%s\\tdeadbeef\\n' %% target)
+print('[1/1] LINK %%s' %% target)
+"""
+NO_OP = """#!/bin/sh
+exit 0
+"""
+FAKE_TOOLS = {'gsutil': FAKE_GSUTIL, 'wget': FAKE_WGET, 'ninja': FAKE_NINJA,
+              'gclient': NO_OP, 'gn': NO_OP}
+
+
+def write_executable(path, content):
+  with open(path, 'w') as f:
+    f.write(content)
+  os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+           stat.S_IXOTH)
+
+
+def install_tools(bin_dir):
+  """Writes the fake tools and the crashing binary to bin_dir. Returns the
+  path of the crashing binary."""
+  if not os.path.exists(bin_dir):
+    os.makedirs(bin_dir)
+  for name, template in FAKE_TOOLS.iteritems():
+    write_executable(os.path.join(bin_dir, name),
+                     template % {'python': sys.executable})
+  crashing_binary = os.path.join(bin_dir, 'crashing_binary')
+  write_executable(crashing_binary, CRASHING_BINARY)
+  return crashing_binary
+
+
+def create_source_checkout(source_dir):
+  """Creates a git checkout that passes for a V8 one."""
+  update_script = os.path.join(source_dir, 'tools', 'clang', 'scripts',
+                               'update.py')
+  os.makedirs(os.path.dirname(update_script))
+  with open(update_script, 'w') as f:
+    f.write('')
+  with open(os.devnull, 'w') as devnull:
+    for args in [['init', '-q'], ['add', '-A'],
+                 ['-c', 'user.name=benchmark', '-c', 'user.email=b@localhost',
+                  'commit', '-q', '-m', 'Initial commit']]:
+      subprocess.check_call(['git'] + args, cwd=source_dir, stdout=devnull)
+
+
+def create_build_archive(crashing_binary, padding_size):
+  """Returns a build archive with the binary in it, padded with incompressible
+  data to make downloading and extracting it cost something."""
+  archive = StringIO.StringIO()
+  with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+    with open(crashing_binary) as f:
+      info = zipfile.ZipInfo(os.path.join(BUILD_NAME, 'd8'))
+      info.external_attr = 0755 << 16
+      zipped.writestr(info, f.read())
+    zipped.writestr(os.path.join(BUILD_NAME, 'args.gn'), get_gn_args())
+    zipped.writestr(os.path.join(BUILD_NAME, 'snapshot_blob.bin'),
+                    os.urandom(padding_size))
+  return archive.getvalue()
+
+
+def get_gn_args():
+  return 'is_asan = true\nis_debug = false\nv8_enable_verify_heap = true\n'
+
+
+def get_testcase_info():
+  """Returns what the testcase-detail endpoint returns for the testcase."""
+  lines = [
+      '[Environment] ASAN_OPTIONS = alloc_dealloc_mismatch=0:symbolize=0',
+      'Running command: /mnt/builds/%s/d8 --random-seed=1 --expose-gc '
+      '/mnt/inputs/%s' % (BUILD_NAME, TESTCASE_FILENAME),
+      ASAN_ERROR] + CRASH_FRAMES
+  return {
+      'id': TESTCASE_ID,
+      'crash_type': CRASH_TYPE,
+      'crash_state': CRASH_STATE,
+      'crash_revision': REVISION,
+      'crash_stacktrace': {'lines': [{'content': line} for line in lines]},
+      'metadata': {
+          'build_url': 'https://storage.cloud.google.com/%s/%s.zip' % (
+              BUILD_BUCKET, BUILD_NAME),
+          'gn_args': get_gn_args()},
+      'testcase': {
+          'job_type': JOB_TYPE,
+          'absolute_path': '/mnt/inputs/%s' % TESTCASE_FILENAME,
+          'one_time_crasher_flag': False,
+          'window_argument': '',
+          'minimized_arguments': ''}}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves the ClusterFuzz, cr-rev and Cloud Storage stand-ins."""
+
+  def log_message(self, *_):
+    pass
+
+  def send(self, body, content_type='application/json', headers=None,
+           status=200):
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    for name, value in (headers or {}).iteritems():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    url = urlparse.urlparse(self.path)
+    if url.path == '/v2/testcase-detail/download-testcase':
+      self.send('print("fuzz");\n', 'application/octet-stream', {
+          'Content-Disposition': 'attachment; filename="%s"' %
+                                 TESTCASE_FILENAME})
+    elif url.path == '/crrev':
+      self.send(json.dumps({'git_sha': GIT_SHA}))
+    elif url.path == '/gs/%s/%s.zip' % (BUILD_BUCKET, BUILD_NAME):
+      self.send_object(self.server.build_archive)
+    else:
+      self.send_error(404)
+
+  def send_object(self, content):
+    """Serves a Cloud Storage object, or the byte range of it asked for."""
+    headers = {'x-goog-hash': 'md5=%s' % base64.b64encode(
+        hashlib.md5(content).digest())}
+    match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+    if not match:
+      self.send(content, 'application/zip', headers)
+      return
+    start, end = int(match.group(1)), int(match.group(2))
+    headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(content))
+    self.send(content[start:end + 1], 'application/zip', headers, status=206)
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    if self.path == '/v2/testcase-detail/refresh':
+      self.send(json.dumps(get_testcase_info()),
+                headers={'x-clusterfuzz-authorization': 'Bearer benchmark'})
+    elif self.path == '/v2/parse_stacktrace':
+      crashed = 'AddressSanitizer' in json.loads(body)['stacktrace']
+      self.send(json.dumps({'crash_type': CRASH_TYPE if crashed else '',
+                            'crash_state': CRASH_STATE if crashed else ''}))
+    else:
+      self.send_error(404)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Runs the stand-in endpoints on a free local port, in the background."""
+
+  daemon_threads = True
+
+  def __init__(self, build_archive):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+    self.build_archive = build_archive
+    self.base_url = 'http://127.0.0.1:%d' % self.server_port
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.shutdown()
+    self.server_close()
@@ -0,0 +1,221 @@
+"""Extracts build archives in-process, decompressing members across a pool
+of threads."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import errno
+import fnmatch
+import logging
+import zipfile
+import posixpath
+import multiprocessing
+from multiprocessing import pool
+
+from clusterfuzz import common
+from clusterfuzz import elf
+from clusterfuzz import resource_usage
+from clusterfuzz import tracing
+
+COPY_SIZE = 1024 * 1024
+# The data files, besides shared libraries, that a binary may read at
+# startup: fuzzer dictionaries and options, V8 snapshots, ICU data and
+# Chrome's resource packs.
+NEEDED_PATTERNS = ['args.gn', '*.dict', '*.options', '*.bin', '*.dat',
+                   '*.pak']
+logger = logging.getLogger('clusterfuzz')
+
+
+class UnsafeMemberError(common.ExpectedException):
+  """An error for archive members that would land outside the destination."""
+
+  def __init__(self, name):
+    super(UnsafeMemberError, self).__init__(
+        'The archive member %s would be extracted outside of the destination.'
+        % name)
+
+
+def get_member_ends(zipped):
+  """Returns the offset up to which each member's data is stored. The data of
+  a member ends where the next member, or the central directory, begins."""
+  infos = sorted(zipped.infolist(), key=lambda info: info.header_offset)
+  ends = {}
+  for info, next_info in zip(infos, infos[1:]):
+    ends[info.filename] = next_info.header_offset
+  if infos:
+    ends[infos[-1].filename] = zipped.start_dir
+  return ends
+
+
+def get_relative_name(name, root):
+  """Returns the name of a member relative to the root directory of the
+  archive, or None if it is outside of it."""
+  if not root:
+    return name
+  prefix = root.rstrip('/') + '/'
+  if not name.startswith(prefix):
+    return None
+  return name[len(prefix):]
+
+
+def get_target_path(destination, name):
+  """Returns where a member is extracted to, refusing names that escape
+  destination."""
+  if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/'):
+    raise UnsafeMemberError(name)
+  return os.path.join(destination, *name.split('/'))
+
+
+def make_dirs(path):
+  """Creates path, which other threads may be creating at the same time."""
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+
+
+def extract_member(zipped, info, destination, progress, root=None):
+  """Extracts one member, keeping its permissions, and symlinks as
+  symlinks."""
+  path = get_target_path(destination, get_relative_name(info.filename, root))
+  if info.filename.endswith('/'):
+    make_dirs(path)
+    return
+
+  make_dirs(os.path.dirname(path))
+  mode = info.external_attr >> 16
+  if stat.S_ISLNK(mode):
+    if os.path.lexists(path):
+      os.remove(path)
+    os.symlink(zipped.read(info), path)
+    progress.add(info.file_size)
+    return
+
+  source = zipped.open(info)
+  try:
+    with open(path, 'wb') as target:
+      while True:
+        data = source.read(COPY_SIZE)
+        if not data:
+          break
+        target.write(data)
+        progress.add(len(data))
+  finally:
+    source.close()
+  if mode & 0777:
+    os.chmod(path, mode & 07777)
+
+
+@tracing.traced
+def extract(archive_path, destination, threads=None, wait_for=None,
+            show_progress=True, root=None, names=None):
+  """Extracts the zip archive at archive_path into destination.
+
+  With root, only the members in that directory of the archive are extracted,
+  straight into destination. With names, only the members of those names are.
+
+  Members are handed to the threads in the order they are stored in. When
+  the archive is still being written, wait_for(offset) must block until the
+  archive is complete up to offset; only its central directory, at the end,
+  is needed up front."""
+  threads = threads or multiprocessing.cpu_count()
+  zipped = zipfile.ZipFile(archive_path)
+  try:
+    infos = sorted(
+        [info for info in zipped.infolist()
+         if get_relative_name(info.filename, root) and
+         (names is None or info.filename in names)],
+        key=lambda info: info.header_offset)
+    ends = get_member_ends(zipped)
+    progress = common.ByteProgress(
+        sum(info.file_size for info in infos), prefix='Extracting:',
+        show=show_progress)
+    logger.info('Extracting %d files (%s) with %d threads...', len(infos),
+                resource_usage.format_bytes(progress.total), threads)
+
+    def extract_one(info):
+      if wait_for:
+        wait_for(ends[info.filename])
+      # Reading a ZipFile opened by path opens the file again per member, so
+      # the threads can share it.
+      extract_member(zipped, info, destination, progress, root)
+
+    workers = pool.ThreadPool(threads)
+    try:
+      for _ in workers.imap_unordered(extract_one, infos):
+        pass
+    finally:
+      workers.terminate()
+      workers.join()
+  finally:
+    zipped.close()
+
+
+def is_needed_file(relative_name, binary_name):
+  return relative_name == binary_name or any(
+      fnmatch.fnmatch(relative_name, pattern) for pattern in NEEDED_PATTERNS)
+
+
+def find_library(library, dependent, relative_names, names_by_basename):
+  """Returns the member that provides library to the member dependent: the
+  one next to it if there is one, or else any of that name."""
+  name = posixpath.join(posixpath.dirname(dependent), library)
+  if name in relative_names:
+    return name
+  candidates = names_by_basename.get(library)
+  return candidates[0] if candidates else None
+
+
+@tracing.traced
+def extract_needed(archive_path, destination, root, binary_name, threads=None,
+                   wait_for=None, show_progress=True):
+  """Extracts, like extract with root, only binary_name, the shared libraries
+  it needs, transitively, and the data files matching NEEDED_PATTERNS.
+  Returns the names of the members extracted."""
+  with zipfile.ZipFile(archive_path) as zipped:
+    relative_names = {}
+    for name in zipped.namelist():
+      relative_name = get_relative_name(name, root)
+      if relative_name and not name.endswith('/'):
+        relative_names[name] = relative_name
+  names_by_basename = {}
+  for name in sorted(relative_names):
+    names_by_basename.setdefault(posixpath.basename(name), []).append(name)
+
+  selected = set(name for name, relative_name in relative_names.iteritems()
+                 if is_needed_file(relative_name, binary_name))
+  pending = selected
+  while pending:
+    extract(archive_path, destination, threads=threads, wait_for=wait_for,
+            show_progress=show_progress, root=root, names=pending)
+
+    found = set()
+    for name in pending:
+      path = get_target_path(destination, relative_names[name])
+      if os.path.islink(path):
+        found.add(posixpath.normpath(posixpath.join(
+            posixpath.dirname(name), os.readlink(path))))
+      elif os.path.isfile(path):
+        for library in elf.get_needed_libraries(path):
+          found.add(find_library(
+              library, name, relative_names, names_by_basename))
+    # Libraries the system provides are not in the archive.
+    pending = set(name for name in found if name in relative_names) - selected
+    selected |= pending
+
+  logger.info('Extracted %d of %d files, which %s needs.', len(selected),
+              len(relative_names), binary_name)
+  return selected
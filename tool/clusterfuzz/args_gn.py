@@ -0,0 +1,143 @@
+"""Reads and writes the assignments of args.gn files."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import hashlib
+
+from clusterfuzz import common
+
+FINGERPRINT_LENGTH = 12
+ASSIGNMENT_PATTERN = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(.*)$',
+                                re.DOTALL)
+OPENING_BRACKETS = '([{'
+CLOSING_BRACKETS = ')]}'
+
+
+class ParseError(common.ExpectedException):
+  """An error for args.gn content that is not a list of assignments."""
+
+  def __init__(self, reason):
+    super(ParseError, self).__init__('Cannot parse the gn args: %s' % reason)
+
+
+def split_statements(content):
+  """Returns the statements of content without its comments. Statements end
+  at newlines that are outside of strings and brackets."""
+  statements = []
+  statement = []
+  depth = 0
+  in_string = False
+  escaped = False
+  index = 0
+  while index < len(content):
+    char = content[index]
+    if in_string:
+      statement.append(char)
+      if escaped:
+        escaped = False
+      elif char == '\\':
+        escaped = True
+      elif char == '"':
+        in_string = False
+    elif char == '"':
+      in_string = True
+      statement.append(char)
+    elif char == '#':
+      end = content.find('\n', index)
+      index = len(content) if end == -1 else end
+      continue
+    elif char == '\n' and depth == 0:
+      statements.append(''.join(statement))
+      statement = []
+    else:
+      if char in OPENING_BRACKETS:
+        depth += 1
+      elif char in CLOSING_BRACKETS:
+        depth -= 1
+      statement.append(char)
+    index += 1
+
+  if in_string or depth:
+    raise ParseError('unterminated string or bracket')
+  statements.append(''.join(statement))
+  return [s for s in statements if s.strip()]
+
+
+def normalize_value(value):
+  """Returns value with the whitespace outside of strings removed, a space
+  after each comma, and no trailing commas in lists."""
+  normalized = []
+  in_string = False
+  escaped = False
+  for char in value:
+    if in_string:
+      normalized.append(char)
+      if escaped:
+        escaped = False
+      elif char == '\\':
+        escaped = True
+      elif char == '"':
+        in_string = False
+    elif char == '"':
+      in_string = True
+      normalized.append(char)
+    elif char.isspace():
+      continue
+    elif char == ',':
+      normalized.append(', ')
+    else:
+      if char == ']' and normalized and normalized[-1] == ', ':
+        normalized.pop()
+      normalized.append(char)
+  return ''.join(normalized)
+
+
+def parse(content):
+  """Returns a dict of the names assigned in content to their values, which
+  are normalized so that equivalent content parses the same."""
+  args = {}
+  for statement in split_statements(content):
+    match = ASSIGNMENT_PATTERN.match(statement)
+    if not match:
+      raise ParseError('%r is not an assignment' % statement.strip())
+    value = normalize_value(match.group(2))
+    if not value:
+      raise ParseError('%s has no value' % match.group(1))
+    args[match.group(1)] = value
+  return args
+
+
+def serialize(args):
+  """Returns args.gn content that assigns args, sorted by name."""
+  return '\n'.join('%s = %s' % (name, value)
+                   for name, value in sorted(args.iteritems()))
+
+
+def fingerprint(args):
+  """Returns a short hash of args, which equivalent args share."""
+  return hashlib.sha1(serialize(args)).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def read(path):
+  """Returns the args of the args.gn at path, or None if it is missing or
+  cannot be parsed."""
+  if not os.path.isfile(path):
+    return None
+  with open(path) as f:
+    try:
+      return parse(f.read())
+    except ParseError:
+      return None
@@ -0,0 +1,202 @@
+"""Where builds and testcase files are fetched from.
+
+By default they come from Cloud Storage and ClusterFuzz. CF_ARTIFACT_STORE
+can point at a local directory (e.g. an NFS mount) or an HTTP mirror laid
+out like a bucket instead:
+
+  <store>/<bucket>/<path of the build archive>
+  <store>/testcases/<testcase id>/<testcase file>
+
+Whatever the store does not have is fetched from Cloud Storage and
+ClusterFuzz as usual."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import urlparse
+import logging
+
+from clusterfuzz import common
+from clusterfuzz import downloader
+
+CLUSTERFUZZ_TESTCASE_URL = (
+    'https://%s/v2/testcase-detail/download-testcase?id=%s' %
+    (common.DOMAIN_NAME, '%s'))
+STORE_ENV_VAR = 'CF_ARTIFACT_STORE'
+TESTCASES_DIR = 'testcases'
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_object_path(build_url):
+  """Returns the bucket/object path of a build URL."""
+  path = downloader.get_gcs_path(build_url)
+  if path is None:
+    path = urlparse.urlparse(build_url).path
+  return path.lstrip('/')
+
+
+class StoredArchive(object):
+  """A build archive that is already whole on disk, in the shape of a
+  downloader.Download."""
+
+  def __init__(self, path):
+    self.path = path
+    self.partial_path = path
+
+  def wait_for_tail(self):
+    pass
+
+  def wait_for(self, _):
+    pass
+
+  def wait(self):
+    return self.path
+
+  def close(self):
+    pass
+
+
+class ArtifactStore(object):
+  """Fetches builds and testcase files. Subclasses must implement all of
+  the methods."""
+
+  def start_build_download(self, build_url, saved_file):
+    """Starts fetching a build archive, to saved_file unless the store has
+    it on disk already. Returns a downloader.Download or StoredArchive."""
+    raise NotImplementedError
+
+  def open_build(self, build_url):
+    """Returns a seekable file of a build archive, which reads only what is
+    asked of it."""
+    raise NotImplementedError
+
+  def download_testcase(self, testcase_id, directory):
+    """Saves a testcase's file in the empty directory, and returns the
+    name it was saved under."""
+    raise NotImplementedError
+
+
+class RemoteStore(ArtifactStore):
+  """Fetches builds from Cloud Storage and testcases from ClusterFuzz."""
+
+  def start_build_download(self, build_url, saved_file):
+    """Downloads over HTTP, falling back to gsutil when that cannot be
+    started, e.g. because Cloud Storage refuses to serve the build that way
+    or cannot be reached."""
+    try:
+      return downloader.start_gcs_download(build_url, saved_file)
+    except downloader.DownloadError as e:
+      logger.info('%s. Downloading with gsutil instead.', e)
+    gsutil_path = build_url.replace(
+        'https://storage.cloud.google.com/', 'gs://')
+    common.execute(
+        'gsutil', 'cp %s .' % gsutil_path, os.path.dirname(saved_file))
+    return StoredArchive(saved_file)
+
+  def open_build(self, build_url):
+    return downloader.open_gcs_file(build_url)
+
+  def download_testcase(self, testcase_id, directory):
+    auth_header = common.get_stored_auth_header()
+    args = '--content-disposition --header="Authorization: %s" "%s"' % (
+        auth_header, CLUSTERFUZZ_TESTCASE_URL % testcase_id)
+    common.execute('wget', args, directory)
+    return os.listdir(directory)[0]
+
+
+class LocalStore(ArtifactStore):
+  """Reads builds and testcases from a directory, such as an NFS mount."""
+
+  def __init__(self, root):
+    self.root = root
+    self.remote = RemoteStore()
+
+  def get_build_path(self, build_url):
+    return os.path.join(self.root, get_object_path(build_url))
+
+  def start_build_download(self, build_url, saved_file):
+    """Extracts the stored archive where it is, without copying it."""
+    path = self.get_build_path(build_url)
+    if not os.path.isfile(path):
+      logger.info('%s is not in %s.', build_url, self.root)
+      return self.remote.start_build_download(build_url, saved_file)
+    logger.info('Using the build archive at %s.', path)
+    return StoredArchive(path)
+
+  def open_build(self, build_url):
+    path = self.get_build_path(build_url)
+    if not os.path.isfile(path):
+      return self.remote.open_build(build_url)
+    return open(path, 'rb')
+
+  def download_testcase(self, testcase_id, directory):
+    testcase_dir = os.path.join(self.root, TESTCASES_DIR, str(testcase_id))
+    filenames = (os.listdir(testcase_dir) if os.path.isdir(testcase_dir)
+                 else [])
+    if not filenames:
+      logger.info('Testcase %s is not in %s.', testcase_id, self.root)
+      return self.remote.download_testcase(testcase_id, directory)
+    shutil.copy(os.path.join(testcase_dir, filenames[0]), directory)
+    return filenames[0]
+
+
+class HttpMirrorStore(ArtifactStore):
+  """Fetches builds and testcases from a plain HTTP server."""
+
+  def __init__(self, base_url):
+    self.base_url = base_url.rstrip('/')
+    self.remote = RemoteStore()
+
+  def get_build_url(self, build_url):
+    return '%s/%s' % (self.base_url, get_object_path(build_url))
+
+  def start_build_download(self, build_url, saved_file):
+    try:
+      return downloader.Download(
+          self.get_build_url(build_url), saved_file).start()
+    except downloader.NotFoundError as e:
+      logger.info('%s. Downloading from Cloud Storage instead.', e)
+      return self.remote.start_build_download(build_url, saved_file)
+
+  def open_build(self, build_url):
+    try:
+      return downloader.RangeFile(self.get_build_url(build_url))
+    except downloader.NotFoundError:
+      return self.remote.open_build(build_url)
+
+  def download_testcase(self, testcase_id, directory):
+    returncode, _ = common.execute(
+        'wget', '--content-disposition "%s/%s/%s"' % (
+            self.base_url, TESTCASES_DIR, testcase_id),
+        directory, exit_on_error=False)
+    filenames = os.listdir(directory)
+    if returncode != 0 or not filenames:
+      logger.info('Testcase %s is not on %s.', testcase_id, self.base_url)
+      common.delete_if_exists(directory)
+      os.makedirs(directory)
+      return self.remote.download_testcase(testcase_id, directory)
+    return filenames[0]
+
+
+def get():
+  """Returns the store CF_ARTIFACT_STORE names, or the remote one."""
+  location = os.environ.get(STORE_ENV_VAR)
+  if not location or location == 'remote':
+    return RemoteStore()
+  if location.startswith(('http://', 'https://')):
+    return HttpMirrorStore(location)
+  if location.startswith('file://'):
+    location = location[len('file://'):]
+  return LocalStore(os.path.expanduser(location))
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import re
 import stat
 import multiprocessing
 import urllib
@@ -22,12 +23,37 @@ import sys
 import base64
 import string
 import logging
+import time
+import shutil
+import zipfile
+import tempfile
 import urlfetch
 
 from cmd_editor import editor
+from clusterfuzz import archive
+from clusterfuzz import args_gn
+from clusterfuzz import artifact_store
+from clusterfuzz import cache
 from clusterfuzz import common
-
-
+from clusterfuzz import downloader
+from clusterfuzz import ninja_log
+from clusterfuzz import resource_usage
+from clusterfuzz import stamps
+from clusterfuzz import tracing
+
+
+# Kept in a build directory that only has what the binary needs extracted.
+PARTIAL_BUILD_ARCHIVE = '.partial.zip'
+OUT_DIR_PATTERN = re.compile(
+    r'^clusterfuzz_[0-9a-f]+_([0-9a-f]{%d})(_dirty)?$' %
+    args_gn.FINGERPRINT_LENGTH)
+CLANG_UPDATE_SCRIPT = os.path.join('tools', 'clang', 'scripts', 'update.py')
+GOLD_PLUGIN_SCRIPT = os.path.join('build', 'download_gold_plugin.py')
+INSTALL_BUILD_DEPS_SCRIPT = os.path.join('build', 'install-build-deps.sh')
+LLVM_BUILD_DIR = os.path.join('third_party', 'llvm-build', 'Release+Asserts')
+GOLD_PLUGIN = os.path.join(LLVM_BUILD_DIR, 'lib', 'LLVMgold.so')
+RUNHOOKS_STEP = 'gclient_runhooks'
+MSAN_RUNHOOKS_STEP = 'gclient_runhooks_msan'
 logger = logging.getLogger('clusterfuzz')
 
 
@@ -41,15 +67,28 @@ def build_revision_to_sha_url(revision, repo):
               'repo': repo}))
 
 
-def sha_from_revision(revision, repo):
-  """Converts a chrome revision number to it corresponding git sha."""
+@tracing.traced(category='http')
+def fetch_sha_from_revision(revision, repo):
+  """Asks cr-rev for the git sha of a chrome revision number."""
 
   response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
   return json.loads(response.body)['git_sha']
 
 
-def get_pdfium_sha(chromium_sha):
-  """Gets the correct Pdfium sha using the Chromium sha."""
+def sha_from_revision(revision, repo):
+  """Converts a chrome revision number to it corresponding git sha. Once
+  resolved, a revision is looked up in the cache index instead."""
+  index = cache.get_index()
+  sha = index.get_revision_sha(repo, revision)
+  if sha is None:
+    sha = fetch_sha_from_revision(revision, repo)
+    index.add_revision_sha(repo, revision, sha)
+  return sha
+
+
+@tracing.traced(category='http')
+def fetch_pdfium_sha(chromium_sha):
+  """Reads the Pdfium sha from Chromium's DEPS at chromium_sha."""
   response = urlfetch.fetch(
       ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
        'format=TEXT' % chromium_sha))
@@ -60,6 +99,17 @@ def get_pdfium_sha(chromium_sha):
   return sha_line.strip()
 
 
+def get_pdfium_sha(chromium_sha):
+  """Gets the correct Pdfium sha using the Chromium sha, from the cache
+  index if it was read before."""
+  index = cache.get_index()
+  sha = index.get_dependency_sha(chromium_sha, 'pdfium')
+  if sha is None:
+    sha = fetch_pdfium_sha(chromium_sha)
+    index.add_dependency_sha(chromium_sha, 'pdfium', sha)
+  return sha
+
+
 def sha_exists(sha, source_dir):
   """Check if sha exists."""
   returncode, _ = common.execute(
@@ -67,6 +117,63 @@ def sha_exists(sha, source_dir):
   return returncode == 0
 
 
+class RepositoryState(object):
+  """What a git checkout has checked out. Each answer is asked of git once,
+  and asked again only after a checkout or fetch made through this object."""
+
+  def __init__(self, source_directory):
+    self.source_directory = source_directory
+    self.head = None
+    self.dirty = None
+    self.known_shas = set()
+
+  def invalidate(self):
+    self.head = None
+    self.dirty = None
+
+  def get_head(self):
+    """Returns the sha of HEAD."""
+    if self.head is None:
+      try:
+        _, head = common.execute(
+            'git', 'rev-parse HEAD', self.source_directory,
+            print_command=False, print_output=False)
+      except SystemExit:
+        logger.info(
+            'Error: The selected directory is not a valid git repository.')
+        raise
+      self.head = head.strip()
+    return self.head
+
+  def is_dirty(self):
+    """Returns whether tracked files differ from HEAD. Only exit statuses are
+    read, so that a large diff is never produced."""
+    if self.dirty is None:
+      # Files that were only touched would otherwise count as changed.
+      common.execute(
+          'git', 'update-index -q --refresh', self.source_directory,
+          print_command=False, print_output=False, exit_on_error=False)
+      returncode, _ = common.execute(
+          'git', 'diff-index --quiet HEAD --', self.source_directory,
+          print_command=False, print_output=False, exit_on_error=False)
+      self.dirty = returncode != 0
+    return self.dirty
+
+  def has_commit(self, sha):
+    if sha not in self.known_shas and sha_exists(sha, self.source_directory):
+      self.known_shas.add(sha)
+    return sha in self.known_shas
+
+  def fetch(self, sha):
+    common.execute('git', 'fetch origin %s' % sha, self.source_directory)
+    self.invalidate()
+    self.known_shas.add(sha)
+
+  def checkout(self, sha):
+    common.execute('git', 'checkout %s' % sha, self.source_directory)
+    self.invalidate()
+
+
 class BinaryProvider(object):
   """Downloads/builds and then provides the location of a binary."""
 
@@ -80,68 +187,179 @@ class BinaryProvider(object):
     """Get build directory. This method must be implemented by a subclass."""
     raise NotImplementedError
 
-  def download_build_data(self):
-    """Downloads a build and saves it locally."""
+  @tracing.traced
+  def download_build_data(self, needed_only=False):
+    """Downloads a build and saves it locally.
+
+    The build is extracted to a staging directory that is renamed to the
+    build directory once complete, so an existing build directory is always
+    whole. With needed_only, only what the binary needs is extracted, and the
+    archive is kept in the build directory for extract_remaining."""
 
     build_dir = self.build_dir_name()
     binary_location = os.path.join(build_dir, self.binary_name)
     if os.path.exists(build_dir):
+      if not needed_only and self.extract_remaining():
+        return build_dir
+      cache.use_build(self.build_url, build_dir, self.testcase_id)
       return build_dir
 
-    logger.info('Downloading build data...')
+    cache.evict()
     if not os.path.exists(common.CLUSTERFUZZ_BUILDS_DIR):
       os.makedirs(common.CLUSTERFUZZ_BUILDS_DIR)
 
-    gsutil_path = self.build_url.replace(
-        'https://storage.cloud.google.com/', 'gs://')
-    common.execute(
-        'gsutil', 'cp %s .' % gsutil_path, common.CLUSTERFUZZ_CACHE_DIR)
-
-    filename = os.path.split(gsutil_path)[1]
-    saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, filename)
+    saved_file = self.get_saved_file()
+    # Concurrent runs on the same build download it once.
+    with common.file_lock(saved_file + '.lock'):
+      if not os.path.exists(build_dir):
+        logger.info('Downloading build data...')
+        staging_dir = tempfile.mkdtemp(
+            prefix='.staging-', dir=common.CLUSTERFUZZ_BUILDS_DIR)
+        try:
+          archive_path = self.download_and_extract(
+              saved_file, staging_dir, needed_only)
+          partial_archive = os.path.join(staging_dir, PARTIAL_BUILD_ARCHIVE)
+          if needed_only and archive_path == saved_file:
+            os.rename(saved_file, partial_archive)
+          elif needed_only:
+            # The store keeps the archive on disk; there is no need to copy it.
+            os.symlink(archive_path, partial_archive)
+          elif archive_path == saved_file:
+            os.remove(saved_file)
+          os.chmod(staging_dir, 0755)
+          os.rename(staging_dir, build_dir)
+        finally:
+          logger.info('Cleaning up...')
+          shutil.rmtree(staging_dir, ignore_errors=True)
+        stats = os.stat(binary_location)
+        os.chmod(binary_location, stats.st_mode | stat.S_IEXEC)
+    cache.use_build(self.build_url, build_dir, self.testcase_id)
+
+  def extract_remaining(self):
+    """Extracts the rest of a build that was only partly extracted. Returns
+    whether there was anything left. Only downloaded binaries are ever
+    partly extracted."""
+    return False
+
+  def download_and_extract(self, saved_file, destination, needed_only=False):
+    """Fetches the build from the artifact store, to saved_file unless the
+    store has it on disk, and extracts it to destination as it arrives.
+    Returns the path of the archive."""
+    download = artifact_store.get().start_build_download(
+        self.build_url, saved_file)
+    if isinstance(download, artifact_store.StoredArchive):
+      self.extract_build(download.path, destination, needed_only)
+      return download.path
 
-    common.execute(
-        'unzip', '-q %s -d %s' % (saved_file, common.CLUSTERFUZZ_BUILDS_DIR),
-        cwd=common.CLUSTERFUZZ_DIR)
-
-    logger.info('Cleaning up...')
-    os.remove(saved_file)
-    os.rename(os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
-                           os.path.splitext(filename)[0]), build_dir)
-    stats = os.stat(binary_location)
-    os.chmod(binary_location, stats.st_mode | stat.S_IEXEC)
+    try:
+      download.wait_for_tail()
+      try:
+        self.extract_build(download.partial_path, destination, needed_only,
+                           wait_for=download.wait_for, show_progress=False)
+      except zipfile.BadZipfile:
+        # The archive's directory is bigger than the last chunk, so it can
+        # only be read once the download is complete.
+        download.wait()
+        self.extract_build(saved_file, destination, needed_only)
+        return saved_file
+      download.wait()
+    except BaseException:
+      download.close()
+      raise
+    return saved_file
+
+  def extract_build(self, archive_path, destination, needed_only, **kwargs):
+    """Extracts the build directory of the archive to destination."""
+    with resource_usage.in_process('unzip', 'extract %s' % archive_path):
+      if needed_only:
+        archive.extract_needed(archive_path, destination,
+                               self.get_archive_root(), self.binary_name,
+                               **kwargs)
+      else:
+        archive.extract(archive_path, destination,
+                        root=self.get_archive_root(), **kwargs)
+
+  def get_saved_file(self):
+    return os.path.join(common.CLUSTERFUZZ_CACHE_DIR,
+                        os.path.basename(self.build_url))
+
+  def get_archive_root(self):
+    """Returns the directory of the archive that holds the build."""
+    return os.path.splitext(os.path.basename(self.build_url))[0]
+
+  def read_remote_build_files(self, names):
+    """Returns the contents of the named files of the build, fetching only
+    the archive's directory and those files."""
+    remote_file = artifact_store.get().open_build(self.build_url)
+    try:
+      zipped = zipfile.ZipFile(remote_file)
+      contents = dict(
+          (name, zipped.read('%s/%s' % (self.get_archive_root(), name)))
+          for name in names)
+    finally:
+      remote_file.close()
+    logger.info('Read %s from the build archive.', ', '.join(names))
+    return contents
 
   def get_binary_path(self):
     return '%s/%s' % (self.get_build_directory(), self.binary_name)
 
   def build_dir_name(self):
-    """Returns a build number's respective directory."""
+    """Returns the directory of the build. Testcases crashing on the same
+    build archive share it."""
     return os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
-                        str(self.testcase_id) + '_build')
+                        cache.get_build_key(self.build_url) + '_build')
 
 
 class DownloadedBinary(BinaryProvider):
   """Uses a downloaded binary."""
 
+  def __init__(self, testcase_id, build_url, binary_name, needed_only=False):
+    super(DownloadedBinary, self).__init__(testcase_id, build_url, binary_name)
+    self.needed_only = needed_only
+
+  @tracing.traced
   def get_build_directory(self):
     """Returns the location of the correct build to use for reproduction."""
 
     if self.build_directory:
       return self.build_directory
 
-    self.download_build_data()
+    self.download_build_data(self.needed_only)
     # We need the source dir so we can use asan_symbolize.py from the
     # chromium source directory.
     self.source_directory = common.get_source_directory('chromium')
     self.build_directory = self.build_dir_name()
     return self.build_directory
 
+  def extract_remaining(self):
+    """Extracts the rest of a build that download_build_data only extracted
+    what the binary needs of. Returns whether there was anything left."""
+    build_dir = self.build_dir_name()
+    archive_path = os.path.join(build_dir, PARTIAL_BUILD_ARCHIVE)
+    if not os.path.exists(archive_path):
+      return False
+
+    with common.file_lock(self.get_saved_file() + '.lock'):
+      if not os.path.exists(archive_path):
+        return False
+      logger.info('Extracting the rest of the build...')
+      with resource_usage.in_process('unzip', 'extract %s' % archive_path):
+        archive.extract(archive_path, build_dir, root=self.get_archive_root())
+      os.remove(archive_path)
+    cache.use_build(self.build_url, build_dir, self.testcase_id, update=True)
+    return True
+
 
 class GenericBuilder(BinaryProvider):
   """Provides a base for binary builders."""
 
+  # Whether the hooks are re-run to fetch the MSan instrumented libraries.
+  MSAN_HOOKS = False
+
   def __init__(self, testcase_id, build_url, revision, current, goma_dir,
-               source, binary_name, target, goma_threads, edit_mode):
+               source, binary_name, target, goma_threads, edit_mode,
+               gn_check=False, force_sync=False):
     """self.git_sha must be set in a subclass, or some of these
     instance methods may not work."""
     super(GenericBuilder, self).__init__(testcase_id, build_url, binary_name)
@@ -151,80 +369,97 @@ class GenericBuilder(BinaryProvider):
     self.source_directory = source
     self.revision = revision
     self.gn_args = None
+    self.final_gn_args = None
     self.gn_args_options = None
-    self.gn_flags = '--check'
+    self.gn_check = gn_check
+    self.force_sync = force_sync
     self.goma_threads = goma_threads
     self.edit_mode = edit_mode
+    self.repository = None
+
+  def get_repository(self):
+    """Returns the state of the checkout in the source directory."""
+    if (not self.repository or
+        self.repository.source_directory != self.source_directory):
+      self.repository = RepositoryState(self.source_directory)
+    return self.repository
 
   def get_current_sha(self):
-    try:
-      _, current_sha = common.execute(
-          'git', 'rev-parse HEAD', self.source_directory, print_command=False,
-          print_output=False)
-    except SystemExit:
-      logger.info(
-          'Error: The selected directory is not a valid git repository.')
-      raise
-    return current_sha.strip()
+    return self.get_repository().get_head()
 
   def source_dir_is_dirty(self):
     """Returns true if the source dir has uncommitted changes."""
-
-    _, diff_result = common.execute(
-        'git', 'diff', self.source_directory, print_command=False,
-        print_output=False)
-    return bool(diff_result)
+    return self.get_repository().is_dirty()
 
   def out_dir_name(self):
     """Returns the correct out dir in which to build the revision.
 
-    Directory name is of the format clusterfuzz_<testcase_id>_<git_sha>,
-    with a possible '_dirty' on the end. Based on the current git sha, and
-    whether changes have been made to the repo."""
+    Directory name is of the format clusterfuzz_<git_sha>_<fingerprint>,
+    with a possible '_dirty' on the end. Based on the current git sha, the
+    gn args to build with, and whether changes have been made to the repo.
+    Testcases that build the same revision with the same args share it."""
 
     dir_name = os.path.join(self.source_directory, 'out',
-                            'clusterfuzz_%s_%s' % (str(self.testcase_id),
-                                                   self.get_current_sha()))
+                            'clusterfuzz_%s_%s' % (
+                                self.get_current_sha(),
+                                self.get_gn_args_fingerprint()))
     if self.source_dir_is_dirty():
       dir_name += '_dirty'
     return dir_name
 
 
+  def find_seed_out_dir(self):
+    """Returns the most recently built other out dir with the same gn args
+    as the build directory, or None."""
+    out_dir, name = os.path.split(self.build_directory)
+    if not os.path.isdir(out_dir):
+      return None
+
+    fingerprint = self.get_gn_args_fingerprint()
+    candidates = []
+    for other_name in os.listdir(out_dir):
+      match = OUT_DIR_PATTERN.match(other_name)
+      log_path = os.path.join(out_dir, other_name, ninja_log.NINJA_LOG_NAME)
+      if (other_name != name and match and match.group(1) == fingerprint and
+          os.path.isfile(log_path)):
+        candidates.append((os.path.getmtime(log_path), other_name))
+    if not candidates:
+      return None
+    return os.path.join(out_dir, max(candidates)[1])
+
+  @tracing.traced
+  def seed_build_directory(self):
+    """Starts a new build directory as a clone of the closest existing one,
+    so that ninja only rebuilds what changed since."""
+    seed_dir = self.find_seed_out_dir()
+    if not seed_dir:
+      return
+    logger.info('Starting %s from %s.', self.build_directory, seed_dir)
+    method = common.clone_directory(seed_dir, self.build_directory)
+    if not method:
+      logger.info('Cannot copy %s. Building from scratch instead.', seed_dir)
+      return
+    logger.debug('Cloned %s with %s.', seed_dir, method)
+
+  @tracing.traced
   def checkout_source_by_sha(self):
     """Checks out the correct revision."""
 
     if self.get_current_sha() == self.git_sha:
       return
 
-    if not sha_exists(self.git_sha, self.source_directory):
-      common.execute(
-          'git', 'fetch origin %s' % self.git_sha, self.source_directory)
+    repository = self.get_repository()
+    if not repository.has_commit(self.git_sha):
+      repository.fetch(self.git_sha)
 
-    binary = 'git'
-    args = 'checkout %s' % self.git_sha
     common.check_confirm(
         'Proceed with the following command:\n'
-        '%s %s in %s?' % (binary, args, self.source_directory))
+        'git checkout %s in %s?' % (self.git_sha, self.source_directory))
     if self.source_dir_is_dirty():
       logger.info('Your source directory has uncommitted changes: please'
                   'commit or stash these changes and re-run this tool.')
       sys.exit(1)
-    common.execute(binary, args, self.source_directory)
-
-  def deserialize_gn_args(self, args):
-    """Convert gn args into a dict."""
-
-    args_hash = {}
-    for line in args.splitlines():
-      key, val = line.split('=')
-      args_hash[key.strip()] = val.strip()
-    return args_hash
-
-  def serialize_gn_args(self, args_hash):
-    args = []
-    for key, val in sorted(args_hash.iteritems()):
-      args.append('%s = %s' % (key, val))
-    return '\n'.join(args)
+    repository.checkout(self.git_sha)
 
   def setup_gn_goma_params(self, gn_args):
     """Ensures that goma_dir and gn_goma are used correctly."""
@@ -238,48 +473,84 @@ class GenericBuilder(BinaryProvider):
       gn_args['goma_dir'] = '"%s"' % self.goma_dir
     return gn_args
 
-  def setup_gn_args(self):
-    """Ensures that args.gn is set up properly."""
-    # Remove existing gn file from build directory.
-    args_gn_path = os.path.join(self.build_directory, 'args.gn')
-    if os.path.isfile(args_gn_path):
-      os.remove(args_gn_path)
-
-    # Create build directory if it does not already exist.
-    if not os.path.exists(self.build_directory):
-      os.makedirs(self.build_directory)
+  def get_gn_args(self):
+    """Returns the content of the args.gn to build with. It is worked out,
+    and edited in edit mode, only once."""
+    if self.final_gn_args is not None:
+      return self.final_gn_args
 
-    # If no args.gn file is found, get it from downloaded build.
+    # If no args.gn file is found, get it from the ClusterFuzz build.
     if self.gn_args:
       gn_args = self.gn_args
     else:
-      args_gn_downloaded_build_path = os.path.join(
-          self.build_dir_name(), 'args.gn')
-      with open(args_gn_downloaded_build_path, 'r') as f:
-        gn_args = f.read()
+      gn_args = self.get_build_gn_args()
 
     # Add additional options to existing gn args.
-    args_hash = self.deserialize_gn_args(gn_args)
+    args_hash = args_gn.parse(gn_args)
     args_hash = self.setup_gn_goma_params(args_hash)
     if self.gn_args_options:
       for k, v in self.gn_args_options.iteritems():
         args_hash[k] = v
 
     # Let users edit the current args.
-    content = self.serialize_gn_args(args_hash)
+    content = args_gn.serialize(args_hash)
     if self.edit_mode:
       content = editor.edit(
           content, prefix='edit-args-gn-',
           comment='Edit args.gn before building.')
+    self.final_gn_args = content
+    return content
+
+  def get_gn_args_fingerprint(self):
+    """Returns a short hash of the gn args to build with, which does not
+    depend on their order, spacing or comments."""
+    return args_gn.fingerprint(args_gn.parse(self.get_gn_args()))
+
+  def setup_gn_args(self):
+    """Ensures that args.gn is set up properly. gn gen only runs when the
+    build directory was generated with other args, or to check includes."""
+    content = self.get_gn_args()
+    self.gn_args = content
+
+    args_gn_path = os.path.join(self.build_directory, 'args.gn')
+    # ninja re-runs gn itself when build files change since.
+    if (not self.gn_check and
+        os.path.isfile(os.path.join(self.build_directory, 'build.ninja')) and
+        args_gn.read(args_gn_path) == args_gn.parse(content)):
+      logger.info('The gn args of %s are unchanged.', self.build_directory)
+      return
+
+    # Remove existing gn file from build directory.
+    if os.path.isfile(args_gn_path):
+      os.remove(args_gn_path)
+
+    # Create build directory if it does not already exist.
+    if not os.path.exists(self.build_directory):
+      os.makedirs(self.build_directory)
 
     # Write args to file and store.
     with open(args_gn_path, 'w') as f:
       f.write(content)
-    self.gn_args = content
 
-    common.execute('gn', 'gen %s %s' % (self.gn_flags, self.build_directory),
+    flags = '--check ' if self.gn_check else ''
+    common.execute('gn', 'gen %s%s' % (flags, self.build_directory),
                    self.source_directory)
 
+  def get_build_gn_args(self):
+    """Returns the args.gn of the ClusterFuzz build. Unless the build is
+    downloaded already, only that file is read from the remote archive, and
+    the build is only downloaded if the archive cannot be read in parts."""
+    build_dir = self.build_dir_name()
+    if not os.path.exists(build_dir):
+      try:
+        return self.read_remote_build_files(['args.gn'])['args.gn']
+      except (downloader.DownloadError, zipfile.BadZipfile, KeyError) as e:
+        logger.info('Cannot read args.gn from the build archive (%s). '
+                    'Downloading the build instead.', e)
+        self.download_build_data()
+    with open(os.path.join(build_dir, 'args.gn'), 'r') as f:
+      return f.read()
+
   def pre_build_steps(self):
     """Steps to be run before the target is built."""
 
@@ -294,31 +565,138 @@ class GenericBuilder(BinaryProvider):
       cpu_count = multiprocessing.cpu_count()
       return 50 * cpu_count if self.goma_dir else (3 * cpu_count) / 4
 
+  def find_gclient_file(self):
+    """Returns the .gclient file of the checkout the source directory is in,
+    or None."""
+    directory = os.path.abspath(self.source_directory)
+    while True:
+      path = os.path.join(directory, '.gclient')
+      if os.path.isfile(path):
+        return path
+      parent = os.path.dirname(directory)
+      if parent == directory:
+        return None
+      directory = parent
+
+  def get_sync_inputs(self):
+    """Returns what gclient sync syncs the dependencies to."""
+    gclient_file = self.find_gclient_file()
+    return {
+        'sha': self.get_current_sha(),
+        'deps': stamps.hash_file(os.path.join(self.source_directory, 'DEPS')),
+        'gclient': stamps.hash_file(gclient_file) if gclient_file else None}
+
+  def sync(self):
+    """Runs gclient sync, unless it last ran with the same revision, DEPS and
+    .gclient, or is forced to."""
+    stamps.run(
+        'gclient_sync', self.source_directory, self.get_sync_inputs(),
+        lambda: common.execute('gclient', 'sync', self.source_directory),
+        force=self.force_sync)
+
+  def run_stamped(self, step, inputs, fn, outputs=()):
+    """Runs fn in the source directory, unless step last ran with the same
+    inputs, or was forced to."""
+    stamps.run(step, self.source_directory, inputs, fn, force=self.force_sync,
+               outputs=[os.path.join(self.source_directory, output)
+                        for output in outputs])
+
+  def hash_source_file(self, path):
+    return stamps.hash_file(os.path.join(self.source_directory, path))
+
+  def get_msan_gyp_defines(self):
+    """Returns the GYP_DEFINES that fetch the MSan instrumented libraries,
+    or None if the build does not need them."""
+    if not self.MSAN_HOOKS:
+      return None
+    args_hash = args_gn.parse(self.get_gn_args())
+    msan_track_origins_value = (int(args_hash['msan_track_origins'])
+                                if 'msan_track_origins' in args_hash
+                                else 2)
+    return ('msan=1 msan_track_origins=%d '
+            'use_prebuilt_instrumented_libraries=1' % msan_track_origins_value)
+
+  def run_hooks(self):
+    """Runs gclient runhooks, unless it last ran with the same revision,
+    DEPS, .gclient and GYP_DEFINES, for a build that does or does not re-run
+    them for MSan like this one."""
+    inputs = self.get_sync_inputs()
+    inputs['gyp_defines'] = os.environ.get('GYP_DEFINES')
+    # Both kinds of builds rewrite the same hook outputs, so switching kinds
+    # must run the hooks again.
+    inputs['msan_gyp_defines'] = self.get_msan_gyp_defines()
+
+    def run():
+      # It undoes what runhooks with MSan's GYP_DEFINES did.
+      stamps.clear(MSAN_RUNHOOKS_STEP, self.source_directory)
+      common.execute('gclient', 'runhooks', self.source_directory)
+    self.run_stamped(RUNHOOKS_STEP, inputs, run)
+
+  def run_msan_hooks(self):
+    """Re-runs the hooks with the GYP_DEFINES that fetch the MSan
+    instrumented libraries, unless they last ran with the same inputs."""
+    gyp_defines = self.get_msan_gyp_defines()
+    inputs = self.get_sync_inputs()
+    inputs['gyp_defines'] = gyp_defines
+    self.run_stamped(
+        MSAN_RUNHOOKS_STEP, inputs,
+        lambda: common.execute('gclient', 'runhooks', self.source_directory,
+                               env={'GYP_DEFINES': gyp_defines}))
+
+  def update_clang(self):
+    """Updates clang, unless update.py, which pins its revision, is the same
+    as when it last ran and the toolchain is still there."""
+    self.run_stamped(
+        'clang_update', {'script': self.hash_source_file(CLANG_UPDATE_SCRIPT)},
+        lambda: common.execute('python', CLANG_UPDATE_SCRIPT,
+                               self.source_directory),
+        outputs=[LLVM_BUILD_DIR])
+
+  def download_gold_plugin(self):
+    """Downloads the gold plugin, unless its script is the same as when it
+    last ran and the plugin is still there."""
+    self.run_stamped(
+        'gold_plugin', {'script': self.hash_source_file(GOLD_PLUGIN_SCRIPT)},
+        lambda: common.execute(GOLD_PLUGIN_SCRIPT, '', self.source_directory),
+        outputs=[GOLD_PLUGIN])
+
+  def install_32bit_build_deps(self):
+    """Installs the 32-bit libraries, unless install-build-deps.sh is the
+    same as when it last ran."""
+    args = '--lib32 --syms --no-prompt'
+    self.run_stamped(
+        'install_build_deps',
+        {'script': self.hash_source_file(INSTALL_BUILD_DEPS_SCRIPT),
+         'args': args},
+        lambda: common.execute_with_shell(INSTALL_BUILD_DEPS_SCRIPT, args,
+                                          self.source_directory))
+
+  @tracing.traced
   def build_target(self):
     """Build the correct revision in the source directory."""
     # Note: gclient sync must be run before setting up the gn args.
-    common.execute('gclient', 'sync', self.source_directory)
+    self.sync()
 
-    self.pre_build_steps()
-    self.setup_gn_args()
+    with tracing.span('pre_build_steps'):
+      self.pre_build_steps()
+    with tracing.span('setup_gn_args'):
+      self.setup_gn_args()
     goma_cores = self.get_goma_cores()
+    start_time = time.time()
     common.execute(
         'ninja',
         "-w 'dupbuild=err' -C %s -j %i -l 15 %s" % (
             self.build_directory, goma_cores, self.target),
         self.source_directory, capture_output=False)
+    ninja_log.report(self.build_directory, goma_cores, start_time)
 
+  @tracing.traced
   def get_build_directory(self):
     """Returns the location of the correct build to use for reproduction."""
 
     if self.build_directory:
       return self.build_directory
 
-    if not self.gn_args:
-      self.download_build_data()
-
-    self.build_directory = self.build_dir_name()
-
     if not self.source_directory:
       self.source_directory = common.get_source_directory(self.name)
 
@@ -326,6 +704,8 @@ class GenericBuilder(BinaryProvider):
       self.checkout_source_by_sha()
 
     self.build_directory = self.out_dir_name()
+    if not os.path.exists(self.build_directory):
+      self.seed_build_directory()
     self.build_target()
 
     return self.build_directory
@@ -335,43 +715,41 @@ class PdfiumBuilder(GenericBuilder):
   """Build a fresh Pdfium binary."""
 
   def __init__(self, testcase, binary_definition, current, goma_dir,
-               goma_threads, edit_mode):
+               goma_threads, edit_mode, gn_check=False, force_sync=False):
     super(PdfiumBuilder, self).__init__(
         testcase.id, testcase.build_url, testcase.revision, current,
         goma_dir, os.environ.get(binary_definition.source_var), 'pdfium_test',
-        None, goma_threads, edit_mode)
+        None, goma_threads, edit_mode, gn_check, force_sync)
     self.chromium_sha = sha_from_revision(self.revision, 'chromium/src')
     self.name = 'Pdfium'
     self.git_sha = get_pdfium_sha(self.chromium_sha)
     self.gn_args = testcase.gn_args
     self.gn_args_options = {'pdf_is_standalone': 'true'}
-    self.gn_flags = ''
 
 
 class V8Builder(GenericBuilder):
   """Builds a fresh v8 binary."""
 
   def __init__(self, testcase, binary_definition, current, goma_dir,
-               goma_threads, edit_mode):
+               goma_threads, edit_mode, gn_check=False, force_sync=False):
     super(V8Builder, self).__init__(
         testcase.id, testcase.build_url, testcase.revision, current, goma_dir,
         os.environ.get(binary_definition.source_var), 'd8', None, goma_threads,
-        edit_mode)
+        edit_mode, gn_check, force_sync)
     self.git_sha = sha_from_revision(self.revision, 'v8/v8')
     self.gn_args = testcase.gn_args
     self.name = 'V8'
 
   def pre_build_steps(self):
-    common.execute('gclient', 'runhooks', self.source_directory)
+    self.run_hooks()
     if not self.current:
-      common.execute('python', 'tools/clang/scripts/update.py',
-                     self.source_directory)
+      self.update_clang()
 
 class ChromiumBuilder(GenericBuilder):
   """Builds a specific target from inside a Chromium source repository."""
 
   def __init__(self, testcase, binary_definition, current, goma_dir,
-               goma_threads, edit_mode):
+               goma_threads, edit_mode, gn_check=False, force_sync=False):
     target_name = None
     binary_name = binary_definition.binary_name
     if binary_definition.target:
@@ -381,16 +759,15 @@ class ChromiumBuilder(GenericBuilder):
     super(ChromiumBuilder, self).__init__(
         testcase.id, testcase.build_url, testcase.revision, current,
         goma_dir, os.environ.get(binary_definition.source_var), binary_name,
-        target_name, goma_threads, edit_mode)
+        target_name, goma_threads, edit_mode, gn_check, force_sync)
     self.git_sha = sha_from_revision(self.revision, 'chromium/src')
     self.gn_args = testcase.gn_args
     self.name = 'chromium'
 
   def pre_build_steps(self):
-    common.execute('gclient', 'runhooks', self.source_directory)
+    self.run_hooks()
     if not self.current:
-      common.execute('python', 'tools/clang/scripts/update.py',
-                     self.source_directory)
+      self.update_clang()
 
 
 class CfiChromiumBuilder(ChromiumBuilder):
@@ -399,43 +776,31 @@ class CfiChromiumBuilder(ChromiumBuilder):
   def pre_build_steps(self):
     """Run the pre-build steps and then run download_gold_plugin.py."""
     super(CfiChromiumBuilder, self).pre_build_steps()
-    common.execute('build/download_gold_plugin.py', '', self.source_directory)
+    self.download_gold_plugin()
 
 
 class MsanChromiumBuilder(ChromiumBuilder):
   """Build a MSAN chromium build."""
 
+  MSAN_HOOKS = True
+
   def setup_gn_args(self):
     """Run the setup_gn_args and re-run hooks with special GYP_DEFINES."""
     super(MsanChromiumBuilder, self).setup_gn_args()
 
-    args_hash = self.deserialize_gn_args(self.gn_args)
-    msan_track_origins_value = (int(args_hash['msan_track_origins'])
-                                if 'msan_track_origins' in args_hash
-                                else 2)
-    common.execute('gclient', 'runhooks', self.source_directory,
-                   env={'GYP_DEFINES':
-                        ('msan=1 msan_track_origins=%d '
-                         'use_prebuilt_instrumented_libraries=1') %
-                        msan_track_origins_value})
+    self.run_msan_hooks()
 
 
 class MsanV8Builder(V8Builder):
   """Build a MSAN V8 build."""
 
+  MSAN_HOOKS = True
+
   def setup_gn_args(self):
     """Run the setup_gn_args and re-run hooks with special GYP_DEFINES."""
     super(MsanV8Builder, self).setup_gn_args()
 
-    args_hash = self.deserialize_gn_args(self.gn_args)
-    msan_track_origins_value = (int(args_hash['msan_track_origins'])
-                                if 'msan_track_origins' in args_hash
-                                else 2)
-    common.execute('gclient', 'runhooks', self.source_directory,
-                   env={'GYP_DEFINES':
-                        ('msan=1 msan_track_origins=%d '
-                         'use_prebuilt_instrumented_libraries=1') %
-                        msan_track_origins_value})
+    self.run_msan_hooks()
 
 
 class ChromiumBuilder32Bit(ChromiumBuilder):
@@ -444,9 +809,7 @@ class ChromiumBuilder32Bit(ChromiumBuilder):
   def pre_build_steps(self):
     """Run the pre-build steps and then install 32-bit libraries."""
     super(ChromiumBuilder32Bit, self).pre_build_steps()
-    common.execute_with_shell('build/install-build-deps.sh',
-                              '--lib32 --syms --no-prompt',
-                              self.source_directory)
+    self.install_32bit_build_deps()
 
 class V8Builder32Bit(V8Builder):
   """Build a 32-bit V8 build."""
@@ -454,6 +817,4 @@ class V8Builder32Bit(V8Builder):
   def pre_build_steps(self):
     """Run the pre-build steps and then install 32-bit libraries."""
     super(V8Builder32Bit, self).pre_build_steps()
-    common.execute_with_shell('build/install-build-deps.sh',
-                              '--lib32 --syms --no-prompt',
-                              self.source_directory)
+    self.install_32bit_build_deps()
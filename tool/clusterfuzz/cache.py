@@ -0,0 +1,437 @@
+"""Keeps an index of the builds and testcases in the cache, so that testcases
+can share builds and the cache can be kept under a disk budget without ever
+removing something that is in use."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import errno
+import time
+import atexit
+import shutil
+import hashlib
+import logging
+import sqlite3
+import threading
+import contextlib
+
+from clusterfuzz import common
+from clusterfuzz import resource_usage
+
+INDEX_FILE_PATH = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'index.sqlite')
+LOCK_TIMEOUT = 60
+BUDGET_ENV_VAR = 'CF_CACHE_BUDGET'
+DEFAULT_BUDGET = 100 * 1024 ** 3
+# Untracked files younger than this may belong to a download in progress.
+UNTRACKED_MIN_AGE = 24 * 60 * 60
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+              'T': 1024 ** 4}
+BUILD = 'build'
+TESTCASE = 'testcase'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  key TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  path TEXT NOT NULL,
+  source TEXT,
+  size INTEGER NOT NULL,
+  created REAL NOT NULL,
+  last_used REAL NOT NULL,
+  pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS testcases (
+  key TEXT NOT NULL,
+  testcase_id TEXT NOT NULL,
+  PRIMARY KEY (key, testcase_id)
+);
+CREATE TABLE IF NOT EXISTS users (
+  key TEXT NOT NULL,
+  pid INTEGER NOT NULL,
+  PRIMARY KEY (key, pid)
+);
+CREATE TABLE IF NOT EXISTS revision_shas (
+  repo TEXT NOT NULL,
+  revision TEXT NOT NULL,
+  sha TEXT NOT NULL,
+  PRIMARY KEY (repo, revision)
+);
+CREATE TABLE IF NOT EXISTS dependency_shas (
+  sha TEXT NOT NULL,
+  dependency TEXT NOT NULL,
+  dependency_sha TEXT NOT NULL,
+  PRIMARY KEY (sha, dependency)
+);
+"""
+logger = logging.getLogger('clusterfuzz')
+
+index_lock = threading.Lock()
+index = None
+
+
+class InvalidSizeError(common.ExpectedException):
+  """An error for sizes that cannot be parsed."""
+
+  def __init__(self, size):
+    super(InvalidSizeError, self).__init__(
+        'Invalid size: %s. Use a number of bytes, optionally followed by K, '
+        'M, G or T.' % size)
+
+
+def get_build_key(build_url):
+  """Returns the key of the build archive at build_url. Archives are never
+  overwritten, so the URL identifies the content."""
+  return hashlib.sha1(build_url).hexdigest()
+
+
+def get_testcase_key(testcase_id):
+  return '%s_testcase' % testcase_id
+
+
+def parse_size(size):
+  """Converts a size like 20G to a number of bytes."""
+  match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(size),
+                   re.IGNORECASE)
+  if not match:
+    raise InvalidSizeError(size)
+  return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def get_budget():
+  """Returns the number of bytes the cache may use."""
+  budget = os.environ.get(BUDGET_ENV_VAR)
+  return parse_size(budget) if budget else DEFAULT_BUDGET
+
+
+def get_size(path):
+  """Returns the disk usage of the files under path, in bytes."""
+  if not os.path.isdir(path):
+    return os.lstat(path).st_size if os.path.lexists(path) else 0
+  size = 0
+  for root, _, files in os.walk(path):
+    for name in files:
+      try:
+        size += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        continue
+  return size
+
+
+def delete_path(path):
+  """Deletes a file or a directory tree, if it exists."""
+  if os.path.isdir(path) and not os.path.islink(path):
+    shutil.rmtree(path, ignore_errors=True)
+  elif os.path.lexists(path):
+    os.remove(path)
+
+
+def is_running(pid):
+  """Returns whether the process pid is still alive."""
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno == errno.EPERM
+  return True
+
+
+class Entry(object):
+  """Something in the cache, along with who uses it."""
+
+  def __init__(self, key, kind, path, source, size, created, last_used,
+               pinned, testcase_ids=None, users=None):
+    self.key = key
+    self.kind = kind
+    self.path = path
+    self.source = source
+    self.size = size
+    self.created = created
+    self.last_used = last_used
+    self.pinned = bool(pinned)
+    self.testcase_ids = testcase_ids or []
+    self.users = users or []
+
+  @property
+  def refcount(self):
+    """The number of running processes that use the entry."""
+    return len(self.users)
+
+
+class CacheIndex(object):
+  """The index of the cache, stored in an SQLite database so that concurrent
+  runs of the tool see each other's changes."""
+
+  def __init__(self, path=INDEX_FILE_PATH):
+    if not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    self.path = path
+    # Transactions are started explicitly, see transaction().
+    self.connection = sqlite3.connect(
+        path, timeout=LOCK_TIMEOUT, isolation_level=None,
+        check_same_thread=False)
+    self.connection.executescript(SCHEMA)
+    self.lock = threading.Lock()
+    self.acquired = set()
+
+  @contextlib.contextmanager
+  def transaction(self):
+    """Holds the database's write lock for the block, so that checking and
+    changing the index is atomic across processes."""
+    with self.lock:
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+        yield self.connection
+      except BaseException:  # pylint: disable=broad-except
+        self.connection.execute('ROLLBACK')
+        raise
+      self.connection.execute('COMMIT')
+
+  def execute(self, query, params=()):
+    """Runs query in its own transaction and returns the rows it selected."""
+    with self.transaction() as connection:
+      return connection.execute(query, params).fetchall()
+
+  def add(self, key, kind, path, source=None, size=0):
+    """Adds an entry, or updates it if it is already known. Being pinned and
+    the creation time survive updates."""
+    now = time.time()
+    self.execute(
+        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, '
+        'COALESCE((SELECT created FROM entries WHERE key = ?), ?), ?, '
+        'COALESCE((SELECT pinned FROM entries WHERE key = ?), 0))',
+        (key, kind, path, source, size, key, now, now, key))
+
+  def get(self, key):
+    """Returns the entry for key, or None if it is not known."""
+    rows = self.execute('SELECT * FROM entries WHERE key = ?', (key,))
+    if not rows:
+      return None
+    testcase_ids = [row[0] for row in self.execute(
+        'SELECT testcase_id FROM testcases WHERE key = ? ORDER BY testcase_id',
+        (key,))]
+    return Entry(*rows[0], testcase_ids=testcase_ids,
+                 users=self.get_users(key))
+
+  def get_all(self, kind=None):
+    """Returns every entry, or every entry of a kind, least recently used
+    first."""
+    if kind:
+      rows = self.execute('SELECT key FROM entries WHERE kind = ? '
+                          'ORDER BY last_used', (kind,))
+    else:
+      rows = self.execute('SELECT key FROM entries ORDER BY last_used')
+    return [entry for entry in (self.get(key) for key, in rows) if entry]
+
+  def find(self, key_or_testcase_id):
+    """Returns the entries with a key starting with key_or_testcase_id, or
+    that the testcase with that ID uses."""
+    keys = [key for key, in self.execute(
+        'SELECT key FROM entries WHERE substr(key, 1, length(?)) = ? UNION '
+        'SELECT key FROM testcases WHERE testcase_id = ?',
+        (key_or_testcase_id,) * 3)]
+    return [entry for entry in (self.get(key) for key in sorted(keys))
+            if entry]
+
+  def get_total_size(self):
+    return self.execute('SELECT COALESCE(SUM(size), 0) FROM entries')[0][0]
+
+  def touch(self, key):
+    """Marks an entry as used now."""
+    self.execute('UPDATE entries SET last_used = ? WHERE key = ?',
+                 (time.time(), key))
+
+  def set_pinned(self, key, pinned):
+    """Pinned entries are never evicted."""
+    self.execute('UPDATE entries SET pinned = ? WHERE key = ?',
+                 (int(pinned), key))
+
+  def add_testcase(self, key, testcase_id):
+    """Records that a testcase resolves to the entry."""
+    self.execute('INSERT OR IGNORE INTO testcases VALUES (?, ?)',
+                 (key, str(testcase_id)))
+
+  def acquire(self, key):
+    """Counts this process as a user of the entry until it exits."""
+    self.execute('INSERT OR IGNORE INTO users VALUES (?, ?)',
+                 (key, os.getpid()))
+    self.acquired.add(key)
+
+  def release(self, key):
+    """Stops counting this process as a user of the entry."""
+    self.execute('DELETE FROM users WHERE key = ? AND pid = ?',
+                 (key, os.getpid()))
+    self.acquired.discard(key)
+
+  def release_all(self):
+    for key in list(self.acquired):
+      self.release(key)
+
+  def get_users(self, key):
+    """Returns the pids of the running processes using the entry. Processes
+    that died without releasing it are forgotten."""
+    with self.transaction() as connection:
+      return self._get_users(connection, key)
+
+  def _get_users(self, connection, key):
+    running = []
+    for pid, in connection.execute(
+        'SELECT pid FROM users WHERE key = ?', (key,)).fetchall():
+      if is_running(pid):
+        running.append(pid)
+      else:
+        connection.execute('DELETE FROM users WHERE key = ? AND pid = ?',
+                           (key, pid))
+    return running
+
+  def remove(self, key):
+    """Forgets an entry. Removing its files is up to the caller."""
+    with self.transaction() as connection:
+      self._remove(connection, key)
+
+  def _remove(self, connection, key):
+    connection.execute('DELETE FROM users WHERE key = ?', (key,))
+    connection.execute('DELETE FROM testcases WHERE key = ?', (key,))
+    connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+  def remove_if_unused(self, key):
+    """Forgets an entry and moves its files out of the way, unless a running
+    process uses it. Returns where the files were moved to, or None if the
+    entry is in use. Deleting them is up to the caller."""
+    with self.transaction() as connection:
+      rows = connection.execute('SELECT path FROM entries WHERE key = ?',
+                                (key,)).fetchall()
+      if not rows or self._get_users(connection, key):
+        return None
+      path = rows[0][0]
+      # Renaming while holding the lock means no other run can pick up the
+      # entry half-deleted.
+      trash_path = '%s.deleting-%d' % (path, os.getpid())
+      if os.path.lexists(path):
+        os.rename(path, trash_path)
+      self._remove(connection, key)
+      return trash_path
+
+  def get_revision_sha(self, repo, revision):
+    """Returns the sha a commit position of repo was resolved to, or None.
+    Commit positions never move, so these are never evicted."""
+    rows = self.execute(
+        'SELECT sha FROM revision_shas WHERE repo = ? AND revision = ?',
+        (repo, str(revision)))
+    return rows[0][0] if rows else None
+
+  def add_revision_sha(self, repo, revision, sha):
+    self.execute('INSERT OR REPLACE INTO revision_shas VALUES (?, ?, ?)',
+                 (repo, str(revision), sha))
+
+  def get_dependency_sha(self, sha, dependency):
+    """Returns the sha DEPS pins dependency to at sha, or None."""
+    rows = self.execute(
+        'SELECT dependency_sha FROM dependency_shas '
+        'WHERE sha = ? AND dependency = ?', (sha, dependency))
+    return rows[0][0] if rows else None
+
+  def add_dependency_sha(self, sha, dependency, dependency_sha):
+    self.execute('INSERT OR REPLACE INTO dependency_shas VALUES (?, ?, ?)',
+                 (sha, dependency, dependency_sha))
+
+
+def get_index():
+  """Returns the index of the cache, opening it on first use."""
+  global index
+  with index_lock:
+    if index is None:
+      index = CacheIndex()
+      atexit.register(index.release_all)
+    return index
+
+
+def use(key, kind, path, testcase_id, source=None, update=False):
+  """Records that testcase_id uses the entry at path, and protects it from
+  eviction while this process runs. The size is measured when the entry is
+  new, or when update is set because its files changed."""
+  cache_index = get_index()
+  if update or cache_index.get(key) is None:
+    cache_index.add(key, kind, path, source, get_size(path))
+  else:
+    cache_index.touch(key)
+  cache_index.add_testcase(key, testcase_id)
+  cache_index.acquire(key)
+  return key
+
+
+def use_build(build_url, build_dir, testcase_id, update=False):
+  """Records that testcase_id uses the build from build_url, extracted to
+  build_dir."""
+  key = use(get_build_key(build_url), BUILD, build_dir, testcase_id,
+            source=build_url, update=update)
+  logger.debug('Build %s is shared by testcases: %s', key,
+               ', '.join(get_index().get(key).testcase_ids))
+  return key
+
+
+def use_testcase(testcase_id, testcase_dir, update=True):
+  """Records the files of a testcase, freshly downloaded unless update is
+  unset."""
+  return use(get_testcase_key(testcase_id), TESTCASE, testcase_dir,
+             testcase_id, update=update)
+
+
+def evict(budget=None, needed=0):
+  """Removes the least recently used entries until the cache, plus needed
+  bytes, fits in budget. Entries that are pinned or in use are kept. Returns
+  the removed entries."""
+  budget = get_budget() if budget is None else budget
+  cache_index = get_index()
+  entries = cache_index.get_all()
+  total = sum(entry.size for entry in entries)
+
+  removed = []
+  for entry in entries:
+    if total + needed <= budget:
+      break
+    if entry.pinned:
+      continue
+    trash_path = cache_index.remove_if_unused(entry.key)
+    if trash_path is None:
+      continue
+    logger.info('Evicting %s %s (%s, last used %s).', entry.kind, entry.key,
+                resource_usage.format_bytes(entry.size),
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(
+                    entry.last_used)))
+    delete_path(trash_path)
+    total -= entry.size
+    removed.append(entry)
+
+  if total + needed > budget:
+    logger.info('The cache uses %s of its %s budget; the rest is pinned or in '
+                'use.', resource_usage.format_bytes(total),
+                resource_usage.format_bytes(budget))
+  return removed
+
+
+def find_untracked():
+  """Returns the build and testcase directories the index does not know, and
+  that have not changed for UNTRACKED_MIN_AGE. They are left behind by older
+  versions of the tool or by interrupted runs."""
+  known = set(entry.path for entry in get_index().get_all())
+  untracked = []
+  for directory in [common.CLUSTERFUZZ_BUILDS_DIR,
+                    common.CLUSTERFUZZ_TESTCASES_DIR]:
+    if not os.path.isdir(directory):
+      continue
+    for name in sorted(os.listdir(directory)):
+      path = os.path.join(directory, name)
+      if (path not in known and
+          os.lstat(path).st_mtime < time.time() - UNTRACKED_MIN_AGE):
+        untracked.append(path)
+  return untracked
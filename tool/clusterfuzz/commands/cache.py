@@ -0,0 +1,111 @@
+"""Module for the 'cache' command.
+
+Lists, measures, pins and prunes the builds and testcases in the cache."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+import logging
+
+from clusterfuzz import cache
+from clusterfuzz import resource_usage
+
+KEY_WIDTH = 16
+logger = logging.getLogger('clusterfuzz')
+
+
+def format_time(timestamp):
+  return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+
+def list_entries():
+  """Lists the entries, least recently used first, i.e. in eviction order."""
+  entries = cache.get_index().get_all()
+  if not entries:
+    logger.info('The cache is empty.')
+    return
+
+  lines = ['%-*s %-8s %10s %-16s %-6s %5s %s' % (
+      KEY_WIDTH, 'Key', 'Kind', 'Size', 'Last used', 'Pinned', 'Users',
+      'Testcases')]
+  for entry in entries:
+    lines.append('%-*s %-8s %10s %-16s %-6s %5d %s' % (
+        KEY_WIDTH, entry.key[:KEY_WIDTH], entry.kind,
+        resource_usage.format_bytes(entry.size), format_time(entry.last_used),
+        'yes' if entry.pinned else '', entry.refcount,
+        ', '.join(entry.testcase_ids)))
+  logger.info('\n'.join(lines))
+
+
+def show_size():
+  """Shows how much of the budget is used, by kind of entry."""
+  cache_index = cache.get_index()
+  for kind in [cache.BUILD, cache.TESTCASE]:
+    entries = cache_index.get_all(kind)
+    logger.info('%ss: %d, %s', kind.capitalize(), len(entries),
+                resource_usage.format_bytes(
+                    sum(entry.size for entry in entries)))
+  logger.info('Total: %s of a %s budget (set with %s)',
+              resource_usage.format_bytes(cache_index.get_total_size()),
+              resource_usage.format_bytes(cache.get_budget()),
+              cache.BUDGET_ENV_VAR)
+
+  untracked = cache.find_untracked()
+  if untracked:
+    logger.info('Untracked: %d, %s (remove with: cache prune --untracked)',
+                len(untracked), resource_usage.format_bytes(
+                    sum(cache.get_size(path) for path in untracked)))
+
+
+def set_pinned(key, pinned):
+  """Pins or unpins the entries matching key, which is a key prefix or a
+  testcase ID."""
+  cache_index = cache.get_index()
+  entries = cache_index.find(key)
+  if not entries:
+    logger.info('Nothing in the cache matches %s.', key)
+    sys.exit(1)
+
+  for entry in entries:
+    cache_index.set_pinned(entry.key, pinned)
+    logger.info('%s %s %s.', 'Pinned' if pinned else 'Unpinned', entry.kind,
+                entry.key)
+
+
+def prune(budget, untracked):
+  """Evicts entries until the cache fits in budget, and optionally removes
+  what the index does not know about."""
+  budget = cache.parse_size(budget) if budget else cache.get_budget()
+  removed = cache.evict(budget)
+  logger.info('Evicted %d entries, %s.', len(removed),
+              resource_usage.format_bytes(
+                  sum(entry.size for entry in removed)))
+
+  if untracked:
+    for path in cache.find_untracked():
+      logger.info('Removing untracked %s', path)
+      cache.delete_path(path)
+
+
+def execute(action, key=None, budget=None, untracked=False):
+  """Execute the cache command."""
+  if action == 'list':
+    list_entries()
+  elif action == 'size':
+    show_size()
+  elif action in ('pin', 'unpin'):
+    set_pinned(key, action == 'pin')
+  elif action == 'prune':
+    prune(budget, untracked)
@@ -0,0 +1,101 @@
+"""Module for the 'prefetch' command.
+
+Fetches what reproducing a list of testcases needs ahead of time, so that
+`reproduce` starts warm."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import logging
+import threading
+from multiprocessing import pool
+
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+
+DEFAULT_JOBS = 4
+logger = logging.getLogger('clusterfuzz')
+
+# Concurrent fetches into one checkout would fight over its locks.
+git_lock = threading.Lock()
+
+
+def fetch_source(builder, source_var):
+  """Fetches the git objects of the revision the builder builds, if the
+  checkout is known without asking."""
+  if not builder.source_directory:
+    logger.info('Not fetching %s %s: set %s to the checkout to fetch into.',
+                builder.name, builder.git_sha, source_var)
+    return
+  with git_lock:
+    repository = builder.get_repository()
+    if not repository.has_commit(builder.git_sha):
+      repository.fetch(builder.git_sha)
+
+
+def prefetch(testcase_id, build, response=None):
+  """Fetches the testcase's information, its file, and either its build or
+  the source of its revision. Returns None, or why it failed."""
+  try:
+    response = response or reproduce.get_testcase_info(testcase_id)
+    current_testcase = testcase.Testcase(response)
+    current_testcase.get_testcase_path()
+    definition = reproduce.get_binary_definition(
+        current_testcase.job_type, build)
+
+    if build == 'download':
+      binary_provider = reproduce.get_downloaded_binary(
+          current_testcase, definition)
+      binary_provider.download_build_data(binary_provider.needed_only)
+    else:
+      # Resolves the revision to its sha.
+      builder = definition.builder(
+          current_testcase, definition, current=False, goma_dir=None,
+          goma_threads=None, edit_mode=False)
+      fetch_source(builder, definition.source_var)
+  except (Exception, SystemExit) as e:  # pylint: disable=broad-except
+    # common.execute exits on errors, which must not end the other fetches.
+    logger.debug('Prefetching testcase %s failed.', testcase_id,
+                 exc_info=True)
+    return str(e) or e.__class__.__name__
+  logger.info('Prefetched testcase %s.', testcase_id)
+  return None
+
+
+def execute(testcase_ids, build, j):
+  """Execute the prefetch command."""
+  # The first request may ask the user to log in, which must happen before
+  # the others are sent.
+  first_response = reproduce.get_testcase_info(testcase_ids[0])
+
+  def prefetch_one(testcase_id):
+    return prefetch(testcase_id, build,
+                    first_response if testcase_id == testcase_ids[0] else None)
+
+  workers = pool.ThreadPool(min(j or DEFAULT_JOBS, len(testcase_ids)))
+  try:
+    # map_async keeps the main thread interruptible.
+    errors = workers.map_async(prefetch_one, testcase_ids).get(sys.maxint)
+  finally:
+    workers.terminate()
+    workers.join()
+
+  failures = [(testcase_id, error)
+              for testcase_id, error in zip(testcase_ids, errors) if error]
+  for testcase_id, error in failures:
+    logger.info('Failed to prefetch testcase %s: %s', testcase_id, error)
+  logger.info('Prefetched %d of %d testcases.',
+              len(testcase_ids) - len(failures), len(testcase_ids))
+  if failures:
+    sys.exit(1)
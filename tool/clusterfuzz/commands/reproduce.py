@@ -29,6 +29,8 @@ from clusterfuzz import stackdriver_logging
 from clusterfuzz import testcase
 from clusterfuzz import binary_providers
 from clusterfuzz import reproducers
+from clusterfuzz import resource_usage
+from clusterfuzz import tracing
 
 
 CLUSTERFUZZ_AUTH_HEADER = 'x-clusterfuzz-authorization'
@@ -79,6 +81,7 @@ def get_verification_header():
   return 'VerificationCode %s' % verification
 
 
+@tracing.traced(category='http')
 def send_request(url, data):
   """Get a clusterfuzz url that requires authentication.
 
@@ -116,14 +119,18 @@ def get_testcase_info(testcase_id):
   return json.loads(send_request(CLUSTERFUZZ_TESTCASE_INFO_URL, data).text)
 
 def ensure_goma():
-  """Ensures GOMA is installed and ready for use, and starts it."""
+  """Ensures GOMA is installed and ready for use, and starts it in the
+  background. Returns the goma dir and the pending start, which must be waited
+  on before building."""
 
   goma_dir = os.environ.get('GOMA_DIR', GOMA_DIR)
   if not os.path.isfile(os.path.join(goma_dir, 'goma_ctl.py')):
     raise common.GomaNotInstalledError()
 
-  common.execute('python', 'goma_ctl.py ensure_start', goma_dir)
-  return goma_dir
+  with resource_usage.phase('goma'):
+    goma_start = common.execute_async(
+        'python', 'goma_ctl.py ensure_start', goma_dir)
+  return goma_dir, goma_start
 
 
 def parse_job_definition(job_definition, presets):
@@ -199,6 +206,18 @@ def get_binary_definition(job_type, build_param):
   raise common.JobTypeNotSupportedError(job_type)
 
 
+def get_downloaded_binary(current_testcase, definition):
+  """Returns the provider of the testcase's binary from its ClusterFuzz
+  build."""
+  if definition.binary_name:
+    binary_name = definition.binary_name
+  else:
+    binary_name = common.get_binary_name(current_testcase.stacktrace_lines)
+  return binary_providers.DownloadedBinary(
+      current_testcase.id, current_testcase.build_url, binary_name,
+      needed_only=definition.reproducer.EXTRACT_NEEDED_ONLY)
+
+
 def maybe_warn_unreproducible(current_testcase):
   """Print warning if the testcase is unreproducible."""
   if not current_testcase.reproducible:
@@ -213,7 +232,7 @@ def maybe_warn_unreproducible(current_testcase):
 
 @stackdriver_logging.log
 def execute(testcase_id, current, build, disable_goma, j, iterations,
-            disable_xvfb, target_args, edit_mode):
+            disable_xvfb, target_args, edit_mode, gn_check, force_sync):
   """Execute the reproduce command."""
   logger.info('Reproducing testcase %s', testcase_id)
   logger.debug('(testcase_id:%s, current=%s, build=%s, disable_goma=%s)',
@@ -232,21 +251,27 @@ def execute(testcase_id, current, build, disable_goma, j, iterations,
   maybe_warn_unreproducible(current_testcase)
 
   if build == 'download':
-    if definition.binary_name:
-      binary_name = definition.binary_name
-    else:
-      binary_name = common.get_binary_name(current_testcase.stacktrace_lines)
-    binary_provider = binary_providers.DownloadedBinary(
-        current_testcase.id, current_testcase.build_url, binary_name)
+    binary_provider = get_downloaded_binary(current_testcase, definition)
   else:
-    goma_dir = None if disable_goma else ensure_goma()
+    goma_dir, goma_start = (None, None) if disable_goma else ensure_goma()
+    # Goma starts up while the builder looks up its revision.
     binary_provider = definition.builder( # pylint: disable=redefined-variable-type
-        current_testcase, definition, current, goma_dir, j, edit_mode)
+        current_testcase, definition, current, goma_dir, j, edit_mode,
+        gn_check, force_sync)
+    if goma_start:
+      with tracing.span('wait_for_goma'):
+        goma_start.wait()
 
   reproducer = definition.reproducer(
       binary_provider, current_testcase, definition.sanitizer, disable_xvfb,
       target_args, edit_mode)
   try:
-    reproducer.reproduce(iterations)
+    with tracing.span('run_reproducer'):
+      reproducer.reproduce(iterations)
   finally:
     maybe_warn_unreproducible(current_testcase)
+    try:
+      resource_usage.write_summary(current_testcase.job_type)
+    except Exception:  # pylint: disable=broad-except
+      # The summary is best effort, and must not hide the reproducer's error.
+      logger.debug('Writing the resource usage summary failed.', exc_info=True)
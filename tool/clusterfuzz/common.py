@@ -18,15 +18,26 @@ from __future__ import print_function
 import os
 import sys
 import stat
+import errno
+import select
 import subprocess
 import logging
 import time
 import re
 import signal
 import shutil
+import threading
+import tempfile
+import collections
+import contextlib
+import fcntl
+import pipes
+import shlex
 
 from backports.shutil_get_terminal_size import get_terminal_size
 from clusterfuzz import local_logging
+from clusterfuzz import resource_usage
+from clusterfuzz import tracing
 
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 CLUSTERFUZZ_CACHE_DIR = os.path.join(CLUSTERFUZZ_DIR, 'cache')
@@ -36,7 +47,16 @@ AUTH_HEADER_FILE = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'auth_header')
 DOMAIN_NAME = 'clusterfuzz.com'
 DEBUG_PRINT = os.environ.get('CF_DEBUG')
 TERMINAL_WIDTH = get_terminal_size().columns
+KILL_GRACE_PERIOD = 3
+SIGNAL_POLL_INTERVAL = 0.1
+READ_SIZE = 64 * 1024
+CAPTURE_MEMORY_LIMIT = 16 * 1024 * 1024
+BYTE_PROGRESS_INTERVAL = 0.2
+SHELL = '/bin/sh'
+# Characters that only mean something to a shell, when unquoted.
+SHELL_METACHARACTERS = frozenset('|&;<>()$`*?[]{}~\n')
 logger = logging.getLogger('clusterfuzz')
+executable_cache = {}
 
 
 def get_binary_name(stacktrace):
@@ -184,31 +204,79 @@ def get_stored_auth_header():
     return f.read()
 
 
-def wait_timeout(proc, timeout):
-  """If proc runs longer than <timeout> seconds, kill it."""
-  if not timeout:
-    return
-  for _ in range(0, timeout * 2):
-    time.sleep(0.5)
-    if proc.poll():
-      break
-  else:
-    try:
-      os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-
-      # Wait for any shutdown stacktrace to be dumped.
-      time.sleep(3)
-    except OSError as e:
-      if e.errno != 3:  # No such process.
-        raise
+def kill_process_group(pgid, sig):
+  """Sends sig to a process group. Returns False if the group is gone."""
+  try:
+    os.killpg(pgid, sig)
+  except OSError as e:
+    if e.errno != errno.ESRCH:
+      raise
+    return False
+  return True
+
+
+def read_output(proc, timeout=None, kill_grace_period=KILL_GRACE_PERIOD,
+                monitor=None):
+  """Yields proc's output as it arrives. If proc runs longer than <timeout>
+  seconds, its process group is sent SIGTERM and, if it is still alive
+  <kill_grace_period> seconds later, SIGKILL.
+
+  Stops as soon as the output pipe is closed, i.e. when every process in the
+  group has exited, or when the group is gone after being signalled. The
+  resource monitor, if any, is given a chance to sample in between reads."""
+  fd = proc.stdout.fileno()
+  pgid = None
+  deadline = time.time() + timeout if timeout else None
+  sent_signal = None
+
+  while True:
+    wait = None
+    if deadline is not None:
+      wait = max(0, deadline - time.time())
+    if sent_signal:
+      # Once signalled, keep an eye on the group itself because a process
+      # outside of it might be holding the pipe open.
+      wait = (SIGNAL_POLL_INTERVAL if wait is None
+              else min(wait, SIGNAL_POLL_INTERVAL))
+    if monitor:
+      monitor.sample()
+      wait = (resource_usage.SAMPLE_INTERVAL if wait is None
+              else min(wait, resource_usage.SAMPLE_INTERVAL))
+
+    readable, _, _ = select.select([fd], [], [], wait)
+    if readable:
+      chunk = os.read(fd, READ_SIZE)
+      if not chunk:
+        return
+      yield chunk
+      continue
+
+    if (sent_signal and proc.poll() is not None and
+        not kill_process_group(pgid, 0)):
+      return
+    if deadline is None or time.time() < deadline:
+      continue
+
+    if not sent_signal:
+      # Give the process a chance to dump its shutdown stacktrace.
+      pgid = os.getpgid(proc.pid)
+      sent_signal = signal.SIGTERM
+      deadline = time.time() + kill_grace_period
+    elif sent_signal == signal.SIGTERM:
+      sent_signal = signal.SIGKILL
+      deadline = None
+    if not kill_process_group(pgid, sent_signal):
+      return
 
 
 def print_progress_bar(iteration, total, prefix='', suffix='', decimals=1,
-                       length=min(100, TERMINAL_WIDTH-26), fill='='):
+                       length=None, fill='='):
   """Prints a progress bar on the same line.
 
   From: http://stackoverflow.com/a/34325723."""
 
+  if length is None:
+    length = min(100, TERMINAL_WIDTH - 26)
   percent = ("{0:." + str(decimals) + "f}").format(
       100 * (iteration / float(total)))
   filled_length = int(length * iteration // total)
@@ -220,7 +288,67 @@ def print_progress_bar(iteration, total, prefix='', suffix='', decimals=1,
   return full_line
 
 
-def interpret_ninja_output(line):
+class NinjaProgress(object):
+  """Works out the rate of a ninja build and when it will finish."""
+
+  def __init__(self):
+    self.start_time = None
+    self.start_edge = None
+
+  def update(self, current, total):
+    """Returns the edges/sec rate and the ETA, formatted for the progress
+    bar."""
+    now = time.time()
+    if self.start_time is None:
+      self.start_time = now
+      self.start_edge = current
+      return ''
+
+    elapsed = now - self.start_time
+    if elapsed <= 0 or current <= self.start_edge:
+      return ''
+    rate = (current - self.start_edge) / elapsed
+    eta = int((total - current) / rate)
+    return '%.1f/s ETA %d:%02d' % (rate, eta / 60, eta % 60)
+
+
+class ByteProgress(object):
+  """Shows how many of a number of bytes are done, with the rate. Bytes can
+  be added from any thread."""
+
+  def __init__(self, total, prefix='', show=True):
+    self.total = total
+    self.prefix = prefix
+    self.show = show
+    self.done = 0
+    self.start_time = time.time()
+    self.last_print_time = None
+    self.lock = threading.Lock()
+
+  def add(self, size):
+    with self.lock:
+      self.done += size
+      now = time.time()
+      if not self.show or not self.total:
+        return
+      if (self.done < self.total and self.last_print_time is not None and
+          now - self.last_print_time < BYTE_PROGRESS_INTERVAL):
+        return
+      self.last_print_time = now
+
+      elapsed = now - self.start_time
+      rate = self.done / elapsed if elapsed > 0 else 0
+      suffix = '%s/%s %s/s' % (
+          resource_usage.format_bytes(self.done),
+          resource_usage.format_bytes(self.total),
+          resource_usage.format_bytes(rate))
+      print_progress_bar(
+          min(self.done, self.total), self.total, prefix=self.prefix,
+          suffix=suffix,
+          length=max(10, min(100, TERMINAL_WIDTH - 26 - len(suffix))))
+
+
+def interpret_ninja_output(line, progress=None):
   """Call print progress bar with the right params if line is valid.
 
   In this case, valid implies line is of a form similar to:
@@ -228,33 +356,92 @@ def interpret_ninja_output(line):
 
   if not re.search(r'\[[0-9]{1,6}\/[0-9]{1,6}\] [A-Z]*', line):
     return
-  progress = line.split(' ')[0]
-  current, total = [int(x) for x in (progress.replace('[', '')
+  progress_str = line.split(' ')[0]
+  current, total = [int(x) for x in (progress_str.replace('[', '')
                                      .replace(']', '').split('/'))]
-  print_progress_bar(current, total, prefix='Ninja progress:')
+  if not progress:
+    print_progress_bar(current, total, prefix='Ninja progress:')
+    return
 
+  suffix = progress.update(current, total)
+  print_progress_bar(
+      current, total, prefix='Ninja progress:', suffix=suffix,
+      length=max(10, min(100, TERMINAL_WIDTH - 26 - len(suffix))))
 
-def check_binary(binary, cwd):
-  """Check if the binary exists."""
-  try:
-    subprocess.check_output(['which', binary], cwd=cwd)
-  except subprocess.CalledProcessError:
-    raise NotInstalledError(binary)
 
+def is_executable(path):
+  return os.path.isfile(path) and os.access(path, os.X_OK)
 
-def start_execute(binary, args, cwd, env=None, print_command=True):
-  """Runs a command, and returns the subprocess.Popen object."""
 
-  check_binary(binary, cwd)
+def find_executable(binary, cwd):
+  """Resolves binary to a path the way `which` would, but in-process. Hits on
+  PATH are cached by the value of PATH, and checked again before reuse."""
+  if os.sep in binary:
+    path = os.path.abspath(os.path.join(cwd, binary))
+    return path if is_executable(path) else None
 
-  command = (binary + ' ' + args).strip()
-  env = env or {}
+  search_path = os.environ.get('PATH', os.defpath)
+  key = (search_path, binary)
+  path = executable_cache.get(key)
+  if path and is_executable(path):
+    return path
 
+  executable_cache.pop(key, None)
+  for directory in search_path.split(os.pathsep):
+    path = os.path.abspath(os.path.join(directory, binary))
+    if is_executable(path):
+      executable_cache[key] = path
+      return path
+  return None
+
+
+def check_binary(binary, cwd):
+  """Check if the binary exists, and return its path."""
+  path = find_executable(binary, cwd)
+  if not path:
+    raise NotInstalledError(binary)
+  return path
+
+
+def sanitize_env(env):
+  """Returns env with None values dropped and everything else as strings."""
   # See https://github.com/google/clusterfuzz-tools/issues/199 why we need this.
   sanitized_env = {}
-  for k, v in env.iteritems():
+  for k, v in (env or {}).iteritems():
     if v is not None:
       sanitized_env[str(k)] = str(v)
+  return sanitized_env
+
+
+def needs_shell(args):
+  """Returns True if args uses shell syntax that shlex.split cannot express,
+  like pipes, redirections, variables or globs, outside of single quotes."""
+  quote = None
+  escaped = False
+  for char in args:
+    if escaped:
+      escaped = False
+    elif quote == "'":
+      if char == "'":
+        quote = None
+    elif char == '\\':
+      escaped = True
+    elif quote == '"':
+      if char == '"':
+        quote = None
+      elif char in '$`':
+        return True
+    elif char in '\'"':
+      quote = char
+    elif char in SHELL_METACHARACTERS:
+      return True
+  return False
+
+
+def popen(argv, executable, command, phase, cwd, env, print_command):
+  """Starts argv in a new session, with its output piped, and attaches a
+  resource monitor to the returned subprocess.Popen object."""
+  sanitized_env = sanitize_env(env)
 
   env_str = ' '.join(
       ['%s="%s"' % (k, v) for k, v in sanitized_env.iteritems()])
@@ -268,47 +455,245 @@ def start_execute(binary, args, cwd, env=None, print_command=True):
   final_env = os.environ.copy()
   final_env.update(sanitized_env)
 
-  return subprocess.Popen(
-      command,
-      shell=True,
+  # A new session lets read_output kill the command along with its children.
+  # Python 2 has no start_new_session, so this has to go through preexec_fn.
+  proc = subprocess.Popen(
+      argv,
+      executable=executable,
       stdin=subprocess.PIPE,
       stdout=subprocess.PIPE,
       stderr=subprocess.STDOUT,
       cwd=cwd,
       env=final_env,
       preexec_fn=os.setsid)
+  proc.resource_monitor = resource_usage.ProcessTreeMonitor(
+      proc.pid, command, phase)
+  return proc
+
+
+def start_execute_argv(argv, cwd, env=None, print_command=True):
+  """Runs a command given as a list of arguments, without a shell, and
+  returns the subprocess.Popen object."""
+  executable = check_binary(argv[0], cwd)
+  command = ' '.join(pipes.quote(arg) for arg in argv)
+  return popen(argv, executable, command, resource_usage.get_phase(argv[0]),
+               cwd, env, print_command)
+
+
+def start_execute(binary, args, cwd, env=None, print_command=True):
+  """Runs a command, and returns the subprocess.Popen object.
+
+  args is split the way a shell would split it and run without a shell, unless
+  it uses shell syntax (see needs_shell), in which case the command goes
+  through /bin/sh -c as is."""
+  if isinstance(args, unicode):
+    args = args.encode('utf-8')
+  if not needs_shell(args):
+    return start_execute_argv([binary] + shlex.split(args), cwd, env=env,
+                              print_command=print_command)
+
+  check_binary(binary, cwd)
+  command = (binary + ' ' + args).strip()
+  return popen([SHELL, '-c', command], SHELL, command,
+               resource_usage.get_phase(binary), cwd, env, print_command)
+
+
+class LineSplitter(object):
+  """Splits chunks of output into whole lines, without their newlines.
+
+  Each chunk is split with str.split, so the bytes are only walked once, and
+  at C speed."""
+
+  def __init__(self):
+    self.pending = []
+
+  def split(self, chunk):
+    """Returns the lines completed by chunk."""
+    lines = chunk.split('\n')
+    if len(lines) > 1 and self.pending:
+      self.pending.append(lines[0])
+      lines[0] = ''.join(self.pending)
+      self.pending = []
+    remainder = lines.pop()
+    if remainder:
+      self.pending.append(remainder)
+    return lines
+
+  def flush(self):
+    """Returns the trailing line if the output didn't end with a newline."""
+    if not self.pending:
+      return []
+    lines = [''.join(self.pending)]
+    self.pending = []
+    return lines
+
+
+class CapturedOutput(object):
+  """The captured output of a command.
+
+  Lines are kept in memory until they add up to memory_limit bytes. Beyond
+  that, the whole output is spilled to a temporary file, and only a bounded
+  head and tail stay in memory. Consumers should stream the output with
+  iter_chunks or iter_lines rather than read it whole."""
+
+  def __init__(self, memory_limit=CAPTURE_MEMORY_LIMIT):
+    self.memory_limit = memory_limit
+    self.head = []
+    self.head_size = 0
+    self.tail = collections.deque()
+    self.tail_size = 0
+    self.size = 0
+    self.spill_file = None
+    self.ends_with_newline = False
+
+  @property
+  def spilled(self):
+    return self.spill_file is not None
+
+  def append(self, lines):
+    """Adds whole lines, without their newlines."""
+    if not lines:
+      return
+
+    for line in lines:
+      self.size += len(line) + 1
+
+    if not self.spilled:
+      self.head.extend(lines)
+      self.head_size += sum(len(line) + 1 for line in lines)
+      if self.head_size > self.memory_limit:
+        self._spill()
+      return
+
+    self.spill_file.write('\n'.join(lines))
+    self.spill_file.write('\n')
+    for line in lines:
+      self.tail.append(line)
+      self.tail_size += len(line) + 1
+    while self.tail_size > self.memory_limit / 2 and len(self.tail) > 1:
+      self.tail_size -= len(self.tail.popleft()) + 1
+
+  def _spill(self):
+    """Moves the output to a temporary file, keeping the head in memory."""
+    self.spill_file = tempfile.TemporaryFile(prefix='clusterfuzz-output-')
+    self.spill_file.write('\n'.join(self.head))
+    self.spill_file.write('\n')
+    head = []
+    head_size = 0
+    for line in self.head:
+      if head_size + len(line) + 1 > self.memory_limit / 2:
+        break
+      head.append(line)
+      head_size += len(line) + 1
+    self.head = head
+    self.head_size = head_size
+
+  def finish(self, ends_with_newline):
+    """Records whether the last line was terminated by a newline."""
+    self.ends_with_newline = ends_with_newline and self.size > 0
+    if self.spilled and not self.ends_with_newline:
+      self.spill_file.truncate(self.size - 1)
+      if self.tail:
+        self.tail_size -= 1
+    if not self.ends_with_newline:
+      self.size = max(0, self.size - 1)
+
+  def iter_chunks(self):
+    """Yields the output in chunks, reading it back from disk if spilled."""
+    if not self.spilled:
+      yield self.read()
+      return
+
+    self.spill_file.flush()
+    self.spill_file.seek(0)
+    for chunk in iter(lambda: self.spill_file.read(READ_SIZE), b''):
+      yield chunk
+    self.spill_file.seek(0, os.SEEK_END)
+
+  def iter_lines(self):
+    """Yields the output line by line."""
+    if not self.spilled:
+      for line in self.head:
+        yield line
+      return
+
+    splitter = LineSplitter()
+    for chunk in self.iter_chunks():
+      for line in splitter.split(chunk):
+        yield line
+    for line in splitter.flush():
+      yield line
+
+  def is_blank(self):
+    return not self.spilled and not self.read().strip()
+
+  def read(self):
+    """Returns the whole output as a string."""
+    if self.spilled:
+      return ''.join(self.iter_chunks())
+    output = '\n'.join(self.head)
+    if self.ends_with_newline:
+      output += '\n'
+    return output
+
+  def summary(self):
+    """Returns the whole output if it fits in memory, or its head and tail
+    otherwise."""
+    if not self.spilled:
+      return self.read()
+    omitted = self.size - self.head_size - self.tail_size
+    return '%s\n... %d bytes omitted ...\n%s' % (
+        '\n'.join(self.head), omitted, '\n'.join(self.tail))
+
+  def close(self):
+    """Deletes the spilled output, if any."""
+    if self.spill_file:
+      self.spill_file.close()
+
+  def __str__(self):
+    return self.read()
 
 
 def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
-                 timeout=None, ninja_command=False):
-  """Looks after a command as it runs, and prints/returns its output after."""
+                 timeout=None, ninja_command=False, lazy_output=False):
+  """Looks after a command as it runs, and prints/returns its output after.
+
+  With lazy_output, the output is returned as a CapturedOutput so that it
+  never has to be held in memory as a whole."""
 
   def _print(s):
     if print_output:
       logger.debug(s)
 
-  _print('---------------------------------------')
-  output_chunks = []
-  current_line = []
-  wait_timeout(proc, timeout)
-  for chunk in iter(lambda: proc.stdout.read(100), b''):
+  def _consume(lines):
     if print_output:
-      local_logging.send_output(chunk)
-      if ninja_command and not DEBUG_PRINT:
-        for x in chunk:
-          if x == '\n':
-            interpret_ninja_output(''.join(current_line))
-            current_line = []
-          else:
-            current_line.append(x)
-      elif not DEBUG_PRINT:
-        sys.stdout.write('.')
-        sys.stdout.flush()
+      for line in lines:
+        local_logging.send_output(line)
+        if ninja_command and not DEBUG_PRINT:
+          interpret_ninja_output(line, ninja_progress)
     if capture_output:
-      # According to: http://stackoverflow.com/questions/19926089, this is the
-      # fastest way to build strings.
-      output_chunks.append(chunk)
+      output.append(lines)
+
+  _print('---------------------------------------')
+  output = CapturedOutput()
+  splitter = LineSplitter()
+  ninja_progress = NinjaProgress() if ninja_command else None
+  monitor = getattr(proc, 'resource_monitor', None)
+  for chunk in read_output(proc, timeout, monitor=monitor):
+    _consume(splitter.split(chunk))
+    if print_output and not ninja_command and not DEBUG_PRINT:
+      sys.stdout.write('.')
+      sys.stdout.flush()
+  trailing_line = splitter.flush()
+  _consume(trailing_line)
+  output.finish(ends_with_newline=not trailing_line)
+  if monitor:
+    # The command has exited but not been reaped yet, so its final counters
+    # can still be read.
+    monitor.sample(force=True)
   proc.wait()
+  if monitor:
+    monitor.finish(proc.returncode)
   if print_output:
     print()
   _print('---------------------------------------')
@@ -316,25 +701,115 @@ def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
     _print('| Return code is non-zero (%d).' % proc.returncode)
     if exit_on_error:
       _print('| Exit.')
+      output.close()
       sys.exit(proc.returncode)
-  return proc.returncode, ''.join(output_chunks)
+  if lazy_output:
+    return proc.returncode, output
+  try:
+    return proc.returncode, output.read()
+  finally:
+    output.close()
 
 
 def execute(binary, args, cwd, print_command=True, print_output=True,
-            capture_output=True, exit_on_error=True, env=None):
-  """Execute a bash command."""
-  proc = start_execute(binary, args, cwd, env=env, print_command=print_command)
-  return wait_execute(proc, exit_on_error, capture_output, print_output,
-                      ninja_command=binary == 'ninja')
-
-
-def execute_with_shell(binary, args, cwd):
-  """Execute command with os.system because install_deps.sh needs it."""
+            capture_output=True, exit_on_error=True, env=None,
+            lazy_output=False):
+  """Execute a command, through a shell only if args uses shell syntax."""
+  with tracing.span(os.path.basename(binary), 'command', args=args, cwd=cwd):
+    proc = start_execute(binary, args, cwd, env=env,
+                         print_command=print_command)
+    return wait_execute(proc, exit_on_error, capture_output, print_output,
+                        ninja_command=binary == 'ninja',
+                        lazy_output=lazy_output)
+
+
+def execute_argv(argv, cwd, print_command=True, print_output=True,
+                 capture_output=True, exit_on_error=True, env=None,
+                 lazy_output=False):
+  """Execute a command given as a list of arguments, without a shell."""
+  with tracing.span(os.path.basename(argv[0]), 'command', argv=argv, cwd=cwd):
+    proc = start_execute_argv(argv, cwd, env=env, print_command=print_command)
+    return wait_execute(proc, exit_on_error, capture_output, print_output,
+                        ninja_command=argv[0] == 'ninja',
+                        lazy_output=lazy_output)
+
+
+class AsyncResult(object):
+  """Runs a function in a background thread and holds on to its outcome."""
+
+  def __init__(self, fn, *args, **kwargs):
+    self.result = None
+    self.exc_info = None
+    # Commands run in the background count towards the caller's phase.
+    self.phase = resource_usage.current_phase()
+    self.thread = threading.Thread(target=self._run, args=(fn, args, kwargs))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _run(self, fn, args, kwargs):
+    try:
+      with resource_usage.phase(self.phase):
+        self.result = fn(*args, **kwargs)
+    except BaseException:  # pylint: disable=broad-except
+      # SystemExit from exit_on_error must reach the waiting thread too.
+      self.exc_info = sys.exc_info()
+
+  def done(self):
+    return not self.thread.is_alive()
+
+  def wait(self):
+    """Waits for the function to finish. Returns its result, or re-raises its
+    exception in the calling thread."""
+    # Joining without a timeout would stop Ctrl+C from being delivered.
+    while self.thread.is_alive():
+      self.thread.join(SIGNAL_POLL_INTERVAL)
+    if self.exc_info:
+      raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+    return self.result
+
+
+def run_async(fn, *args, **kwargs):
+  """Starts fn in the background, and returns its AsyncResult."""
+  return AsyncResult(fn, *args, **kwargs)
+
+
+def execute_async(binary, args, cwd, **kwargs):
+  """Starts a command in a background thread. Takes the same arguments as
+  execute, whose (returncode, output) is returned by wait()."""
+  return run_async(execute, binary, args, cwd, **kwargs)
+
+
+def wait_all(async_results):
+  """Waits for every AsyncResult and returns their results in order. If any of
+  them failed, the first exception is raised once all of them have finished."""
+  results = []
+  exc_info = None
+  for async_result in async_results:
+    try:
+      results.append(async_result.wait())
+    except BaseException:  # pylint: disable=broad-except
+      results.append(None)
+      exc_info = exc_info or sys.exc_info()
+  if exc_info:
+    raise exc_info[0], exc_info[1], exc_info[2]
+  return results
+
+
+def execute_with_shell(binary, args, cwd, exit_on_error=True):
+  """Execute command with os.system because install_deps.sh needs it, and
+  return its exit code."""
   check_binary(binary, cwd)
 
   command = ('cd %s && %s %s' % (cwd, binary, args or '')).strip()
   logger.info('Running: %s', command)
-  os.system(command)
+  status = os.system(command)
+  returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+  if returncode != 0:
+    logger.info('| Return code is non-zero (%d).', returncode)
+    if exit_on_error:
+      logger.info('| Exit.')
+      sys.exit(returncode)
+  return returncode
 
 
 def confirm(question, default='y'):
@@ -376,6 +851,18 @@ def ask(question, error_message, validate_fn):
   return answer
 
 
+@contextlib.contextmanager
+def file_lock(path):
+  """Holds an exclusive lock on path, which is created if needed, for the
+  block. Other runs of the tool wait for it."""
+  with open(path, 'a') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
 def get_resource(chmod_permission, *paths):
   """Take a relative filepath and return the actual path. chmod_permission is
     needed because our packaging might destroy the permission."""
@@ -390,6 +877,30 @@ def delete_if_exists(path):
     shutil.rmtree(path)
 
 
+def clone_directory(source, destination):
+  """Copies the directory source to destination: with copy-on-write clones
+  where the filesystem has them, or else with a plain copy. Files are never
+  shared, because ninja and the build actions write some outputs in place.
+  Returns 'reflink', 'copy', or None if the directory could not be copied."""
+  staging_dir = tempfile.mkdtemp(
+      prefix='.clone-', dir=os.path.dirname(os.path.abspath(destination)))
+  staging_path = os.path.join(staging_dir, 'clone')
+  try:
+    for method, argv in [
+        ('reflink', ['cp', '-a', '--reflink=always', source, staging_path]),
+        ('copy', ['cp', '-a', source, staging_path])]:
+      returncode, _ = execute_argv(
+          argv, os.path.dirname(staging_dir), print_command=False,
+          print_output=False, exit_on_error=False)
+      if returncode == 0:
+        os.rename(staging_path, destination)
+        return method
+      delete_if_exists(staging_path)
+    return None
+  finally:
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
 def get_valid_abs_dir(path):
   """Return true if path is a valid dir."""
   if not path:
@@ -0,0 +1,525 @@
+"""Downloads files over HTTP as parallel byte ranges, or reads just parts of
+them.
+
+An interrupted download resumes where it stopped, and the content is checked
+against the MD5 the server advertises as it arrives."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import json
+import base64
+import hashlib
+import logging
+import threading
+from multiprocessing import pool
+
+import requests
+
+from clusterfuzz import common
+from clusterfuzz import resource_usage
+
+CHUNK_SIZE = 16 * 1024 * 1024
+RANGE_BLOCK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+DEFAULT_CONNECTIONS = 8
+RETRIES = 3
+TIMEOUT = 60
+WAIT_INTERVAL = 1
+PARTIAL_SUFFIX = '.partial'
+STATE_SUFFIX = '.partial.json'
+GCS_API_URL = 'https://storage.googleapis.com/'
+GCS_URL_PREFIXES = ['https://storage.cloud.google.com/', 'gs://']
+logger = logging.getLogger('clusterfuzz')
+
+gcs_auth_header_lock = threading.Lock()
+gcs_auth_header = None
+
+
+class DownloadError(common.ExpectedException):
+  """An error for downloads that cannot be completed."""
+
+  def __init__(self, url, reason):
+    super(DownloadError, self).__init__(
+        'Error downloading %s: %s' % (url, reason))
+
+
+class AuthorizationError(DownloadError):
+  """An error for downloads the server refuses to serve to us."""
+
+
+class ChecksumError(DownloadError):
+  """An error for downloads that do not match their checksum."""
+
+
+class NotFoundError(DownloadError):
+  """An error for downloads of things the server does not have."""
+
+
+class NetworkError(DownloadError):
+  """An error for connections that failed or timed out, which may work when
+  tried again."""
+
+
+def get_gcs_path(url):
+  """Returns the bucket/object path of a Cloud Storage object given by a
+  gs:// or browser URL, or None if it is neither."""
+  for prefix in GCS_URL_PREFIXES:
+    if url.startswith(prefix):
+      return url[len(prefix):]
+  return None
+
+
+def get_gcs_url(url):
+  """Returns the HTTP URL of a Cloud Storage object given by a gs:// or
+  browser URL, or url itself if it is neither."""
+  path = get_gcs_path(url)
+  return GCS_API_URL + path if path is not None else url
+
+
+def get_gcs_auth_header():
+  """Returns an Authorization header for Cloud Storage, or None if gcloud is
+  not installed or logged in. gcloud is only asked once per run."""
+  global gcs_auth_header
+  with gcs_auth_header_lock:
+    if gcs_auth_header is None:
+      gcs_auth_header = ''
+      home = os.path.expanduser('~')
+      if common.find_executable('gcloud', home):
+        returncode, token = common.execute(
+            'gcloud', 'auth print-access-token', home, print_command=False,
+            print_output=False, exit_on_error=False)
+        if returncode == 0 and token.strip():
+          gcs_auth_header = 'Bearer %s' % token.strip()
+    return gcs_auth_header or None
+
+
+def get_md5(headers):
+  """Returns the hex MD5 of the content from Cloud Storage's x-goog-hash or
+  the standard Content-MD5 header, or None if neither has it."""
+  hashes = headers.get('x-goog-hash', '').split(',')
+  hashes.append('md5=%s' % headers.get('Content-MD5', ''))
+  for digest in hashes:
+    name, _, value = digest.strip().partition('=')
+    if name == 'md5' and value:
+      return base64.b64decode(value).encode('hex')
+  return None
+
+
+def request(url, headers, byte_range=None):
+  """Requests the inclusive byte_range of url, or all of it."""
+  headers = dict(headers)
+  if byte_range:
+    headers['Range'] = 'bytes=%d-%d' % byte_range
+  try:
+    response = requests.get(url, headers=headers, stream=True,
+                            timeout=TIMEOUT)
+  except requests.RequestException as e:
+    raise NetworkError(url, e)
+  if response.status_code in (401, 403):
+    response.close()
+    raise AuthorizationError(url, 'HTTP %d' % response.status_code)
+  if response.status_code == 404:
+    response.close()
+    raise NotFoundError(url, 'HTTP 404')
+  if response.status_code not in (200, 206):
+    response.close()
+    raise DownloadError(url, 'HTTP %d' % response.status_code)
+  return response
+
+
+def get_gcs_headers():
+  """Returns the headers that authorize requests to Cloud Storage."""
+  auth_header = get_gcs_auth_header()
+  return {'Authorization': auth_header} if auth_header else {}
+
+
+class Download(object):
+  """Downloads url to path in chunks, over several connections at once.
+
+  Until it is complete, the content is kept in path + PARTIAL_SUFFIX, and the
+  chunks that are done in path + STATE_SUFFIX, so that a later download of
+  the same version of url picks up where this one stopped. The last chunk
+  is fetched first, and the rest in order, so that an archive can be read
+  while it downloads; see wait_for."""
+
+  def __init__(self, url, path, headers=None,
+               connections=DEFAULT_CONNECTIONS, chunk_size=CHUNK_SIZE):
+    self.url = url
+    self.path = path
+    self.partial_path = path + PARTIAL_SUFFIX
+    self.state_path = path + STATE_SUFFIX
+    self.headers = headers or {}
+    self.connections = connections
+    self.chunk_size = chunk_size
+    self.size = None
+    self.etag = None
+    self.md5 = None
+    self.supports_ranges = False
+    self.chunks = []
+    self.done = set()
+    self.error = None
+    self.condition = threading.Condition()
+    self.progress = None
+    self.workers = None
+    self.hasher = None
+    self.actual_md5 = None
+    self.monitor = None
+
+  def request(self, byte_range=None):
+    return request(self.url, self.headers, byte_range)
+
+  def probe(self):
+    """Finds out the size, version and checksum of the content, and whether
+    the server serves byte ranges."""
+    response = self.request((0, 0))
+    response.close()
+    self.etag = response.headers.get('ETag')
+    self.md5 = get_md5(response.headers)
+    self.supports_ranges = response.status_code == 206
+    if self.supports_ranges:
+      self.size = int(response.headers['Content-Range'].split('/')[-1])
+    elif 'Content-Length' in response.headers:
+      self.size = int(response.headers['Content-Length'])
+
+  def get_chunks(self):
+    """Returns the (start, end) of every chunk. Without byte ranges, or a
+    known size, the content is one chunk."""
+    if not self.supports_ranges or not self.size:
+      return [(0, self.size)]
+    return [(start, min(start + self.chunk_size, self.size))
+            for start in xrange(0, self.size, self.chunk_size)]
+
+  def get_state(self):
+    return {'url': self.url, 'size': self.size, 'etag': self.etag,
+            'chunk_size': self.chunk_size}
+
+  def load_state(self):
+    """Picks up the chunks a previous download of the same content did."""
+    if not (self.supports_ranges and os.path.exists(self.partial_path) and
+            os.path.exists(self.state_path)):
+      return
+    try:
+      with open(self.state_path) as f:
+        state = json.load(f)
+    except ValueError:
+      return
+    if state.get('state') != self.get_state():
+      return
+    self.done = set(index for index in state.get('done', [])
+                    if 0 <= index < len(self.chunks))
+
+  def save_state(self):
+    """Records the chunks that are done. Called with the condition held."""
+    temporary_path = self.state_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+      json.dump({'state': self.get_state(), 'done': sorted(self.done)}, f)
+    os.rename(temporary_path, self.state_path)
+
+  def start(self):
+    """Starts downloading in the background, and returns self."""
+    self.monitor = resource_usage.InProcessMonitor(
+        'download %s' % self.url, 'download')
+    self.probe()
+    self.chunks = self.get_chunks()
+    self.load_state()
+    if not self.done:
+      with open(self.partial_path, 'wb') as f:
+        if self.size:
+          f.truncate(self.size)
+
+    remaining = [index for index in range(len(self.chunks))
+                 if index not in self.done]
+    # The last chunk goes first: that is where an archive's directory is.
+    if len(remaining) > 1 and remaining[-1] == len(self.chunks) - 1:
+      remaining.insert(0, remaining.pop())
+    done_size = sum(self.get_chunk_size(index) for index in self.done)
+    logger.info('Downloading %s (%s%s) with %d connections...', self.url,
+                resource_usage.format_bytes(self.size or 0),
+                ', resuming after %s' % resource_usage.format_bytes(done_size)
+                if done_size else '', self.connections)
+
+    self.progress = common.ByteProgress(self.size, prefix='Downloading:')
+    self.progress.add(done_size)
+    self.workers = pool.ThreadPool(min(self.connections, len(remaining)) or 1)
+    self.workers.map_async(self.fetch_chunk, remaining, chunksize=1)
+    if self.md5 and self.size is not None:
+      self.hasher = threading.Thread(target=self.hash_content)
+      self.hasher.daemon = True
+      self.hasher.start()
+    return self
+
+  def get_chunk_size(self, index):
+    start, end = self.chunks[index]
+    return end - start if end is not None else 0
+
+  def fetch_chunk(self, index):
+    """Fetches a chunk, retrying on network errors."""
+    start, end = self.chunks[index]
+    for attempt in range(1, RETRIES + 1):
+      if self.error:
+        return
+      try:
+        written = self.fetch_range(start, end)
+        break
+      except (NetworkError, IOError) as e:
+        # requests' errors are IOErrors too.
+        if attempt == RETRIES:
+          self.fail(e if isinstance(e, DownloadError)
+                    else DownloadError(self.url, e))
+          return
+        logger.debug('Retrying bytes %d-%s of %s: %s', start, end, self.url,
+                     e)
+      except DownloadError as e:
+        self.fail(e)
+        return
+      except Exception as e:  # pylint: disable=broad-except
+        # Nobody would see it in the pool's thread.
+        self.fail(DownloadError(self.url, e))
+        return
+
+    with self.condition:
+      if self.size is None:
+        self.size = written
+      self.done.add(index)
+      if self.supports_ranges:
+        self.save_state()
+      self.condition.notify_all()
+
+  def fetch_range(self, start, end):
+    """Writes the bytes from start to end, or all of them, to the file, and
+    returns how many there were."""
+    response = self.request(
+        (start, end - 1) if self.supports_ranges else None)
+    if self.supports_ranges and response.status_code != 206:
+      response.close()
+      raise DownloadError(self.url, 'the server ignored the byte range')
+
+    written = 0
+    try:
+      with open(self.partial_path, 'r+b') as f:
+        f.seek(start)
+        for data in response.iter_content(READ_SIZE):
+          f.write(data)
+          written += len(data)
+          self.progress.add(len(data))
+    finally:
+      response.close()
+    if end is not None and written != end - start:
+      self.progress.add(-written)
+      raise IOError('got %d of %d bytes' % (written, end - start))
+    return written
+
+  def fail(self, error):
+    with self.condition:
+      if not self.error:
+        self.error = error
+      self.condition.notify_all()
+
+  def is_complete(self):
+    return len(self.done) == len(self.chunks)
+
+  def get_complete_until(self):
+    """Returns the offset up to which all the chunks are done. Called with
+    the condition held."""
+    for index, (start, _) in enumerate(self.chunks):
+      if index not in self.done:
+        return start
+    return self.size
+
+  def wait_until(self, predicate):
+    """Waits for predicate, or for the download to fail. Called with the
+    condition held. The timeout keeps the wait interruptible."""
+    while not predicate():
+      if self.error:
+        raise self.error
+      self.condition.wait(WAIT_INTERVAL)
+    if self.error:
+      raise self.error
+
+  def wait_for(self, offset):
+    """Waits until the content is complete up to offset."""
+    with self.condition:
+      self.wait_until(lambda: self.is_complete() or
+                      self.get_complete_until() >= offset)
+
+  def wait_for_tail(self):
+    """Waits until the last chunk is done."""
+    with self.condition:
+      self.wait_until(lambda: len(self.chunks) - 1 in self.done)
+
+  def hash_content(self):
+    """Hashes the content as it completes, in order."""
+    md5 = hashlib.md5()
+    hashed = 0
+    # Unbuffered, so that reading on after a chunk completes never returns
+    # data buffered from before.
+    with io.open(self.partial_path, 'rb', buffering=0) as f:
+      while hashed < self.size:
+        with self.condition:
+          while not self.error and self.get_complete_until() <= hashed:
+            self.condition.wait(WAIT_INTERVAL)
+          if self.error:
+            return
+          end = self.get_complete_until()
+        f.seek(hashed)
+        while hashed < end:
+          data = f.read(min(READ_SIZE, end - hashed))
+          md5.update(data)
+          hashed += len(data)
+    self.actual_md5 = md5.hexdigest()
+
+  def finish_monitor(self, returncode):
+    if self.monitor:
+      self.monitor.finish(returncode)
+      self.monitor = None
+
+  def close(self):
+    """Stops the background threads."""
+    self.fail(DownloadError(self.url, 'stopped'))
+    if self.workers:
+      self.workers.terminate()
+      self.workers.join()
+    self.finish_monitor(1)
+
+  def wait(self):
+    """Waits for the download to finish, checks it and moves it to path."""
+    try:
+      self.finish_download()
+    except BaseException:
+      self.finish_monitor(1)
+      raise
+    self.finish_monitor(0)
+    return self.path
+
+  def finish_download(self):
+    try:
+      with self.condition:
+        self.wait_until(self.is_complete)
+    finally:
+      self.workers.close()
+      self.workers.join()
+
+    if self.hasher:
+      self.hasher.join()
+    elif self.md5:
+      # Without a known size, the content can only be hashed at the end.
+      self.hash_content()
+    if self.md5 and self.actual_md5 != self.md5:
+      for path in [self.partial_path, self.state_path]:
+        if os.path.exists(path):
+          os.remove(path)
+      raise ChecksumError(self.url, 'the MD5 is %s instead of %s' % (
+          self.actual_md5, self.md5))
+
+    os.rename(self.partial_path, self.path)
+    if os.path.exists(self.state_path):
+      os.remove(self.state_path)
+
+
+class RangeFile(object):
+  """A read-only file over the byte ranges of url, for reading a few parts
+  of a big file, like the directory and some members of an archive, without
+  downloading all of it. What is read is fetched in whole blocks, which are
+  kept for later reads."""
+
+  def __init__(self, url, headers=None, block_size=RANGE_BLOCK_SIZE):
+    self.url = url
+    self.headers = headers or {}
+    self.block_size = block_size
+    self.blocks = {}
+    self.position = 0
+    self.fetched = 0
+
+    response = request(url, self.headers, (0, 0))
+    response.close()
+    if response.status_code != 206:
+      raise DownloadError(url, 'the server does not serve byte ranges')
+    self.size = int(response.headers['Content-Range'].split('/')[-1])
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += self.size
+    if offset < 0:
+      raise IOError('Invalid seek to %d in %s' % (offset, self.url))
+    self.position = offset
+
+  def tell(self):
+    return self.position
+
+  def read(self, size=-1):
+    end = self.size if size < 0 else min(self.position + size, self.size)
+    if end <= self.position:
+      return ''
+    first_block = self.position // self.block_size
+    last_block = (end - 1) // self.block_size
+    self.fetch_blocks(first_block, last_block)
+
+    data = ''.join(self.blocks[index]
+                   for index in range(first_block, last_block + 1))
+    start = self.position - first_block * self.block_size
+    data = data[start:start + end - self.position]
+    self.position = end
+    return data
+
+  def fetch_blocks(self, first_block, last_block):
+    """Fetches the missing blocks from first_block to last_block, a run of
+    consecutive ones per request."""
+    index = first_block
+    while index <= last_block:
+      if index in self.blocks:
+        index += 1
+        continue
+      run_end = index
+      while run_end + 1 <= last_block and run_end + 1 not in self.blocks:
+        run_end += 1
+      start = index * self.block_size
+      end = min((run_end + 1) * self.block_size, self.size)
+      response = request(self.url, self.headers, (start, end - 1))
+      try:
+        data = response.content
+      except requests.RequestException as e:
+        raise NetworkError(self.url, e)
+      finally:
+        response.close()
+      if len(data) != end - start:
+        raise DownloadError(self.url, 'got %d of %d bytes' % (
+            len(data), end - start))
+      self.fetched += len(data)
+      for block in range(index, run_end + 1):
+        offset = (block - index) * self.block_size
+        self.blocks[block] = data[offset:offset + self.block_size]
+      index = run_end + 1
+
+  def close(self):
+    logger.debug('Fetched %s of %s from %s.',
+                 resource_usage.format_bytes(self.fetched),
+                 resource_usage.format_bytes(self.size), self.url)
+    self.blocks = {}
+
+
+def start_gcs_download(url, path, connections=DEFAULT_CONNECTIONS):
+  """Starts downloading a Cloud Storage object, given by a gs:// or browser
+  URL, with the user's gcloud credentials if there are any."""
+  return Download(get_gcs_url(url), path, get_gcs_headers(),
+                  connections).start()
+
+
+def open_gcs_file(url):
+  """Opens a Cloud Storage object, given like for start_gcs_download, as a
+  RangeFile."""
+  return RangeFile(get_gcs_url(url), get_gcs_headers())
@@ -0,0 +1,125 @@
+"""Reads the shared libraries an ELF binary needs from its dynamic section."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import logging
+
+ELF_MAGIC = '\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+MAX_NAME_LENGTH = 4096
+logger = logging.getLogger('clusterfuzz')
+
+
+class Format(object):
+  """The struct formats of one ELF class and byte order."""
+
+  def __init__(self, is_64, endianness):
+    if is_64:
+      self.header = struct.Struct(endianness + 'HHIQQQIHHHHHH')
+      self.program_header = struct.Struct(endianness + 'IIQQQQQQ')
+      self.dynamic_entry = struct.Struct(endianness + 'qQ')
+    else:
+      self.header = struct.Struct(endianness + 'HHIIIIIHHHHHH')
+      self.program_header = struct.Struct(endianness + 'IIIIIIII')
+      self.dynamic_entry = struct.Struct(endianness + 'iI')
+    self.is_64 = is_64
+
+  def parse_program_header(self, data):
+    """Returns (type, offset, address, file size) of a program header."""
+    values = self.program_header.unpack(data)
+    if self.is_64:
+      p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = values
+    else:
+      p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = values
+    return p_type, p_offset, p_vaddr, p_filesz
+
+
+def read_struct(f, offset, fmt):
+  f.seek(offset)
+  data = f.read(fmt.size)
+  if len(data) != fmt.size:
+    raise struct.error('truncated')
+  return data
+
+
+def read_string(f, offset):
+  f.seek(offset)
+  return f.read(MAX_NAME_LENGTH).split('\0', 1)[0]
+
+
+def get_file_offset(segments, address):
+  """Returns where the loadable segments put address in the file."""
+  for offset, segment_address, size in segments:
+    if segment_address <= address < segment_address + size:
+      return offset + address - segment_address
+  return None
+
+
+def get_needed_libraries(path):
+  """Returns the names of the shared libraries (DT_NEEDED) the ELF file at
+  path needs. Files that are not dynamically linked ELF files need none."""
+  with open(path, 'rb') as f:
+    ident = f.read(16)
+    if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+      return []
+    fmt = Format(ord(ident[4]) == ELFCLASS64,
+                 '<' if ord(ident[5]) == ELFDATA2LSB else '>')
+    try:
+      return read_needed_libraries(f, fmt)
+    except struct.error:
+      logger.debug('Cannot read the dynamic section of %s.', path)
+      return []
+
+
+def read_needed_libraries(f, fmt):
+  """Reads the DT_NEEDED names from the ELF file f is open on."""
+  header = fmt.header.unpack(read_struct(f, 16, fmt.header))
+  phoff, phentsize, phnum = header[4], header[8], header[9]
+
+  segments = []
+  dynamic = None
+  for index in range(phnum):
+    p_type, p_offset, p_vaddr, p_filesz = fmt.parse_program_header(
+        read_struct(f, phoff + index * phentsize, fmt.program_header))
+    if p_type == PT_LOAD:
+      segments.append((p_offset, p_vaddr, p_filesz))
+    elif p_type == PT_DYNAMIC:
+      dynamic = (p_offset, p_filesz)
+  if not dynamic:
+    return []
+
+  needed_offsets = []
+  string_table_address = None
+  offset, size = dynamic
+  for entry_offset in range(offset, offset + size, fmt.dynamic_entry.size):
+    tag, value = fmt.dynamic_entry.unpack(
+        read_struct(f, entry_offset, fmt.dynamic_entry))
+    if tag == DT_NULL:
+      break
+    elif tag == DT_NEEDED:
+      needed_offsets.append(value)
+    elif tag == DT_STRTAB:
+      string_table_address = value
+
+  string_table = get_file_offset(segments, string_table_address)
+  if string_table is None:
+    return []
+  return [read_string(f, string_table + offset) for offset in needed_offsets]
@@ -42,7 +42,6 @@ logging_config = dict(
         'clusterfuzz': {'handlers': ['console', 'file'],
                         'level': logging.DEBUG}})
 logger = None
-current_chunk = []
 
 def start_loggers():
   global logger
@@ -51,13 +50,7 @@ def start_loggers():
   config.dictConfig(logging_config)
   logger = logging.getLogger('clusterfuzz')
 
-def send_output(output_chunk):
-  """Send a chunk of command line output to a file."""
+def send_output(line):
+  """Send a line of command line output to a file."""
 
-  global current_chunk
-  for x in output_chunk:
-    if x == '\n':
-      logger.debug(''.join(current_chunk))
-      current_chunk = []
-    else:
-      current_chunk.append(x)
+  logger.debug(line)
@@ -19,6 +19,7 @@ import logging
 
 from clusterfuzz import common
 from clusterfuzz import local_logging
+from clusterfuzz import tracing
 
 logger = logging.getLogger('clusterfuzz')
 
@@ -64,11 +65,67 @@ def execute(argv=None):
   reproduce.add_argument(
       '--edit-mode', action='store_true', default=False,
       help='Edit args.gn before building and target arguments before running.')
+  reproduce.add_argument(
+      '--gn-check', action='store_true', default=False,
+      help=('Check the includes of the build with "gn gen --check", which '
+            'takes a while on Chromium.'))
+  reproduce.add_argument(
+      '--force-sync', action='store_true', default=False,
+      help=('Run "gclient sync", the hooks and the toolchain updates even when '
+            'what they depend on is unchanged since they last ran.'))
+  reproduce.add_argument(
+      '--trace-file', action='store', default=None,
+      help=('Write a timeline of the run to this file, which can be loaded in '
+            'chrome://tracing.'))
+
+  prefetch = subparsers.add_parser(
+      'prefetch', help=('Fetch what reproducing testcases needs ahead of '
+                        'time, several testcases at once.'))
+  prefetch.add_argument('testcase_ids', nargs='+', metavar='testcase_id',
+                        help='The testcase IDs.')
+  prefetch.add_argument(
+      '-b', '--build', action='store', default='chromium',
+      choices=['download', 'chromium', 'standalone'],
+      help=('The type of build the testcases will be reproduced against. '
+            '"download" fetches the builds, the others the source revisions.'))
+  prefetch.add_argument(
+      '-j', action='store', default=None, type=int,
+      help='The number of testcases to fetch at once (default: 4).')
+
+  cache = subparsers.add_parser(
+      'cache', help='Manage the builds and testcases kept in the cache.')
+  cache_actions = cache.add_subparsers(dest='action')
+  cache_actions.add_parser(
+      'list', help='List the cache entries, least recently used first.')
+  cache_actions.add_parser('size', help='Show how much of the budget is used.')
+  for action, verb in [('pin', 'Keep'), ('unpin', 'Stop keeping')]:
+    pin = cache_actions.add_parser(
+        action, help='%s entries regardless of the budget.' % verb)
+    pin.add_argument('key', help='A key, a key prefix or a testcase ID.')
+  prune = cache_actions.add_parser(
+      'prune', help='Evict the least recently used entries over the budget.')
+  prune.add_argument(
+      '--budget', action='store', default=None,
+      help=('The budget to prune to, e.g. 50G. Defaults to $CF_CACHE_BUDGET, '
+            'or 100G.'))
+  prune.add_argument(
+      '--untracked', action='store_true', default=False,
+      help='Also remove builds and testcases that the cache index lacks.')
 
   args = parser.parse_args(argv)
   command = importlib.import_module('clusterfuzz.commands.%s' % args.command)
 
   arg_dict = {k: v for k, v in vars(args).items()}
   del arg_dict['command']
+  trace_file = arg_dict.pop('trace_file', None)
+
+  if not trace_file:
+    command.execute(**arg_dict)
+    return
 
-  command.execute(**arg_dict)
+  tracing.start()
+  try:
+    with tracing.span(args.command):
+      command.execute(**arg_dict)
+  finally:
+    tracing.write(trace_file)
@@ -0,0 +1,194 @@
+"""Profiles a ninja build from the .ninja_log in its build directory."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import bisect
+import logging
+import collections
+
+from clusterfuzz import local_logging
+
+NINJA_LOG_NAME = '.ninja_log'
+PROFILE_FILE_PATH = os.path.join(local_logging.LOG_DIR, 'build_profile.json')
+SLOWEST_EDGES_COUNT = 10
+COMPILE_EXTENSIONS = ('.o', '.obj')
+LINK_EXTENSIONS = ('', '.so', '.a', '.exe', '.nexe')
+logger = logging.getLogger('clusterfuzz')
+
+Edge = collections.namedtuple('Edge', 'start end cmd_hash outputs')
+
+
+class NinjaLogError(Exception):
+  """Raised when a .ninja_log cannot be understood."""
+
+
+def parse(path):
+  """Reads a v5 .ninja_log and returns its builds, oldest first, each as a
+  list of edges in the order they finished.
+
+  The log is appended to by every build, with times relative to the start of
+  that build, so a build begins wherever the end times go backwards."""
+  builds = []
+  entries = collections.OrderedDict()
+  last_end = None
+
+  with open(path) as f:
+    header = f.readline()
+    if not header.startswith('# ninja log v5'):
+      raise NinjaLogError('Unsupported ninja log: %s' % header.strip())
+    for line in f:
+      fields = line.rstrip('\n').split('\t')
+      if len(fields) != 5:
+        continue
+      start, end, _, output, cmd_hash = fields
+      start, end = int(start), int(end)
+      if last_end is not None and end < last_end:
+        builds.append(entries)
+        entries = collections.OrderedDict()
+      last_end = end
+      # The outputs of one edge are logged one per line, with the same times.
+      entries.setdefault((start, end, cmd_hash), []).append(output)
+  builds.append(entries)
+
+  return [[Edge(start, end, cmd_hash, outputs)
+           for (start, end, cmd_hash), outputs in entries.iteritems()]
+          for entries in builds if entries]
+
+
+def get_kind(edge):
+  """Returns whether an edge compiles, links or does something else."""
+  extension = os.path.splitext(edge.outputs[0])[1]
+  if extension in COMPILE_EXTENSIONS:
+    return 'compile'
+  if extension in LINK_EXTENSIONS:
+    return 'link'
+  return 'other'
+
+
+def get_critical_path(edges):
+  """Estimates the critical path of a build.
+
+  The log has no dependencies, so starting from the last edge to finish, the
+  edge that finished last before the current one started is taken to be the
+  one it waited for."""
+  if not edges:
+    return []
+  by_end = sorted(edges, key=lambda edge: edge.end)
+  ends = [edge.end for edge in by_end]
+
+  index = len(by_end) - 1
+  path = []
+  while index >= 0:
+    path.append(by_end[index])
+    index = bisect.bisect_right(ends, by_end[index].start, 0, index) - 1
+  path.reverse()
+  return path
+
+
+def describe(edge):
+  return {'output': edge.outputs[0], 'kind': get_kind(edge),
+          'seconds': (edge.end - edge.start) / 1000.0}
+
+
+def profile(builds, jobs):
+  """Profiles the last of builds, which was run with -j <jobs>."""
+  edges = builds[-1] if builds else []
+  # Later builds overwrite what is known about an output.
+  known_outputs = {}
+  for build in builds[:-1]:
+    for edge in build:
+      for output in edge.outputs:
+        known_outputs[output] = edge.cmd_hash
+  for edge in edges:
+    for output in edge.outputs:
+      known_outputs.pop(output, None)
+  up_to_date_edges = set(known_outputs.itervalues())
+
+  wall_ms = (max(edge.end for edge in edges) -
+             min(edge.start for edge in edges)) if edges else 0
+  busy_ms = sum(edge.end - edge.start for edge in edges)
+  parallelism = float(busy_ms) / wall_ms if wall_ms else 0.0
+  critical_path = get_critical_path(edges)
+
+  slowest = {}
+  for kind in ['compile', 'link']:
+    kind_edges = [edge for edge in edges if get_kind(edge) == kind]
+    kind_edges.sort(key=lambda edge: edge.end - edge.start, reverse=True)
+    slowest[kind] = [describe(edge)
+                     for edge in kind_edges[:SLOWEST_EDGES_COUNT]]
+
+  return {
+      'jobs': jobs,
+      'edges_rebuilt': len(edges),
+      'edges_up_to_date': len(up_to_date_edges),
+      'cold_out_dir': len(builds) <= 1,
+      'wall_seconds': wall_ms / 1000.0,
+      'busy_seconds': busy_ms / 1000.0,
+      'parallelism': parallelism,
+      'utilization': parallelism / jobs if jobs else 0.0,
+      'critical_path_seconds': sum(
+          edge.end - edge.start for edge in critical_path) / 1000.0,
+      'critical_path': [describe(edge) for edge in critical_path],
+      'slowest': slowest}
+
+
+def format_report(build_profile):
+  """Returns the profile as text, for the log."""
+  lines = [
+      'Build profile:',
+      '  Edges rebuilt: %d, already up to date: %d%s' % (
+          build_profile['edges_rebuilt'], build_profile['edges_up_to_date'],
+          ' (cold out dir)' if build_profile['cold_out_dir'] else ''),
+      '  Wall time: %.1fs, busy time: %.1fs' % (
+          build_profile['wall_seconds'], build_profile['busy_seconds']),
+      '  Effective parallelism: %.1f of -j %d (%.0f%%)' % (
+          build_profile['parallelism'], build_profile['jobs'],
+          100 * build_profile['utilization']),
+      '  Critical path: %.1fs over %d edges' % (
+          build_profile['critical_path_seconds'],
+          len(build_profile['critical_path']))]
+  for edge in build_profile['critical_path'][-SLOWEST_EDGES_COUNT:]:
+    lines.append('    %8.1fs %s' % (edge['seconds'], edge['output']))
+  for kind in ['compile', 'link']:
+    lines.append('  Slowest %s edges:' % kind)
+    for edge in build_profile['slowest'][kind]:
+      lines.append('    %8.1fs %s' % (edge['seconds'], edge['output']))
+  return '\n'.join(lines)
+
+
+def report(build_directory, jobs, start_time, path=PROFILE_FILE_PATH):
+  """Profiles the build in build_directory that started at start_time, logs
+  the profile and writes it to path as JSON. Returns the profile, or None
+  without a usable log."""
+  log_path = os.path.join(build_directory, NINJA_LOG_NAME)
+  try:
+    builds = parse(log_path)
+    if os.path.getmtime(log_path) < start_time:
+      # Nothing was logged, so everything was already up to date.
+      builds.append([])
+  except (OSError, IOError, NinjaLogError) as e:
+    logger.debug('Not profiling the build: %s', e)
+    return None
+
+  build_profile = profile(builds, jobs)
+  logger.info(format_report(build_profile))
+
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'w') as f:
+    json.dump(build_profile, f, indent=2)
+  logger.debug('Build profile written to: %s', path)
+  return build_profile
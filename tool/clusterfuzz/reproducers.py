@@ -15,6 +15,7 @@
 
 import os
 import re
+import errno
 import time
 import subprocess
 import logging
@@ -27,7 +28,11 @@ import psutil
 
 from cmd_editor import editor
 from clusterfuzz import common
+from clusterfuzz import resource_usage
+from clusterfuzz import tracing
 
+CLUSTERFUZZ_PARSE_STACKTRACE_URL = (
+    'https://%s/v2/parse_stacktrace' % common.DOMAIN_NAME)
 DISABLE_GL_DRAW_ARG = '--disable-gl-drawing-for-tests'
 DEFAULT_GESTURE_TIME = 5
 TEST_TIMEOUT = 30
@@ -103,9 +108,29 @@ def is_similar(new_type, new_state_lines, original_type, original_state_lines):
   return count >= len(original_state_lines)
 
 
+def write_symbolizer_input(stdin, output):
+  """Writes output to the symbolizer, followed by the null byte ending it."""
+  try:
+    for chunk in output.iter_chunks():
+      stdin.write(chunk)
+    stdin.write('\0')
+  except IOError as e:
+    # The symbolizer exited early; its own output tells why.
+    if e.errno != errno.EPIPE:
+      raise
+  finally:
+    try:
+      stdin.close()
+    except IOError:
+      pass
+
+
 class BaseReproducer(object):
   """The basic reproducer class that all other ones are built on."""
 
+  # Whether a downloaded build is only extracted as far as the binary needs.
+  EXTRACT_NEEDED_ONLY = False
+
   def get_gesture_start_time(self):
     """Determine how long to sleep before running gestures."""
 
@@ -124,6 +149,7 @@ class BaseReproducer(object):
     self.environment = testcase.environment
     self.args = testcase.reproduction_args
     self.target_args = target_args
+    self.binary_provider = binary_provider
     self.binary_path = binary_provider.get_binary_path()
     self.build_directory = binary_provider.get_build_directory()
     self.source_directory = binary_provider.source_directory
@@ -198,13 +224,14 @@ class BaseReproducer(object):
     return common.execute(
         self.binary_path, self.args,
         os.path.dirname(self.binary_path), env=self.environment,
-        exit_on_error=False)
+        exit_on_error=False, lazy_output=True)
 
+  @tracing.traced(category='http')
   def get_stacktrace_info(self, trace):
     """Post a stacktrace, return (crash_state, crash_type)."""
 
     response = requests.post(
-        url=('https://clusterfuzz.com/v2/parse_stacktrace'),
+        url=CLUSTERFUZZ_PARSE_STACKTRACE_URL,
         data=json.dumps({'job': self.job_type, 'stacktrace': trace}))
     response = json.loads(response.text)
     crash_state = [x for x in response['crash_state'].split('\n') if x]
@@ -244,16 +271,23 @@ class BaseReproducer(object):
 
     logger.info('Reproducing...')
 
-    self.pre_build_steps()
+    with tracing.span('pre_build_steps'):
+      self.pre_build_steps()
 
     iterations = 1
     while iterations <= iteration_max:
-      _, output = self.reproduce_crash()
+      with tracing.span('reproduce_crash', iteration=iterations), \
+          resource_usage.phase('reproduce'):
+        _, output = self.reproduce_crash()
 
       print
-      logger.info(output)
+      for line in output.iter_lines():
+        logger.info(line)
 
-      new_crash_state, new_crash_type = self.get_stacktrace_info(output)
+      # A run that spilled to disk is only sent as its head and tail.
+      new_crash_state, new_crash_type = self.get_stacktrace_info(
+          output.summary())
+      output.close()
 
       logger.info(
           'New crash type: %s\n'
@@ -272,14 +306,21 @@ class BaseReproducer(object):
         logger.info("The stacktrace doesn't match the original stacktrace.")
         logger.info('Try again (%d times). Press Ctrl+C to stop trying to '
                     'reproduce.', iterations)
+      # What the binary needs was extracted first; the crash may need more.
+      if self.EXTRACT_NEEDED_ONLY:
+        self.binary_provider.extract_remaining()
       iterations += 1
-      time.sleep(3)
+      with tracing.span('sleep'):
+        time.sleep(3)
     sys.exit(1)
 
 
 class LibfuzzerJobReproducer(BaseReproducer):
   """A reproducer for libfuzzer job types."""
 
+  # A fuzz target needs only a fraction of a full build's files.
+  EXTRACT_NEEDED_ONLY = True
+
   def pre_build_steps(self):
     """Steps to run before building."""
     args = deserialize_libfuzzer_args(self.args)
@@ -298,6 +339,11 @@ class Xvfb(object):
   def __enter__(self):
     if self.disable_xvfb:
       return None
+    with tracing.span('start_xvfb'):
+      return self.start()
+
+  def start(self):
+    """Starts the virtual display and the window manager in it."""
     self.display = xvfbwrapper.Xvfb(width=1280, height=1024)
     self.display.start()
     for i in self.display.xvfb_cmd:
@@ -349,6 +395,7 @@ class LinuxChromeJobReproducer(BaseReproducer):
     """Run a command, returning its output."""
     common.execute('xdotool', command, '.', env={'DISPLAY': display_name})
 
+  @tracing.traced
   def find_windows_for_process(self, process_id, display_name):
     """Return visible windows belonging to a process."""
     pids = self.get_process_ids(process_id)
@@ -358,12 +405,14 @@ class LinuxChromeJobReproducer(BaseReproducer):
     logger.info(
         'Waiting for 20 seconds to ensure all windows appear: '
         'pid=%s, display=%s', pids, display_name)
-    time.sleep(20)
+    with tracing.span('sleep'):
+      time.sleep(20)
 
     visible_windows = set()
     for pid in pids:
-      _, windows = common.execute(
-          'xdotool', 'search --all --pid %s --onlyvisible --name ".*"' % pid,
+      _, windows = common.execute_argv(
+          ['xdotool', 'search', '--all', '--pid', str(pid), '--onlyvisible',
+           '--name', '.*'],
           '.', env={'DISPLAY': display_name}, exit_on_error=False,
           print_command=False, print_output=False)
       for line in windows.splitlines():
@@ -385,10 +434,12 @@ class LinuxChromeJobReproducer(BaseReproducer):
       self.xdotool_command('%s -- %s' % (gesture_type, gesture_cmd),
                            display_name)
 
+  @tracing.traced
   def run_gestures(self, proc, display_name):
     """Executes all required gestures."""
 
-    time.sleep(self.gesture_start_time)
+    with tracing.span('sleep'):
+      time.sleep(self.gesture_start_time)
     logger.info('Running gestures...')
     windows = self.find_windows_for_process(proc.pid, display_name)
     for _, window in enumerate(windows):
@@ -421,25 +472,33 @@ class LinuxChromeJobReproducer(BaseReproducer):
     super(LinuxChromeJobReproducer, self).pre_build_steps()
 
 
+  @tracing.traced
   def post_run_symbolize(self, output):
     """Symbolizes non-libfuzzer chrome jobs."""
-    if not output.strip():
+    if output.is_blank():
       # If no input, nothing to symbolize. Bail out, otherwise
       # we hang inside symbolizer.
-      return ''
+      output.close()
+      return common.CapturedOutput()
 
     asan_symbolizer_location = os.path.join(
         self.source_directory, os.path.join('tools', 'valgrind', 'asan',
                                             'asan_symbolize.py'))
     symbolizer_proxy_location = common.get_resource(
         0755, 'asan_symbolize_proxy.py')
-    proc = common.start_execute(
-        asan_symbolizer_location, '', os.path.expanduser('~'),
-        env={'LLVM_SYMBOLIZER_PATH': symbolizer_proxy_location,
-             'CHROMIUM_SRC': self.source_directory})
-    output += '\0'
-    out, _ = proc.communicate(input=output)
-    return out
+    with resource_usage.phase('symbolize'):
+      proc = common.start_execute(
+          asan_symbolizer_location, '', os.path.expanduser('~'),
+          env={'LLVM_SYMBOLIZER_PATH': symbolizer_proxy_location,
+               'CHROMIUM_SRC': self.source_directory})
+    # The output is streamed in while the symbolized output is read, so that
+    # neither has to fit in memory.
+    writer = common.run_async(write_symbolizer_input, proc.stdin, output)
+    _, symbolized_output = common.wait_execute(
+        proc, exit_on_error=False, print_output=False, lazy_output=True)
+    writer.wait()
+    output.close()
+    return symbolized_output
 
 
   def reproduce_crash(self):
@@ -456,5 +515,5 @@ class LinuxChromeJobReproducer(BaseReproducer):
         self.run_gestures(process, display_name)
 
       err, out = common.wait_execute(process, exit_on_error=False,
-                                     timeout=TEST_TIMEOUT)
+                                     timeout=TEST_TIMEOUT, lazy_output=True)
       return err, self.post_run_symbolize(out)
@@ -0,0 +1,244 @@
+"""Accounts for the resources used by the commands we run."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import logging
+import threading
+import collections
+import contextlib
+import psutil
+
+from clusterfuzz import local_logging
+
+SAMPLE_INTERVAL = 0.5
+SUMMARY_FILE_PATH = os.path.join(local_logging.LOG_DIR, 'resource_usage.json')
+# Downloads and extraction run inside the process; see in_process. gsutil
+# and wget are still run for some downloads.
+PHASES_BY_BINARY = {
+    'gsutil': 'download',
+    'wget': 'download',
+    'gclient': 'gclient',
+    'gn': 'gn',
+    'ninja': 'ninja',
+    'asan_symbolize.py': 'symbolize',
+}
+DEFAULT_PHASE = 'other'
+logger = logging.getLogger('clusterfuzz')
+
+current = threading.local()
+records_lock = threading.Lock()
+records = []
+
+
+@contextlib.contextmanager
+def phase(name):
+  """Attributes the commands run by this thread inside the block to name."""
+  previous = current_phase()
+  current.phase = name
+  try:
+    yield
+  finally:
+    current.phase = previous
+
+
+def current_phase():
+  """Returns the phase set for this thread, if any."""
+  return getattr(current, 'phase', None)
+
+
+def get_phase(binary):
+  """Returns the phase a command belongs to."""
+  return (current_phase() or
+          PHASES_BY_BINARY.get(os.path.basename(binary), DEFAULT_PHASE))
+
+
+def format_bytes(size):
+  """Formats a number of bytes for humans."""
+  for unit in ['B', 'KB', 'MB', 'GB']:
+    if size < 1024:
+      return '%.1f%s' % (size, unit)
+    size /= 1024.0
+  return '%.1fTB' % size
+
+
+class ProcessTreeMonitor(object):
+  """Samples the CPU time, RSS and I/O of a process and its descendants.
+
+  Counters are cumulative per process, so the last value seen for each pid is
+  kept. A process that exits between two samples loses at most
+  SAMPLE_INTERVAL seconds of accounting."""
+
+  def __init__(self, pid, command, phase_name):
+    self.pid = pid
+    self.command = command
+    self.phase = phase_name
+    self.start_time = time.time()
+    self.last_sample_time = None
+    self.cpu_seconds = {}
+    self.io_bytes = {}
+    self.peak_rss = 0
+
+  def next_sample_in(self):
+    """Returns the number of seconds until the next sample is due."""
+    if self.last_sample_time is None:
+      return 0
+    return max(0, self.last_sample_time + SAMPLE_INTERVAL - time.time())
+
+  def sample(self, force=False):
+    """Takes a sample of the process tree, if one is due."""
+    if not force and self.next_sample_in():
+      return
+    self.last_sample_time = time.time()
+
+    try:
+      root = psutil.Process(self.pid)
+      processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+      return
+
+    rss = 0
+    for process in processes:
+      try:
+        with process.oneshot():
+          cpu_times = process.cpu_times()
+          self.cpu_seconds[process.pid] = cpu_times.user + cpu_times.system
+          rss += process.memory_info().rss
+          io_counters = process.io_counters()
+          self.io_bytes[process.pid] = (io_counters.read_bytes +
+                                        io_counters.write_bytes)
+      except psutil.Error:
+        continue
+    self.peak_rss = max(self.peak_rss, rss)
+
+  def finish(self, returncode):
+    """Records the usage of the finished command and returns it."""
+    return record({
+        'command': self.command,
+        'phase': self.phase,
+        'returncode': returncode,
+        'wall_seconds': time.time() - self.start_time,
+        'cpu_seconds': sum(self.cpu_seconds.values()),
+        'peak_rss_bytes': self.peak_rss,
+        'io_bytes': sum(self.io_bytes.values()),
+    })
+
+
+def get_own_usage():
+  """Returns the CPU seconds, I/O bytes and RSS of this process so far."""
+  try:
+    process = psutil.Process()
+    with process.oneshot():
+      cpu_times = process.cpu_times()
+      rss = process.memory_info().rss
+      try:
+        io_counters = process.io_counters()
+        io_bytes = io_counters.read_bytes + io_counters.write_bytes
+      except AttributeError:
+        # Not every platform counts I/O per process.
+        io_bytes = 0
+  except psutil.Error:
+    return 0, 0, 0
+  return cpu_times.user + cpu_times.system, io_bytes, rss
+
+
+class InProcessMonitor(object):
+  """Accounts for work done inside this process, like downloading or
+  extracting across threads, as if it were a command. CPU time and I/O are
+  counted for the whole process, so they include what other threads do
+  meanwhile."""
+
+  def __init__(self, command, phase_name):
+    self.command = command
+    self.phase = current_phase() or phase_name
+    self.start_time = time.time()
+    self.start_cpu_seconds, self.start_io_bytes, self.start_rss = (
+        get_own_usage())
+
+  def finish(self, returncode):
+    """Records the usage of the finished work and returns it."""
+    cpu_seconds, io_bytes, rss = get_own_usage()
+    return record({
+        'command': self.command,
+        'phase': self.phase,
+        'returncode': returncode,
+        'wall_seconds': time.time() - self.start_time,
+        'cpu_seconds': cpu_seconds - self.start_cpu_seconds,
+        'peak_rss_bytes': max(rss, self.start_rss),
+        'io_bytes': io_bytes - self.start_io_bytes,
+    })
+
+
+@contextlib.contextmanager
+def in_process(phase_name, command):
+  """Records the usage of the work done inside the block as command, under
+  phase_name unless this thread is in a phase already."""
+  monitor = InProcessMonitor(command, phase_name)
+  try:
+    yield
+  except BaseException:
+    monitor.finish(1)
+    raise
+  monitor.finish(0)
+
+
+def record(usage):
+  """Adds the usage of a finished command to the summary, and returns it."""
+  with records_lock:
+    records.append(usage)
+  logger.debug(
+      '| Resource usage (%s): wall=%.1fs, cpu=%.1fs, peak_rss=%s, io=%s',
+      usage['phase'], usage['wall_seconds'], usage['cpu_seconds'],
+      format_bytes(usage['peak_rss_bytes']), format_bytes(usage['io_bytes']))
+  return usage
+
+
+def summarize():
+  """Returns the usage of every recorded command, totalled by phase."""
+  phases = collections.OrderedDict()
+  with records_lock:
+    commands = list(records)
+  for usage in commands:
+    total = phases.setdefault(usage['phase'], {
+        'commands': 0, 'wall_seconds': 0, 'cpu_seconds': 0,
+        'peak_rss_bytes': 0, 'io_bytes': 0})
+    total['commands'] += 1
+    total['wall_seconds'] += usage['wall_seconds']
+    total['cpu_seconds'] += usage['cpu_seconds']
+    total['peak_rss_bytes'] = max(total['peak_rss_bytes'],
+                                  usage['peak_rss_bytes'])
+    total['io_bytes'] += usage['io_bytes']
+  return {'phases': phases, 'commands': commands}
+
+
+def write_summary(job_type, path=SUMMARY_FILE_PATH):
+  """Logs the usage of this run by phase, and writes it to path as JSON."""
+  summary = summarize()
+  summary['job_type'] = job_type
+
+  logger.debug('Resource usage by phase:')
+  for name, total in summary['phases'].iteritems():
+    logger.debug(
+        '  %-10s commands=%d, wall=%.1fs, cpu=%.1fs, peak_rss=%s, io=%s',
+        name, total['commands'], total['wall_seconds'], total['cpu_seconds'],
+        format_bytes(total['peak_rss_bytes']), format_bytes(total['io_bytes']))
+
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'w') as f:
+    json.dump(summary, f, indent=2)
+  logger.debug('Resource usage summary written to: %s', path)
+  return summary
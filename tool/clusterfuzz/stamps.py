@@ -0,0 +1,90 @@
+"""Remembers the inputs that slow build steps last ran with, so that the
+steps can be skipped while their inputs are unchanged."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+import logging
+
+from clusterfuzz import common
+
+STAMPS_DIR = os.path.join(common.CLUSTERFUZZ_DIR, 'stamps')
+logger = logging.getLogger('clusterfuzz')
+
+
+def hash_file(path):
+  """Returns the SHA-1 of the file at path, or None if there is none."""
+  if not os.path.isfile(path):
+    return None
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_stamp_path(step, directory):
+  """Returns where the stamp of step for directory is kept."""
+  key = hashlib.sha1(os.path.abspath(directory)).hexdigest()
+  return os.path.join(STAMPS_DIR, key, '%s.json' % step)
+
+
+def get_fingerprint(inputs):
+  return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def is_current(step, directory, inputs, outputs=()):
+  """Returns whether step last succeeded in directory with inputs, and the
+  paths it outputs still exist."""
+  path = get_stamp_path(step, directory)
+  if not os.path.isfile(path):
+    return False
+  if not all(os.path.exists(output) for output in outputs):
+    return False
+  with open(path) as f:
+    try:
+      return json.load(f).get('fingerprint') == get_fingerprint(inputs)
+    except ValueError:
+      return False
+
+
+def record(step, directory, inputs):
+  """Records that step succeeded in directory with inputs."""
+  path = get_stamp_path(step, directory)
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  temporary_path = path + '.tmp'
+  with open(temporary_path, 'w') as f:
+    json.dump({'fingerprint': get_fingerprint(inputs), 'inputs': inputs,
+               'directory': os.path.abspath(directory)}, f)
+  os.rename(temporary_path, path)
+
+
+def clear(step, directory):
+  """Forgets that step succeeded in directory."""
+  path = get_stamp_path(step, directory)
+  if os.path.isfile(path):
+    os.remove(path)
+
+
+def run(step, directory, inputs, fn, force=False, outputs=()):
+  """Calls fn unless step already succeeded in directory with inputs and
+  the paths it outputs still exist, and records its success. Returns
+  whether fn was called."""
+  if not force and is_current(step, directory, inputs, outputs):
+    logger.info('Skipping %s: nothing it depends on changed since it last '
+                'ran.', step)
+    return False
+  fn()
+  record(step, directory, inputs)
+  return True
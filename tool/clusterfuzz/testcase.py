@@ -17,11 +17,12 @@ import os
 import zipfile
 import logging
 
+from clusterfuzz import artifact_store
+from clusterfuzz import cache
 from clusterfuzz import common
 
-CLUSTERFUZZ_TESTCASE_URL = (
-    'https://%s/v2/testcase-detail/download-testcase?id=%s' %
-    (common.DOMAIN_NAME, '%s'))
+# Written to a testcase's directory once its download is complete.
+DOWNLOADED_MARKER = '.downloaded'
 logger = logging.getLogger('clusterfuzz')
 
 class Testcase(object):
@@ -103,10 +104,16 @@ class Testcase(object):
       return true_testcase_path
 
   def get_testcase_path(self):
-    """Downloads & returns the location of the testcase file."""
+    """Downloads & returns the location of the testcase file. A download
+    that completed before, e.g. by prefetch, is reused."""
 
     testcase_dir = self.testcase_dir_name()
-    filename = os.path.join(testcase_dir, 'testcase%s' % self.file_extension)
+    marker_path = os.path.join(testcase_dir, DOWNLOADED_MARKER)
+    if os.path.exists(marker_path):
+      with open(marker_path) as f:
+        filename = f.read()
+      cache.use_testcase(self.id, testcase_dir, update=False)
+      return filename
     common.delete_if_exists(testcase_dir)
 
     logger.info('Downloading testcase data...')
@@ -115,12 +122,12 @@ class Testcase(object):
       os.makedirs(common.CLUSTERFUZZ_TESTCASES_DIR)
     os.makedirs(testcase_dir)
 
-    auth_header = common.get_stored_auth_header()
-    args = '--content-disposition --header="Authorization: %s" "%s"' % (
-        auth_header, CLUSTERFUZZ_TESTCASE_URL % self.id)
-    common.execute('wget', args, testcase_dir)
-    downloaded_filename = os.listdir(testcase_dir)[0]
+    downloaded_filename = artifact_store.get().download_testcase(
+        self.id, testcase_dir)
 
     filename = self.get_true_testcase_path(downloaded_filename)
+    with open(marker_path, 'w') as f:
+      f.write(filename)
+    cache.use_testcase(self.id, testcase_dir)
 
     return filename
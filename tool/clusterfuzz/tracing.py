@@ -0,0 +1,121 @@
+"""Records a timeline of a run in the Chrome trace-event format."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+
+logger = logging.getLogger('clusterfuzz')
+
+# Spans are only recorded after start() is called, so that tracing costs
+# nothing unless it is asked for.
+events = None
+events_lock = threading.Lock()
+named_threads = set()
+# Traces are meant to be shared, so credentials in commands are left out.
+AUTHORIZATION_PATTERN = re.compile(r'(Authorization:\s*)[^"\'\n]*',
+                                   re.IGNORECASE)
+
+
+def now():
+  """Returns the current time in microseconds, the unit of trace events."""
+  return int(time.time() * 1000000)
+
+
+def is_enabled():
+  return events is not None
+
+
+def start():
+  """Starts recording spans."""
+  global events
+  with events_lock:
+    events = []
+    named_threads.clear()
+
+
+def redact(value):
+  """Returns value, or the strings in it if it is a list, with the values of
+  Authorization headers replaced."""
+  if isinstance(value, basestring):
+    return AUTHORIZATION_PATTERN.sub(r'\1<redacted>', value)
+  if isinstance(value, (list, tuple)):
+    return [redact(item) for item in value]
+  return value
+
+
+def add_event(event):
+  """Records a trace event for the current thread."""
+  thread = threading.current_thread()
+  event['pid'] = os.getpid()
+  event['tid'] = thread.ident
+  with events_lock:
+    if events is None:
+      return
+    if thread.ident not in named_threads:
+      # Lets the timeline label the rows with the thread names.
+      named_threads.add(thread.ident)
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': event['pid'],
+                     'tid': thread.ident, 'args': {'name': thread.name}})
+    events.append(event)
+
+
+@contextlib.contextmanager
+def span(name, category='clusterfuzz', **args):
+  """Records the block as a span on the timeline. args are shown alongside it
+  when the span is selected."""
+  if not is_enabled():
+    yield
+    return
+
+  start_time = now()
+  try:
+    yield
+  finally:
+    add_event({'name': name, 'cat': category, 'ph': 'X', 'ts': start_time,
+               'dur': now() - start_time,
+               'args': {k: redact(v) for k, v in args.iteritems()}})
+
+
+def traced(func=None, name=None, category='clusterfuzz'):
+  """Decorates a function so that each call is recorded as a span. Can be used
+  as @traced, or as @traced(name=..., category=...)."""
+  if func is None:
+    return functools.partial(traced, name=name, category=category)
+
+  span_name = name or func.__name__
+
+  @functools.wraps(func)
+  def wrapped(*args, **kwargs):
+    with span(span_name, category):
+      return func(*args, **kwargs)
+  return wrapped
+
+
+def write(path):
+  """Stops recording spans and writes them to path, so that the run can be
+  loaded in chrome://tracing or Perfetto."""
+  global events
+  with events_lock:
+    trace_events, events = events or [], None
+
+  with open(path, 'w') as f:
+    json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+  logger.info('Trace of this run written to: %s', path)
@@ -0,0 +1,142 @@
+"""Test the archive module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import shutil
+import zipfile
+import tempfile
+
+from clusterfuzz import archive
+import helpers
+
+
+def create_archive(path, members):
+  """Writes a zip with members, a list of (name, content, mode)."""
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zipped:
+    for name, content, mode in members:
+      info = zipfile.ZipInfo(name)
+      info.external_attr = mode << 16
+      zipped.writestr(info, content)
+
+
+class ExtractTest(helpers.ExtendedTestCase):
+  """Tests extract."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.print_progress_bar'])
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.archive_path = os.path.join(self.directory, 'build.zip')
+    self.destination = os.path.join(self.directory, 'builds')
+    create_archive(self.archive_path, [
+        ('build/', '', stat.S_IFDIR | 0755),
+        ('build/d8', 'binary' * 1000, stat.S_IFREG | 0755),
+        ('build/lib/libv8.so', 'library', stat.S_IFREG | 0644),
+        ('build/libv8_link.so', 'lib/libv8.so', stat.S_IFLNK | 0777),
+        ('build/args.gn', 'is_asan = true', 0)])
+
+  def test_extract(self):
+    """Test that contents, permissions and symlinks are extracted."""
+    archive.extract(self.archive_path, self.destination, threads=3)
+
+    build_dir = os.path.join(self.destination, 'build')
+    with open(os.path.join(build_dir, 'd8')) as f:
+      self.assertEqual('binary' * 1000, f.read())
+    self.assertEqual(0755, os.stat(os.path.join(build_dir, 'd8')).st_mode &
+                     0777)
+    self.assertEqual(0644, os.stat(os.path.join(
+        build_dir, 'lib', 'libv8.so')).st_mode & 0777)
+    self.assertEqual('lib/libv8.so',
+                     os.readlink(os.path.join(build_dir, 'libv8_link.so')))
+    with open(os.path.join(build_dir, 'args.gn')) as f:
+      self.assertEqual('is_asan = true', f.read())
+
+    last_call = self.mock.print_progress_bar.call_args
+    self.assertEqual(last_call[0][0], last_call[0][1])
+
+  def test_wait_for(self):
+    """Test that each member waits for the bytes it is stored in."""
+    offsets = []
+    archive.extract(self.archive_path, self.destination, threads=1,
+                    wait_for=offsets.append)
+
+    with zipfile.ZipFile(self.archive_path) as zipped:
+      infos = sorted(zipped.infolist(), key=lambda info: info.header_offset)
+      expected = [info.header_offset for info in infos[1:]]
+      expected.append(zipped.start_dir)
+    self.assertEqual(expected, offsets)
+
+  def test_unsafe_member(self):
+    """Test refusing members that escape the destination."""
+    create_archive(self.archive_path, [('../evil', 'evil', 0644)])
+    with self.assertRaises(archive.UnsafeMemberError):
+      archive.extract(self.archive_path, self.destination)
+    self.assertFalse(os.path.exists(os.path.join(self.directory, 'evil')))
+
+  def test_root_and_names(self):
+    """Test extracting some members of the root directory into destination."""
+    archive.extract(self.archive_path, self.destination, root='build',
+                    names=['build/d8', 'build/lib/libv8.so'])
+
+    self.assertEqual(['d8', 'lib'], sorted(os.listdir(self.destination)))
+    self.assertEqual(['libv8.so'],
+                     os.listdir(os.path.join(self.destination, 'lib')))
+
+
+class ExtractNeededTest(helpers.ExtendedTestCase):
+  """Tests extract_needed."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.print_progress_bar',
+                         'clusterfuzz.elf.get_needed_libraries'])
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.archive_path = os.path.join(self.directory, 'build.zip')
+    self.destination = os.path.join(self.directory, 'build_dir')
+    create_archive(self.archive_path, [
+        ('build/', '', stat.S_IFDIR | 0755),
+        ('build/fuzzer', 'fuzzer', stat.S_IFREG | 0755),
+        ('build/fuzzer.dict', 'dict', 0644),
+        ('build/fuzzer.options', 'options', 0644),
+        ('build/args.gn', 'is_asan = true', 0644),
+        ('build/libbase.so', 'libbase.so.1', stat.S_IFLNK | 0777),
+        ('build/libbase.so.1', 'base', 0644),
+        ('build/lib/libicu.so', 'icu', 0644),
+        ('build/icudtl.dat', 'data', 0644),
+        ('build/other_fuzzer', 'other', 0755),
+        ('build/other_fuzzer_seed_corpus.zip', 'corpus', 0644),
+        ('build/libunused.so', 'unused', 0644)])
+    needed = {'fuzzer': ['libbase.so', 'libc.so.6'],
+              'libbase.so.1': ['libicu.so']}
+    self.mock.get_needed_libraries.side_effect = (
+        lambda path: needed.get(os.path.basename(path), []))
+
+  def test_extract_needed(self):
+    """Test extracting the binary, its libraries and its data files."""
+    selected = archive.extract_needed(self.archive_path, self.destination,
+                                      'build', 'fuzzer')
+
+    expected = ['args.gn', 'fuzzer', 'fuzzer.dict', 'fuzzer.options',
+                'icudtl.dat', 'lib/libicu.so', 'libbase.so', 'libbase.so.1']
+    self.assertEqual(sorted('build/' + name for name in expected),
+                     sorted(selected))
+    extracted = []
+    for root, _, files in os.walk(self.destination):
+      extracted.extend(os.path.relpath(os.path.join(root, name),
+                                       self.destination) for name in files)
+    self.assertEqual(expected, sorted(extracted))
+    self.assertEqual('libbase.so.1', os.readlink(
+        os.path.join(self.destination, 'libbase.so')))
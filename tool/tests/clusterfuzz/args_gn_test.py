@@ -0,0 +1,92 @@
+"""Test the args_gn module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import args_gn
+import helpers
+
+
+class ParseTest(helpers.ExtendedTestCase):
+  """Tests parse."""
+
+  def test_parse(self):
+    """Test parsing comments, lists and values with '=' in them."""
+    content = '\n'.join([
+        '# Set by ClusterFuzz.',
+        'is_asan = true  # Trailing comment.',
+        '',
+        'extra_cflags = "-DFOO=1 # not a comment"',
+        'sanitizer_flags = [',
+        '  "-fsanitize=address",',
+        '  "-fsanitize-coverage=edge",  # Coverage.',
+        ']',
+        'v8_target_cpu="x86"'])
+
+    self.assertEqual({
+        'is_asan': 'true',
+        'extra_cflags': '"-DFOO=1 # not a comment"',
+        'sanitizer_flags': '["-fsanitize=address", '
+                           '"-fsanitize-coverage=edge"]',
+        'v8_target_cpu': '"x86"'}, args_gn.parse(content))
+
+  def test_escaped_quote(self):
+    """Test strings with escaped quotes."""
+    self.assertEqual({'defines': r'"A=\"b c\""'},
+                     args_gn.parse(r'defines = "A=\"b c\""'))
+
+  def test_errors(self):
+    """Test rejecting content that is not a list of assignments."""
+    for content in ['Not correct args.gn', 'a = "unterminated', 'a = [1,',
+                    'a += 1', 'a =']:
+      with self.assertRaises(args_gn.ParseError):
+        args_gn.parse(content)
+
+
+class SerializeTest(helpers.ExtendedTestCase):
+  """Tests serialize and fingerprint."""
+
+  def test_serialize(self):
+    """Test writing sorted assignments that parse back the same."""
+    args = args_gn.parse('use_goma = true\nflags = [\n  "a",\n  "b",\n]')
+    content = args_gn.serialize(args)
+
+    self.assertEqual('flags = ["a", "b"]\nuse_goma = true', content)
+    self.assertEqual(args, args_gn.parse(content))
+
+  def test_fingerprint(self):
+    """Test that only equivalent args share a fingerprint."""
+    fingerprint = args_gn.fingerprint(
+        args_gn.parse('is_asan = true\nuse_goma = false'))
+
+    self.assertEqual(args_gn.FINGERPRINT_LENGTH, len(fingerprint))
+    self.assertEqual(fingerprint, args_gn.fingerprint(args_gn.parse(
+        '# Comment.\nuse_goma=false\n\nis_asan = true  # ASan.')))
+    self.assertNotEqual(fingerprint, args_gn.fingerprint(
+        args_gn.parse('is_asan = true\nuse_goma = true')))
+
+
+class ReadTest(helpers.ExtendedTestCase):
+  """Tests read."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_read(self):
+    """Test reading args.gn files, and ones that are missing or broken."""
+    self.fs.CreateFile('/out/a/args.gn', contents='is_asan = true')
+    self.fs.CreateFile('/out/b/args.gn', contents='Not correct args.gn')
+
+    self.assertEqual({'is_asan': 'true'}, args_gn.read('/out/a/args.gn'))
+    self.assertIsNone(args_gn.read('/out/b/args.gn'))
+    self.assertIsNone(args_gn.read('/out/c/args.gn'))
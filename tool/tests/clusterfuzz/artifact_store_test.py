@@ -0,0 +1,223 @@
+"""Test the artifact_store module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mock
+
+import helpers
+from clusterfuzz import artifact_store
+from clusterfuzz import downloader
+
+BUILD_URL = 'https://storage.cloud.google.com/bucket/linux/abc.zip'
+
+
+class GetObjectPathTest(helpers.ExtendedTestCase):
+  """Tests get_object_path."""
+
+  def test_urls(self):
+    """Test the paths of Cloud Storage and other URLs."""
+    self.assertEqual('bucket/linux/abc.zip',
+                     artifact_store.get_object_path(BUILD_URL))
+    self.assertEqual('bucket/abc.zip',
+                     artifact_store.get_object_path('gs://bucket/abc.zip'))
+    self.assertEqual(
+        'builds/abc.zip',
+        artifact_store.get_object_path('http://example.com/builds/abc.zip'))
+
+
+class GetTest(helpers.ExtendedTestCase):
+  """Tests get."""
+
+  def get(self, location):
+    with mock.patch.dict(os.environ, {artifact_store.STORE_ENV_VAR: location}):
+      return artifact_store.get()
+
+  def test_remote(self):
+    """Test that the remote store is the default."""
+    with mock.patch.dict(os.environ):
+      os.environ.pop(artifact_store.STORE_ENV_VAR, None)
+      self.assertIsInstance(artifact_store.get(), artifact_store.RemoteStore)
+    self.assertIsInstance(self.get('remote'), artifact_store.RemoteStore)
+
+  def test_mirror(self):
+    """Test choosing an HTTP mirror."""
+    store = self.get('http://mirror:8000/')
+    self.assertIsInstance(store, artifact_store.HttpMirrorStore)
+    self.assertEqual('http://mirror:8000', store.base_url)
+
+  def test_local(self):
+    """Test choosing a local directory."""
+    self.assertEqual('/mnt/builds', self.get('file:///mnt/builds').root)
+    self.assertEqual(os.path.expanduser('~/builds'),
+                     self.get('~/builds').root)
+
+
+class RemoteStoreTest(helpers.ExtendedTestCase):
+  """Tests RemoteStore."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute',
+                         'clusterfuzz.common.get_stored_auth_header',
+                         'clusterfuzz.downloader.start_gcs_download',
+                         'os.listdir'])
+    self.store = artifact_store.RemoteStore()
+
+  def test_download(self):
+    """Test downloading builds from Cloud Storage over HTTP."""
+    self.assertEqual(
+        self.mock.start_gcs_download.return_value,
+        self.store.start_build_download(BUILD_URL, '/cache/abc.zip'))
+    self.assert_n_calls(0, [self.mock.execute])
+
+  def test_gsutil_fallback(self):
+    """Test downloading with gsutil when the bucket refuses HTTP."""
+    self.mock.start_gcs_download.side_effect = downloader.AuthorizationError(
+        BUILD_URL, 'HTTP 403')
+    download = self.store.start_build_download(BUILD_URL, '/cache/abc.zip')
+
+    self.assertEqual('/cache/abc.zip', download.wait())
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gsutil', 'cp gs://bucket/linux/abc.zip .', '/cache')])
+
+  def test_gsutil_fallback_on_errors(self):
+    """Test downloading with gsutil when HTTP fails in any other way."""
+    for error in [downloader.NetworkError(BUILD_URL, 'Connection reset'),
+                  downloader.DownloadError(BUILD_URL, 'HTTP 500')]:
+      self.mock.start_gcs_download.side_effect = error
+      self.assertIsInstance(
+          self.store.start_build_download(BUILD_URL, '/cache/abc.zip'),
+          artifact_store.StoredArchive)
+    self.assert_n_calls(2, [self.mock.execute])
+
+  def test_download_testcase(self):
+    """Test downloading a testcase from ClusterFuzz."""
+    self.mock.get_stored_auth_header.return_value = 'Bearer 1234'
+    self.mock.listdir.return_value = ['test.js']
+
+    self.assertEqual('test.js', self.store.download_testcase(5, '/testcase'))
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('wget', '--content-disposition --header="Authorization: '
+                  'Bearer 1234" "%s"' % (
+                      artifact_store.CLUSTERFUZZ_TESTCASE_URL % 5),
+                  '/testcase')])
+
+
+class LocalStoreTest(helpers.ExtendedTestCase):
+  """Tests LocalStore, entirely offline."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.artifact_store.RemoteStore.start_build_download',
+        'clusterfuzz.artifact_store.RemoteStore.open_build',
+        'clusterfuzz.artifact_store.RemoteStore.download_testcase'])
+    self.store = artifact_store.LocalStore('/mnt/store')
+    self.fs.CreateFile('/mnt/store/bucket/linux/abc.zip', contents='zip')
+    self.fs.CreateFile('/mnt/store/testcases/5/test.js', contents='crash()')
+
+  def test_build(self):
+    """Test using a stored build where it is."""
+    download = self.store.start_build_download(BUILD_URL, '/cache/abc.zip')
+
+    self.assertIsInstance(download, artifact_store.StoredArchive)
+    self.assertEqual('/mnt/store/bucket/linux/abc.zip', download.wait())
+    self.assertEqual('zip', self.store.open_build(BUILD_URL).read())
+    self.assertFalse(os.path.exists('/cache/abc.zip'))
+    self.assert_n_calls(0, [self.mock.start_build_download,
+                            self.mock.open_build])
+
+  def test_testcase(self):
+    """Test copying a stored testcase."""
+    os.makedirs('/testcase')
+    self.assertEqual('test.js', self.store.download_testcase(5, '/testcase'))
+    with open('/testcase/test.js') as f:
+      self.assertEqual('crash()', f.read())
+    self.assert_n_calls(0, [self.mock.download_testcase])
+
+  def test_missing(self):
+    """Test fetching what the directory does not have remotely."""
+    other_url = 'gs://bucket/linux/def.zip'
+    self.assertEqual(
+        self.mock.start_build_download.return_value,
+        self.store.start_build_download(other_url, '/cache/def.zip'))
+    self.assertEqual(self.mock.open_build.return_value,
+                     self.store.open_build(other_url))
+    self.assertEqual(self.mock.download_testcase.return_value,
+                     self.store.download_testcase(6, '/testcase'))
+
+    self.assert_exact_calls(self.mock.start_build_download, [
+        mock.call(self.store.remote, other_url, '/cache/def.zip')])
+    self.assert_exact_calls(self.mock.download_testcase, [
+        mock.call(self.store.remote, 6, '/testcase')])
+
+
+class HttpMirrorStoreTest(helpers.ExtendedTestCase):
+  """Tests HttpMirrorStore."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.artifact_store.RemoteStore.start_build_download',
+        'clusterfuzz.artifact_store.RemoteStore.download_testcase',
+        'clusterfuzz.common.execute',
+        'clusterfuzz.downloader.Download',
+        'clusterfuzz.downloader.RangeFile'])
+    self.store = artifact_store.HttpMirrorStore('http://mirror')
+    self.mirror_url = 'http://mirror/bucket/linux/abc.zip'
+
+  def test_build(self):
+    """Test downloading and opening a build on the mirror."""
+    self.assertEqual(
+        self.mock.Download.return_value.start.return_value,
+        self.store.start_build_download(BUILD_URL, '/cache/abc.zip'))
+    self.assertEqual(self.mock.RangeFile.return_value,
+                     self.store.open_build(BUILD_URL))
+
+    self.assert_exact_calls(self.mock.Download, [
+        mock.call(self.mirror_url, '/cache/abc.zip')])
+    self.assert_exact_calls(self.mock.RangeFile, [
+        mock.call(self.mirror_url)])
+    self.assert_n_calls(0, [self.mock.start_build_download])
+
+  def test_missing_build(self):
+    """Test downloading a build the mirror does not have remotely."""
+    self.mock.Download.return_value.start.side_effect = (
+        downloader.NotFoundError(self.mirror_url, 'HTTP 404'))
+    self.assertEqual(
+        self.mock.start_build_download.return_value,
+        self.store.start_build_download(BUILD_URL, '/cache/abc.zip'))
+
+  def test_testcase(self):
+    """Test downloading a testcase from the mirror."""
+    os.makedirs('/testcase')
+    self.mock.execute.side_effect = lambda *args, **kwargs: (
+        self.fs.CreateFile('/testcase/test.js') and (0, ''))
+
+    self.assertEqual('test.js', self.store.download_testcase(5, '/testcase'))
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('wget', '--content-disposition "http://mirror/testcases/5"',
+                  '/testcase', exit_on_error=False)])
+    self.assert_n_calls(0, [self.mock.download_testcase])
+
+  def test_missing_testcase(self):
+    """Test downloading a testcase the mirror does not have remotely."""
+    os.makedirs('/testcase')
+    self.mock.execute.return_value = (8, '')
+
+    self.assertEqual(self.mock.download_testcase.return_value,
+                     self.store.download_testcase(5, '/testcase'))
+    self.assert_exact_calls(self.mock.download_testcase, [
+        mock.call(self.store.remote, 5, '/testcase')])
+    self.assertTrue(os.path.isdir('/testcase'))
@@ -14,12 +14,23 @@
 # limitations under the License.
 
 import os
+import stat
 import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import StringIO
 import mock
+import requests
 
 import helpers
+from clusterfuzz import artifact_store
 from clusterfuzz import binary_providers
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import downloader
+from clusterfuzz import stamps
 
 
 class BuildRevisionToShaUrlTest(helpers.ExtendedTestCase):
@@ -40,11 +51,21 @@ class BuildRevisionToShaUrlTest(helpers.ExtendedTestCase):
                               '%2Fheads%2Fmaster'))
 
 
+def patch_cache_index(testcase_obj):
+  """Makes cache.get_index return an index in a temporary directory."""
+  directory = tempfile.mkdtemp()
+  testcase_obj.addCleanup(shutil.rmtree, directory)
+  helpers.patch(testcase_obj, ['clusterfuzz.cache.get_index'])
+  testcase_obj.mock.get_index.return_value = cache.CacheIndex(
+      os.path.join(directory, 'index.sqlite'))
+
+
 class ShaFromRevisionTest(helpers.ExtendedTestCase):
   """Tests the sha_from_revision method."""
 
   def setUp(self):
     helpers.patch(self, ['urlfetch.fetch'])
+    patch_cache_index(self)
 
   def test_get_sha_from_response_body(self):
     """Tests to ensure that the sha is grabbed from the response correctly"""
@@ -57,12 +78,25 @@ class ShaFromRevisionTest(helpers.ExtendedTestCase):
     result = binary_providers.sha_from_revision(123456, 'v8/v8')
     self.assertEqual(result, '1a2s3d4f')
 
+  def test_cached(self):
+    """Tests that a resolved revision is not asked of cr-rev again."""
+    self.mock.fetch.return_value = mock.Mock(
+        body=json.dumps({'git_sha': '1a2s3d4f'}))
+
+    binary_providers.sha_from_revision(123456, 'v8/v8')
+    self.assertEqual('1a2s3d4f',
+                     binary_providers.sha_from_revision(123456, 'v8/v8'))
+    self.assert_n_calls(1, [self.mock.fetch])
+    binary_providers.sha_from_revision(123456, 'chromium/src')
+    self.assert_n_calls(2, [self.mock.fetch])
+
 
 class GetPdfiumShaTest(helpers.ExtendedTestCase):
   """Tests the get_pdfium_sha method."""
 
   def setUp(self):
     helpers.patch(self, ['urlfetch.fetch'])
+    patch_cache_index(self)
     self.mock.fetch.return_value = mock.Mock(
         body=('dmFycyA9IHsNCiAgJ3BkZml1bV9naXQnOiAnaHR0cHM6Ly9wZGZpdW0uZ29vZ'
               '2xlc291cmNlLmNvbScsDQogICdwZGZpdW1fcmV2aXNpb24nOiAnNDA5MzAzOW'
@@ -77,53 +111,225 @@ class GetPdfiumShaTest(helpers.ExtendedTestCase):
          '/DEPS?format=TEXT'))])
     self.assertEqual(result, '4093039d19f832173ec58cfd9f2e8ac393a76091')
 
+  def test_cached(self):
+    """Tests that DEPS is downloaded only once per Chromium sha."""
+    binary_providers.get_pdfium_sha('chrome_sha')
+    self.assertEqual('4093039d19f832173ec58cfd9f2e8ac393a76091',
+                     binary_providers.get_pdfium_sha('chrome_sha'))
+    self.assert_n_calls(1, [self.mock.fetch])
+
 class DownloadBuildDataTest(helpers.ExtendedTestCase):
   """Tests the download_build_data test."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.execute',
-                         'clusterfuzz.common.get_source_directory',
-                         'os.remove',
-                         'os.rename'])
+    helpers.patch(self, [
+        'clusterfuzz.archive.extract',
+        'clusterfuzz.binary_providers.BinaryProvider.download_and_extract',
+        'clusterfuzz.cache.evict',
+        'clusterfuzz.cache.use_build',
+        'clusterfuzz.common.file_lock',
+        'clusterfuzz.common.get_source_directory'])
 
+    self.setup_fake_filesystem()
     self.build_url = 'https://storage.cloud.google.com/abc.zip'
-    self.provider = binary_providers.BinaryProvider(1234, self.build_url, 'd8')
+    self.provider = binary_providers.DownloadedBinary(
+        1234, self.build_url, 'd8')
+    self.build_dir = os.path.join(
+        common.CLUSTERFUZZ_BUILDS_DIR,
+        '%s_build' % cache.get_build_key(self.build_url))
+    self.saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip')
+    self.partial_archive = os.path.join(
+        self.build_dir, binary_providers.PARTIAL_BUILD_ARCHIVE)
+
+    def download_and_extract(unused_self, saved_file, destination,
+                             unused_needed_only):
+      self.fs.CreateFile(saved_file)
+      self.fs.CreateFile(os.path.join(destination, 'd8'))
+      return saved_file
+    self.mock.download_and_extract.side_effect = download_and_extract
 
   def test_build_data_already_downloaded(self):
     """Tests the exit when build data is already returned."""
 
-    self.setup_fake_filesystem()
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
-    os.makedirs(build_dir)
-    self.provider.build_dir = build_dir
+    os.makedirs(self.build_dir)
     result = self.provider.download_build_data()
-    self.assert_n_calls(0, [self.mock.execute])
-    self.assertEqual(result, build_dir)
+    self.assert_n_calls(0, [self.mock.download_and_extract, self.mock.evict,
+                            self.mock.extract])
+    self.assertEqual(result, self.build_dir)
+    self.assert_exact_calls(self.mock.use_build, [
+        mock.call(self.build_url, self.build_dir, 1234)])
 
   def test_get_build_data(self):
-    """Tests extracting, moving and renaming the build data.."""
+    """Tests extracting to a staging directory and moving it into place."""
 
-    helpers.patch(self, ['os.path.exists',
-                         'os.makedirs',
-                         'os.chmod',
-                         'os.stat',
-                         'clusterfuzz.binary_providers.os.remove'])
-    self.mock.stat.return_value = mock.Mock(st_mode=0000)
-    self.mock.exists.side_effect = [False, False]
+    self.provider.download_build_data()
 
+    self.assert_exact_calls(self.mock.evict, [mock.call()])
+    self.assert_exact_calls(self.mock.file_lock, [
+        mock.call(self.saved_file + '.lock')])
+    self.assert_exact_calls(self.mock.download_and_extract, [
+        mock.call(self.provider, self.saved_file, mock.ANY, False)])
+    staging_dir = self.mock.download_and_extract.call_args[0][2]
+    self.assertTrue(os.path.basename(staging_dir).startswith('.staging-'))
+    self.assertFalse(os.path.exists(staging_dir))
+    self.assertFalse(os.path.exists(self.saved_file))
+    self.assertFalse(os.path.exists(self.partial_archive))
+    self.assertTrue(os.stat(os.path.join(self.build_dir, 'd8')).st_mode &
+                    stat.S_IEXEC)
+    self.assert_exact_calls(self.mock.use_build, [
+        mock.call(self.build_url, self.build_dir, 1234)])
+
+  def test_get_needed_build_data(self):
+    """Tests keeping the archive when only what is needed is extracted."""
+
+    self.provider.download_build_data(needed_only=True)
+
+    self.assert_exact_calls(self.mock.download_and_extract, [
+        mock.call(self.provider, self.saved_file, mock.ANY, True)])
+    self.assertFalse(os.path.exists(self.saved_file))
+    self.assertTrue(os.path.exists(self.partial_archive))
+    self.assert_exact_calls(self.mock.use_build, [
+        mock.call(self.build_url, self.build_dir, 1234)])
+
+  def test_get_stored_build_data(self):
+    """Tests linking to an archive the artifact store keeps on disk."""
+
+    def download_and_extract(unused_self, unused_saved_file, destination,
+                             unused_needed_only):
+      self.fs.CreateFile(os.path.join(destination, 'd8'))
+      return '/store/abc.zip'
+    self.mock.download_and_extract.side_effect = download_and_extract
+    self.provider.download_build_data(needed_only=True)
+
+    self.assertFalse(os.path.exists(self.saved_file))
+    self.assertEqual('/store/abc.zip', os.readlink(self.partial_archive))
+
+  def test_complete_needed_build_data(self):
+    """Tests extracting the rest of a build when all of it is wanted."""
+
+    self.fs.CreateFile(self.partial_archive)
     self.provider.download_build_data()
 
-    self.assert_exact_calls(self.mock.execute, [
-        mock.call('gsutil', 'cp gs://abc.zip .',
-                  common.CLUSTERFUZZ_CACHE_DIR),
-        mock.call('unzip', '-q %s -d %s' %
-                  (os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip'),
-                   common.CLUSTERFUZZ_BUILDS_DIR),
-                  cwd=common.CLUSTERFUZZ_DIR)])
-    self.assert_exact_calls(self.mock.chmod, [
-        mock.call(os.path.join(
-            common.CLUSTERFUZZ_BUILDS_DIR, '1234_build', 'd8'), 64)
-    ])
+    self.assert_exact_calls(self.mock.extract, [
+        mock.call(self.partial_archive, self.build_dir, root='abc')])
+    self.assertFalse(os.path.exists(self.partial_archive))
+    self.assert_exact_calls(self.mock.use_build, [
+        mock.call(self.build_url, self.build_dir, 1234, update=True)])
+
+    self.assertFalse(self.provider.extract_remaining())
+    self.assertEqual(1, self.mock.extract.call_count)
+
+  def test_downloaded_meanwhile(self):
+    """Tests using the build another run downloaded while we waited."""
+
+    self.mock.file_lock.side_effect = lambda path: (
+        os.makedirs(self.build_dir) or mock.MagicMock())
+    self.provider.download_build_data()
+
+    self.assert_n_calls(0, [self.mock.download_and_extract])
+    self.assert_exact_calls(self.mock.use_build, [
+        mock.call(self.build_url, self.build_dir, 1234)])
+
+  def test_failed_download(self):
+    """Tests that a failed download leaves no build directory behind."""
+
+    self.mock.download_and_extract.side_effect = (
+        downloader.DownloadError(self.build_url, 'HTTP 500'))
+    with self.assertRaises(downloader.DownloadError):
+      self.provider.download_build_data()
+
+    self.assertFalse(os.path.exists(self.build_dir))
+    self.assertEqual([], os.listdir(common.CLUSTERFUZZ_BUILDS_DIR))
+    self.assert_n_calls(0, [self.mock.use_build])
+
+
+class DownloadAndExtractTest(helpers.ExtendedTestCase):
+  """Tests the download_and_extract method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.archive.extract',
+                         'clusterfuzz.archive.extract_needed',
+                         'clusterfuzz.artifact_store.get'])
+    self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.provider = binary_providers.BinaryProvider(1234, self.build_url, 'd8')
+    self.store = self.mock.get.return_value
+    self.download = self.store.start_build_download.return_value
+    self.download.partial_path = '/cache/abc.zip.partial'
+
+  def test_extract_while_downloading(self):
+    """Tests extracting the archive as it downloads."""
+    self.assertEqual(
+        '/cache/abc.zip',
+        self.provider.download_and_extract('/cache/abc.zip', '/staging'))
+
+    self.assert_exact_calls(self.store.start_build_download, [
+        mock.call(self.build_url, '/cache/abc.zip')])
+    self.download.wait_for_tail.assert_called_once_with()
+    self.assert_exact_calls(self.mock.extract, [
+        mock.call('/cache/abc.zip.partial', '/staging', root='abc',
+                  wait_for=self.download.wait_for, show_progress=False)])
+    self.download.wait.assert_called_once_with()
+    self.assert_n_calls(0, [self.download.close, self.mock.extract_needed])
+
+  def test_extract_needed(self):
+    """Tests extracting only what the binary needs."""
+    self.provider.download_and_extract('/cache/abc.zip', '/staging',
+                                       needed_only=True)
+
+    self.assert_exact_calls(self.mock.extract_needed, [
+        mock.call('/cache/abc.zip.partial', '/staging', 'abc', 'd8',
+                  wait_for=self.download.wait_for, show_progress=False)])
+    self.download.wait.assert_called_once_with()
+    self.assert_n_calls(0, [self.mock.extract])
+
+  def test_big_directory(self):
+    """Tests extracting after the download when the directory is not in the
+    last chunk."""
+    self.mock.extract.side_effect = [zipfile.BadZipfile, None]
+    self.provider.download_and_extract('/cache/abc.zip', '/staging')
+
+    self.download.wait.assert_called_once_with()
+    self.assert_exact_calls(self.mock.extract, [
+        mock.call('/cache/abc.zip.partial', '/staging', root='abc',
+                  wait_for=self.download.wait_for, show_progress=False),
+        mock.call('/cache/abc.zip', '/staging', root='abc')])
+
+  def test_failure(self):
+    """Tests stopping the download when extracting fails."""
+    self.download.wait.side_effect = downloader.ChecksumError('url', 'bad')
+    with self.assertRaises(downloader.ChecksumError):
+      self.provider.download_and_extract('/cache/abc.zip', '/staging')
+    self.download.close.assert_called_once_with()
+
+  def test_stored_archive(self):
+    """Tests extracting an archive the store has on disk in one go."""
+    self.store.start_build_download.return_value = (
+        artifact_store.StoredArchive('/store/abc.zip'))
+    self.assertEqual(
+        '/store/abc.zip',
+        self.provider.download_and_extract('/cache/abc.zip', '/staging'))
+
+    self.assert_exact_calls(self.mock.extract, [
+        mock.call('/store/abc.zip', '/staging', root='abc')])
+
+
+class BuildDirNameTest(helpers.ExtendedTestCase):
+  """Tests the build_dir_name method."""
+
+  def test_shared_by_build_url(self):
+    """Tests that testcases on the same build archive share a directory."""
+    build_url = 'https://storage.cloud.google.com/abc.zip'
+    first = binary_providers.BinaryProvider(1, build_url, 'd8')
+    second = binary_providers.BinaryProvider(2, build_url, 'd8')
+    other = binary_providers.BinaryProvider(
+        1, 'https://storage.cloud.google.com/def.zip', 'd8')
+
+    self.assertEqual(first.build_dir_name(), second.build_dir_name())
+    self.assertNotEqual(first.build_dir_name(), other.build_dir_name())
+    self.assertEqual(
+        os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
+                     '%s_build' % cache.get_build_key(build_url)),
+        first.build_dir_name())
 
 
 class GetBinaryPathTest(helpers.ExtendedTestCase):
@@ -156,14 +362,19 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.V8Builder.build_target',
         'clusterfuzz.common.ask',
         'clusterfuzz.binary_providers.V8Builder.get_current_sha',
+        'clusterfuzz.binary_providers.V8Builder.get_gn_args',
         'clusterfuzz.common.execute',
         'clusterfuzz.common.get_source_directory'])
 
     self.setup_fake_filesystem()
     self.build_url = 'https://storage.cloud.google.com/abc.zip'
     self.mock.get_current_sha.return_value = '1a2s3d4f5g6h'
+    self.mock.get_gn_args.return_value = 'is_asan = true'
     self.mock.execute.return_value = [0, '']
     self.chrome_source = os.path.join('chrome', 'src', 'dir')
+    self.out_dir = os.path.join(
+        self.chrome_source, 'out', 'clusterfuzz_1a2s3d4f5g6h_%s' %
+        hashlib.sha1('is_asan = true').hexdigest()[:12])
 
   def test_parameter_not_set_valid_source(self):
     """Tests functionality when build has never been downloaded."""
@@ -176,10 +387,9 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         testcase, binary_definition, False, '/goma/dir', None, False)
 
     result = provider.get_build_directory()
-    self.assertEqual(result, os.path.join(self.chrome_source, 'out',
-                                          'clusterfuzz_12345_1a2s3d4f5g6h'))
-    self.assert_exact_calls(self.mock.download_build_data,
-                            [mock.call(provider)])
+    self.assertEqual(result, self.out_dir)
+    # args.gn is only read from the build when setting up the gn args.
+    self.assert_n_calls(0, [self.mock.download_build_data])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
@@ -198,10 +408,8 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
     self.mock.get_source_directory.return_value = self.chrome_source
 
     result = provider.get_build_directory()
-    self.assertEqual(result, os.path.join(self.chrome_source, 'out',
-                                          'clusterfuzz_12345_1a2s3d4f5g6h'))
-    self.assert_exact_calls(self.mock.download_build_data,
-                            [mock.call(provider)])
+    self.assertEqual(result, self.out_dir)
+    self.assert_n_calls(0, [self.mock.download_build_data])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
@@ -235,12 +443,14 @@ class DownloadedBuildGetBinaryDirectoryTest(helpers.ExtendedTestCase):
     """Tests functionality when build has never been downloaded."""
 
     provider = binary_providers.DownloadedBinary(12345, self.build_url, 'd8')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '12345_build')
+    build_dir = os.path.join(
+        common.CLUSTERFUZZ_BUILDS_DIR,
+        '%s_build' % cache.get_build_key(self.build_url))
 
     result = provider.get_build_directory()
     self.assertEqual(result, build_dir)
     self.assert_exact_calls(self.mock.download_build_data,
-                            [mock.call(provider)])
+                            [mock.call(provider, False)])
 
   def test_parameter_already_set(self):
     """Tests functionality when the build_directory parameter is already set."""
@@ -260,9 +470,13 @@ class BuildTargetTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.binary_providers.V8Builder.get_goma_cores',
         'clusterfuzz.binary_providers.V8Builder.setup_gn_args',
+        'clusterfuzz.binary_providers.V8Builder.get_sync_inputs',
         'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.ninja_log.report',
         'clusterfuzz.common.execute'])
+    self.setup_fake_filesystem()
     self.mock.get_goma_cores.return_value = 120
+    self.mock.get_sync_inputs.return_value = {'sha': '1a2s3d4f'}
 
   def test_correct_calls(self):
     """Tests the correct checks and commands are run to build."""
@@ -291,6 +505,185 @@ class BuildTargetTest(helpers.ExtendedTestCase):
             capture_output=False)
     ])
     self.assert_exact_calls(self.mock.setup_gn_args, [mock.call(builder)])
+    self.assert_exact_calls(self.mock.report, [
+        mock.call('/chrome/source/out/clusterfuzz_54321', 120, mock.ANY)])
+
+
+class SyncTest(helpers.ExtendedTestCase):
+  """Tests the sync method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.V8Builder.get_current_sha',
+        'clusterfuzz.common.execute'])
+    self.mock.get_current_sha.return_value = '1a2s3d4f'
+    self.fs.CreateFile('/chrome/.gclient', contents='solutions = []')
+    self.fs.CreateFile('/chrome/src/DEPS', contents='deps = {}')
+    testcase = mock.Mock(id=1234, build_url='', revision=54321)
+    self.mock_os_environment({'V8_SRC': '/chrome/src'})
+    self.builder = binary_providers.V8Builder(
+        testcase, mock.Mock(source_var='V8_SRC'), False, None, None, False)
+
+  def assert_synced(self, times):
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gclient', 'sync', '/chrome/src')] * times)
+
+  def test_unchanged(self):
+    """Tests syncing only once while nothing changes."""
+    self.builder.sync()
+    self.builder.sync()
+    self.assert_synced(1)
+
+  def test_changed(self):
+    """Tests syncing again when the revision, DEPS or .gclient change."""
+    self.builder.sync()
+    self.mock.get_current_sha.return_value = '5g6h7j8k'
+    self.builder.sync()
+    with open('/chrome/src/DEPS', 'w') as f:
+      f.write('deps = {"v8": "..."}')
+    self.builder.sync()
+    with open('/chrome/.gclient', 'w') as f:
+      f.write('solutions = [{}]')
+    self.builder.sync()
+    self.assert_synced(4)
+
+  def test_forced(self):
+    """Tests syncing again when forced to."""
+    self.builder.sync()
+    self.builder.force_sync = True
+    self.builder.sync()
+    self.assert_synced(2)
+
+
+class StampedPreBuildStepsTest(helpers.ExtendedTestCase):
+  """Tests skipping the pre-build steps while their inputs are unchanged."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.MsanV8Builder.get_current_sha',
+        'clusterfuzz.common.execute',
+        'clusterfuzz.common.execute_with_shell'])
+    self.mock.get_current_sha.return_value = '1a2s3d4f'
+    self.fs.CreateFile('/v8/DEPS', contents='hooks = []')
+    self.fs.CreateFile('/v8/tools/clang/scripts/update.py',
+                       contents='CLANG_REVISION = 1')
+    self.fs.CreateFile('/v8/build/install-build-deps.sh')
+    testcase = mock.Mock(id=1234, build_url='', revision=54321,
+                         gn_args='msan_track_origins = 0')
+    self.mock_os_environment({'V8_SRC': '/v8', 'GYP_DEFINES': ''})
+    self.builder = binary_providers.MsanV8Builder(
+        testcase, mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    self.builder.gn_args = 'msan_track_origins = 0'
+    self.runhooks = mock.call('gclient', 'runhooks', '/v8')
+    self.msan_runhooks = mock.call(
+        'gclient', 'runhooks', '/v8', env={'GYP_DEFINES': (
+            'msan=1 msan_track_origins=0 '
+            'use_prebuilt_instrumented_libraries=1')})
+
+  def test_hooks(self):
+    """Tests re-running the hooks only when their inputs change."""
+    self.builder.run_hooks()
+    self.builder.run_msan_hooks()
+    self.builder.run_hooks()
+    self.builder.run_msan_hooks()
+    self.assert_exact_calls(self.mock.execute,
+                            [self.runhooks, self.msan_runhooks])
+
+    self.mock_os_environment({'V8_SRC': '/v8', 'GYP_DEFINES': 'asan=1'})
+    self.builder.run_hooks()
+    self.builder.run_msan_hooks()
+    self.assert_exact_calls(self.mock.execute, [self.runhooks,
+                                                self.msan_runhooks] * 2)
+
+  def test_msan_then_plain(self):
+    """Tests that switching between MSan and other builds of the same
+    revision runs the hooks again, since both rewrite their outputs."""
+    plain_builder = binary_providers.V8Builder(
+        mock.Mock(id=1234, build_url='', revision=54321, gn_args=''),
+        mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    plain_builder.get_current_sha = lambda: '1a2s3d4f'
+
+    self.builder.run_hooks()
+    self.builder.run_msan_hooks()
+    plain_builder.run_hooks()
+    plain_builder.run_hooks()
+    self.builder.run_hooks()
+    self.builder.run_msan_hooks()
+
+    self.assert_exact_calls(self.mock.execute, [
+        self.runhooks, self.msan_runhooks, self.runhooks, self.runhooks,
+        self.msan_runhooks])
+
+  def test_msan_without_gn_args(self):
+    """Tests that the MSan hooks of a testcase without gn args use the
+    args.gn of its build, even before they are set up."""
+    builder = binary_providers.MsanV8Builder(
+        mock.Mock(id=1234, build_url='', revision=54321, gn_args=None),
+        mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    self.assertIsNone(builder.gn_args)
+    builder.get_build_gn_args = mock.Mock(
+        return_value='msan_track_origins = 0')
+
+    builder.run_hooks()
+    builder.run_msan_hooks()
+    builder.run_hooks()
+    builder.run_msan_hooks()
+
+    self.assert_exact_calls(self.mock.execute,
+                            [self.runhooks, self.msan_runhooks])
+    self.assert_exact_calls(builder.get_build_gn_args, [mock.call()])
+
+  def test_forced(self):
+    """Tests running the steps regardless of their stamps when forced to."""
+    self.builder.install_32bit_build_deps()
+    self.builder.install_32bit_build_deps()
+    self.builder.force_sync = True
+    self.builder.install_32bit_build_deps()
+    self.assert_exact_calls(self.mock.execute_with_shell, [
+        mock.call('build/install-build-deps.sh', '--lib32 --syms --no-prompt',
+                  '/v8')] * 2)
+
+  def test_failed_build_deps(self):
+    """Tests that a failed install-build-deps.sh leaves no stamp, so it runs
+    again next time."""
+    self.mock.execute_with_shell.side_effect = SystemExit(1)
+    with self.assertRaises(SystemExit):
+      self.builder.install_32bit_build_deps()
+    self.assertFalse(os.path.exists(
+        stamps.get_stamp_path('install_build_deps', '/v8')))
+
+    self.mock.execute_with_shell.side_effect = None
+    self.builder.install_32bit_build_deps()
+    self.builder.install_32bit_build_deps()
+    self.assert_exact_calls(self.mock.execute_with_shell, [
+        mock.call('build/install-build-deps.sh', '--lib32 --syms --no-prompt',
+                  '/v8')] * 2)
+
+  def test_clang(self):
+    """Tests updating clang when update.py changes or its toolchain is
+    gone."""
+    update = mock.call('python', 'tools/clang/scripts/update.py', '/v8')
+
+    def do_update(*unused_args):
+      if not os.path.exists('/v8/third_party/llvm-build/Release+Asserts'):
+        os.makedirs('/v8/third_party/llvm-build/Release+Asserts')
+    self.mock.execute.side_effect = do_update
+    self.builder.update_clang()
+    self.builder.update_clang()
+    self.assert_exact_calls(self.mock.execute, [update])
+
+    with open('/v8/tools/clang/scripts/update.py', 'w') as f:
+      f.write('CLANG_REVISION = 2')
+    self.builder.update_clang()
+    self.assert_exact_calls(self.mock.execute, [update] * 2)
+
+    os.rmdir('/v8/third_party/llvm-build/Release+Asserts')
+    self.builder.update_clang()
+    self.assert_exact_calls(self.mock.execute, [update] * 3)
 
 
 class SetupGnArgsTest(helpers.ExtendedTestCase):
@@ -317,7 +710,7 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
   def test_create_build_dir(self):
     """Tests setting up the args when the build dir does not exist."""
 
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    build_dir = self.builder.build_dir_name()
     os.makedirs(build_dir)
     with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
       f.write('goma_dir = /not/correct/dir\n')
@@ -327,7 +720,7 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [
-        mock.call('gn', 'gen --check %s' % self.testcase_dir,
+        mock.call('gn', 'gen %s' % self.testcase_dir,
                   '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(
@@ -339,7 +732,7 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     os.makedirs(self.testcase_dir)
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
       f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    build_dir = self.builder.build_dir_name()
     os.makedirs(build_dir)
     with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
       f.write('goma_dir = /not/correct/dir')
@@ -348,13 +741,133 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [
-        mock.call('gn', 'gen --check %s' % self.testcase_dir,
+        mock.call('gn', 'gen %s' % self.testcase_dir,
                   '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(
           f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true\nedited')
 
 
+  def test_args_unchanged(self):
+    """Tests leaving a build directory generated with the same args be."""
+
+    self.builder.gn_args = 'use_goma = true\ngoma_dir = "/goma/dir"'
+    self.builder.edit_mode = False
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'build.ninja'))
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'args.gn'),
+                       contents='# Generated.\ngoma_dir="/goma/dir"\n'
+                       'use_goma = true\n')
+
+    self.builder.build_directory = self.testcase_dir
+    self.builder.setup_gn_args()
+
+    self.assert_n_calls(0, [self.mock.execute])
+    with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
+      self.assertTrue(f.read().startswith('# Generated.'))
+    self.assertEqual('goma_dir = "/goma/dir"\nuse_goma = true',
+                     self.builder.gn_args)
+
+  def test_gn_check(self):
+    """Tests checking the includes on request, even with the same args."""
+
+    self.builder.gn_args = 'use_goma = true\ngoma_dir = "/goma/dir"'
+    self.builder.edit_mode = False
+    self.builder.gn_check = True
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'build.ninja'))
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'args.gn'),
+                       contents='goma_dir = "/goma/dir"\nuse_goma = true')
+
+    self.builder.build_directory = self.testcase_dir
+    self.builder.setup_gn_args()
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gn', 'gen --check %s' % self.testcase_dir,
+                  '/chrome/source/dir')])
+
+
+class GetBuildGnArgsTest(helpers.ExtendedTestCase):
+  """Tests the get_build_gn_args method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.V8Builder.download_build_data',
+        'clusterfuzz.binary_providers.V8Builder.read_remote_build_files',
+        'clusterfuzz.binary_providers.sha_from_revision'])
+    testcase = mock.Mock(id=1234, revision=54321, gn_args=None,
+                         build_url='https://storage.cloud.google.com/abc.zip')
+    self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
+    self.builder = binary_providers.V8Builder(
+        testcase, mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    self.mock.read_remote_build_files.return_value = {
+        'args.gn': 'is_asan = true'}
+
+    def download_build_data(builder):
+      self.fs.CreateFile(os.path.join(builder.build_dir_name(), 'args.gn'),
+                         contents='is_msan = true')
+    self.mock.download_build_data.side_effect = download_build_data
+
+  def test_remote(self):
+    """Tests reading only args.gn from the remote archive."""
+    self.assertEqual('is_asan = true', self.builder.get_build_gn_args())
+    self.assert_exact_calls(self.mock.read_remote_build_files, [
+        mock.call(self.builder, ['args.gn'])])
+    self.assert_n_calls(0, [self.mock.download_build_data])
+
+  def test_downloaded(self):
+    """Tests reading args.gn from a build that is downloaded already."""
+    self.fs.CreateFile(os.path.join(self.builder.build_dir_name(), 'args.gn'),
+                       contents='is_ubsan = true')
+    self.assertEqual('is_ubsan = true', self.builder.get_build_gn_args())
+    self.assert_n_calls(0, [self.mock.read_remote_build_files,
+                            self.mock.download_build_data])
+
+  def test_fallback(self):
+    """Tests downloading the build when the archive cannot be read."""
+    self.mock.read_remote_build_files.side_effect = downloader.DownloadError(
+        'url', 'the server does not serve byte ranges')
+    self.assertEqual('is_msan = true', self.builder.get_build_gn_args())
+    self.assert_exact_calls(self.mock.download_build_data,
+                            [mock.call(self.builder)])
+
+  def test_network_error(self):
+    """Tests downloading the build when the connection fails."""
+    self.mock.read_remote_build_files.side_effect = (
+        lambda builder, names: downloader.RangeFile(
+            'https://storage.googleapis.com/abc.zip'))
+    with mock.patch('requests.get', side_effect=requests.ConnectionError(
+        'Connection reset by peer')):
+      self.assertEqual('is_msan = true', self.builder.get_build_gn_args())
+    self.assert_exact_calls(self.mock.download_build_data,
+                            [mock.call(self.builder)])
+
+
+class ReadRemoteBuildFilesTest(helpers.ExtendedTestCase):
+  """Tests the read_remote_build_files method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.artifact_store.get'])
+    remote_file = StringIO.StringIO()
+    with zipfile.ZipFile(remote_file, 'w') as zipped:
+      zipped.writestr('abc/args.gn', 'is_asan = true')
+      zipped.writestr('abc/d8', 'binary')
+    self.store = self.mock.get.return_value
+    self.store.open_build.return_value = remote_file
+    self.provider = binary_providers.BinaryProvider(
+        1234, 'https://storage.cloud.google.com/abc.zip', 'd8')
+
+  def test_read(self):
+    """Tests reading files from the build directory of the archive."""
+    self.assertEqual({'args.gn': 'is_asan = true'},
+                     self.provider.read_remote_build_files(['args.gn']))
+    self.assert_exact_calls(self.store.open_build, [
+        mock.call('https://storage.cloud.google.com/abc.zip')])
+
+  def test_missing(self):
+    """Tests that a file missing from the archive is an error."""
+    with self.assertRaises(KeyError):
+      self.provider.read_remote_build_files(['missing'])
+
 
 class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
   """Tests the checkout_chrome_by_sha method."""
@@ -437,25 +950,94 @@ class V8BuilderOutDirNameTest(helpers.ExtendedTestCase):
     self.mock_os_environment({'V8_SRC': '/source/dir'})
     self.sha = '1a2s3d4f5g6h'
     self.mock.sha_from_revision.return_value = self.sha
-    testcase = mock.Mock(id=1234, build_url='', revision=54321)
+    self.builder = self.create_builder(1234)
+    self.fingerprint = hashlib.sha1(
+        'is_asan = true\nuse_goma = false').hexdigest()[:12]
+
+  def create_builder(self, testcase_id, gn_args='is_asan = true'):
+    testcase = mock.Mock(id=testcase_id, build_url='', revision=54321,
+                         gn_args=gn_args)
     binary_definition = mock.Mock(source_var='V8_SRC')
-    self.builder = binary_providers.V8Builder(
-        testcase, binary_definition, False, '/goma/dir', None, False)
+    return binary_providers.V8Builder(
+        testcase, binary_definition, False, None, None, False)
 
   def test_clean_dir(self):
     """Tests when no changes have been made to the dir."""
 
-    self.mock.execute.side_effect = [[0, self.sha], [0, '']]
+    self.mock.execute.side_effect = [[0, self.sha], [0, ''], [0, '']]
     result = self.builder.out_dir_name()
-    self.assertEqual(result, '/source/dir/out/clusterfuzz_1234_1a2s3d4f5g6h')
+    self.assertEqual(result, '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_%s' %
+                     self.fingerprint)
+    self.assertEqual(result, self.builder.out_dir_name())
+    self.assert_n_calls(3, [self.mock.execute])
 
   def test_dirty_dir(self):
     """Tests when changes have been made to the dir."""
 
-    self.mock.execute.side_effect = [[0, self.sha], [0, 'changes']]
+    self.mock.execute.side_effect = [[0, self.sha], [0, ''], [1, '']]
     result = self.builder.out_dir_name()
-    self.assertEqual(result,
-                     '/source/dir/out/clusterfuzz_1234_1a2s3d4f5g6h_dirty')
+    self.assertEqual(
+        result,
+        '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_%s_dirty' % self.fingerprint)
+
+  def test_shared_by_gn_args(self):
+    """Tests that testcases with the same args share a directory, whatever
+    their order and spacing, and others do not."""
+
+    self.mock.execute.return_value = [0, '']
+    same = self.create_builder(5678, 'use_goma = true\n\nis_asan=true')
+    other = self.create_builder(5678, 'is_msan = true')
+
+    self.assertEqual(self.builder.out_dir_name(), same.out_dir_name())
+    self.assertNotEqual(self.builder.out_dir_name(), other.out_dir_name())
+
+
+class SeedBuildDirectoryTest(helpers.ExtendedTestCase):
+  """Tests the seed_build_directory method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.V8Builder.get_gn_args_fingerprint',
+        'clusterfuzz.common.clone_directory'])
+    self.mock.get_gn_args_fingerprint.return_value = 'a' * 12
+    testcase = mock.Mock(id=1234, build_url='', revision=54321)
+    self.mock_os_environment({'V8_SRC': '/source'})
+    self.builder = binary_providers.V8Builder(
+        testcase, mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    self.builder.build_directory = '/source/out/clusterfuzz_1234_%s' % (
+        'a' * 12)
+
+  def create_out_dir(self, name, built_at=None):
+    log_path = os.path.join('/source/out', name, '.ninja_log')
+    self.fs.CreateFile(log_path)
+    if built_at is None:
+      os.remove(log_path)
+    else:
+      os.utime(log_path, (built_at, built_at))
+
+  def test_seed(self):
+    """Tests cloning the most recently built out dir with the same args."""
+    self.create_out_dir('clusterfuzz_1111_%s' % ('a' * 12), 100)
+    self.create_out_dir('clusterfuzz_2222_%s_dirty' % ('a' * 12), 200)
+    self.create_out_dir('clusterfuzz_3333_%s' % ('b' * 12), 300)
+    self.create_out_dir('clusterfuzz_4444_%s' % ('a' * 12))
+    self.create_out_dir('clusterfuzz_12345_%s' % ('a' * 40), 400)
+
+    self.builder.seed_build_directory()
+
+    self.assert_exact_calls(self.mock.clone_directory, [
+        mock.call('/source/out/clusterfuzz_2222_%s_dirty' % ('a' * 12),
+                  self.builder.build_directory)])
+
+  def test_no_seed(self):
+    """Tests starting from scratch without an out dir with the same args."""
+    self.builder.seed_build_directory()
+    self.create_out_dir('clusterfuzz_3333_%s' % ('b' * 12), 300)
+    self.builder.seed_build_directory()
+
+    self.assert_n_calls(0, [self.mock.clone_directory])
 
 
 class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
@@ -484,7 +1066,7 @@ class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
     os.makedirs(self.testcase_dir)
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
       f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    build_dir = self.builder.build_dir_name()
     os.makedirs(build_dir)
     with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
       f.write('goma_dir = /not/correct/dir')
@@ -493,7 +1075,7 @@ class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [mock.call(
-        'gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
+        'gn', 'gen %s' % self.testcase_dir, '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(
           f.read(),
@@ -507,7 +1089,7 @@ class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
     os.makedirs(self.testcase_dir)
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
       f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    build_dir = self.builder.build_dir_name()
     os.makedirs(build_dir)
     with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
       f.write('goma_dir = /not/correct/dir\n')
@@ -518,7 +1100,7 @@ class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [mock.call(
-        'gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
+        'gn', 'gen %s' % self.testcase_dir, '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(
           f.read(), 'pdf_is_standalone = true\nuse_goma = false')
@@ -532,9 +1114,13 @@ class PdfiumBuildTargetTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.PdfiumBuilder.setup_gn_args',
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.PdfiumBuilder.get_goma_cores',
+        'clusterfuzz.binary_providers.PdfiumBuilder.get_sync_inputs',
+        'clusterfuzz.ninja_log.report',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.get_pdfium_sha'])
+    self.setup_fake_filesystem()
     self.mock.get_goma_cores.return_value = 120
+    self.mock.get_sync_inputs.return_value = {'sha': '1a2s3d4f'}
     self.mock.sha_from_revision.return_value = 'chrome_sha'
     testcase = mock.Mock(id=1234, build_url='', revision=54321)
     self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
@@ -555,6 +1141,8 @@ class PdfiumBuildTargetTest(helpers.ExtendedTestCase):
             'ninja',
             "-w 'dupbuild=err' -C /build/dir -j 120 -l 15 pdfium_test",
             '/source/dir', capture_output=False)])
+    self.assert_exact_calls(self.mock.report,
+                            [mock.call('/build/dir', 120, mock.ANY)])
 
 class ChromiumBuilderTest(helpers.ExtendedTestCase):
   """Tests the methods in ChromiumBuilder."""
@@ -612,8 +1200,12 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
   def test_build_target(self):
     """Tests the build_target method."""
     helpers.patch(self, [
-        'clusterfuzz.binary_providers.ChromiumBuilder.get_goma_cores'])
+        'clusterfuzz.binary_providers.ChromiumBuilder.get_goma_cores',
+        'clusterfuzz.binary_providers.ChromiumBuilder.get_sync_inputs',
+        'clusterfuzz.ninja_log.report'])
+    self.setup_fake_filesystem()
     self.mock.get_goma_cores.return_value = 120
+    self.mock.get_sync_inputs.return_value = {'sha': '1a2s3d4f'}
     self.builder.build_target()
 
     self.assert_exact_calls(self.mock.setup_gn_args, [mock.call(self.builder)])
@@ -628,6 +1220,8 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
              '-j 120 -l 15 target'),
             '/chrome/src',
             capture_output=False)])
+    self.assert_exact_calls(self.mock.report, [
+        mock.call('/chrome/src/out/clusterfuzz_builds', 120, mock.ANY)])
 
   def test_get_binary_path(self):
     """Tests the get_binary_path method."""
@@ -647,6 +1241,7 @@ class CfiChromiumBuilderTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.ChromiumBuilder.pre_build_steps'])
+    self.setup_fake_filesystem()
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
@@ -670,7 +1265,10 @@ class MsanChromiumBuilderTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
-        'clusterfuzz.binary_providers.ChromiumBuilder.setup_gn_args'])
+        'clusterfuzz.binary_providers.ChromiumBuilder.setup_gn_args',
+        'clusterfuzz.binary_providers.MsanChromiumBuilder.get_sync_inputs'])
+    self.setup_fake_filesystem()
+    self.mock.get_sync_inputs.return_value = {'sha': '1a2s3d4f'}
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567,
                          gn_args='msan_track_origins=2\n')
@@ -696,7 +1294,10 @@ class MsanV8BuilderTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
-        'clusterfuzz.binary_providers.V8Builder.setup_gn_args'])
+        'clusterfuzz.binary_providers.V8Builder.setup_gn_args',
+        'clusterfuzz.binary_providers.MsanV8Builder.get_sync_inputs'])
+    self.setup_fake_filesystem()
+    self.mock.get_sync_inputs.return_value = {'sha': '1a2s3d4f'}
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567,
                          gn_args='msan_track_origins=2\n')
@@ -723,6 +1324,7 @@ class ChromiumBuilder32BitTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute_with_shell',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.ChromiumBuilder.pre_build_steps'])
+    self.setup_fake_filesystem()
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
@@ -750,6 +1352,7 @@ class V8Builder32BitTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute_with_shell',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.V8Builder.pre_build_steps'])
+    self.setup_fake_filesystem()
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
@@ -790,6 +1393,63 @@ class GetCurrentShaTest(helpers.ExtendedTestCase):
       builder.get_current_sha()
 
 
+class RepositoryStateTest(helpers.ExtendedTestCase):
+  """Tests RepositoryState."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute',
+                         'clusterfuzz.binary_providers.sha_exists'])
+    self.mock.sha_exists.return_value = False
+    self.repository = binary_providers.RepositoryState('/src')
+
+  def test_head(self):
+    """Test asking git for HEAD once until a checkout."""
+    self.mock.execute.return_value = (0, 'abcd\n')
+    self.assertEqual('abcd', self.repository.get_head())
+    self.assertEqual('abcd', self.repository.get_head())
+    self.repository.checkout('efgh')
+    self.repository.get_head()
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'rev-parse HEAD', '/src', print_command=False,
+                  print_output=False),
+        mock.call('git', 'checkout efgh', '/src'),
+        mock.call('git', 'rev-parse HEAD', '/src', print_command=False,
+                  print_output=False)])
+
+  def test_dirty(self):
+    """Test reading dirtiness from exit statuses only, once until a fetch."""
+    self.mock.execute.side_effect = [(0, ''), (1, ''), (0, ''), (0, ''),
+                                     (0, '')]
+    self.assertTrue(self.repository.is_dirty())
+    self.assertTrue(self.repository.is_dirty())
+    self.repository.fetch('efgh')
+    self.assertFalse(self.repository.is_dirty())
+
+    refresh = mock.call('git', 'update-index -q --refresh', '/src',
+                        print_command=False, print_output=False,
+                        exit_on_error=False)
+    diff_index = mock.call('git', 'diff-index --quiet HEAD --', '/src',
+                           print_command=False, print_output=False,
+                           exit_on_error=False)
+    self.assert_exact_calls(self.mock.execute, [
+        refresh, diff_index, mock.call('git', 'fetch origin efgh', '/src'),
+        refresh, diff_index])
+
+  def test_has_commit(self):
+    """Test that fetched and found commits are not looked up again."""
+    self.mock.execute.return_value = (0, '')
+    self.assertFalse(self.repository.has_commit('abcd'))
+    self.repository.fetch('abcd')
+    self.assertTrue(self.repository.has_commit('abcd'))
+
+    self.mock.sha_exists.return_value = True
+    self.assertTrue(self.repository.has_commit('efgh'))
+    self.assertTrue(self.repository.has_commit('efgh'))
+    self.assert_exact_calls(self.mock.sha_exists, [
+        mock.call('abcd', '/src'), mock.call('efgh', '/src')])
+
+
 class GetGomaCoresTest(helpers.ExtendedTestCase):
   """Tests to ensure the correct number of cores is set."""
 
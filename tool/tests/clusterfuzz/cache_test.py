@@ -0,0 +1,287 @@
+"""Test the cache module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import mock
+
+from clusterfuzz import cache
+import helpers
+
+
+def create_index(testcase_obj):
+  """Creates an index in a temporary directory. SQLite does its own I/O, so
+  it cannot use the fake filesystem."""
+  directory = tempfile.mkdtemp()
+  testcase_obj.addCleanup(shutil.rmtree, directory)
+  return cache.CacheIndex(os.path.join(directory, 'cache', 'index.sqlite'))
+
+
+class GetBuildKeyTest(helpers.ExtendedTestCase):
+  """Tests get_build_key."""
+
+  def test_key(self):
+    """Test that the key only depends on the URL."""
+    self.assertEqual(cache.get_build_key('https://a/b.zip'),
+                     cache.get_build_key('https://a/b.zip'))
+    self.assertNotEqual(cache.get_build_key('https://a/b.zip'),
+                        cache.get_build_key('https://a/c.zip'))
+    self.assertEqual(40, len(cache.get_build_key('https://a/b.zip')))
+
+
+class ParseSizeTest(helpers.ExtendedTestCase):
+  """Tests parse_size and get_budget."""
+
+  def test_parse(self):
+    """Test sizes with and without units."""
+    self.assertEqual(1234, cache.parse_size('1234'))
+    self.assertEqual(20 * 1024 ** 3, cache.parse_size('20G'))
+    self.assertEqual(1536 * 1024, cache.parse_size('1.5mb'))
+    with self.assertRaises(cache.InvalidSizeError):
+      cache.parse_size('lots')
+
+  def test_budget(self):
+    """Test the budget from the environment, and the default."""
+    self.mock_os_environment({'CF_CACHE_BUDGET': '10G'})
+    self.assertEqual(10 * 1024 ** 3, cache.get_budget())
+    self.mock_os_environment({})
+    self.assertEqual(cache.DEFAULT_BUDGET, cache.get_budget())
+
+
+class GetSizeTest(helpers.ExtendedTestCase):
+  """Tests get_size."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_size(self):
+    """Test measuring a tree, a file and nothing."""
+    self.fs.CreateFile('/tree/a', contents='a' * 10)
+    self.fs.CreateFile('/tree/sub/b', contents='b' * 20)
+    self.assertEqual(30, cache.get_size('/tree'))
+    self.assertEqual(10, cache.get_size('/tree/a'))
+    self.assertEqual(0, cache.get_size('/missing'))
+
+
+class CacheIndexTest(helpers.ExtendedTestCase):
+  """Tests CacheIndex."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.is_running', 'time.time'])
+    self.mock.is_running.return_value = True
+    self.mock.time.return_value = 100.0
+    self.index = create_index(self)
+
+  def test_add_and_get(self):
+    """Test adding an entry, and that re-adding keeps its creation time."""
+    self.index.add('key', cache.BUILD, '/builds/key_build', 'https://a/b.zip')
+    self.mock.time.return_value = 200.0
+    self.index.add('key', cache.BUILD, '/builds/key_build', 'https://a/b.zip')
+
+    entry = self.index.get('key')
+    self.assertEqual('/builds/key_build', entry.path)
+    self.assertEqual('https://a/b.zip', entry.source)
+    self.assertEqual(100.0, entry.created)
+    self.assertEqual(200.0, entry.last_used)
+    self.assertIsNone(self.index.get('other'))
+
+  def test_get_all(self):
+    """Test that entries are listed least recently used first."""
+    self.index.add('first', cache.BUILD, '/first')
+    self.mock.time.return_value = 200.0
+    self.index.add('second', cache.BUILD, '/second')
+    self.mock.time.return_value = 300.0
+    self.index.touch('first')
+
+    self.assertEqual(['second', 'first'],
+                     [entry.key for entry in self.index.get_all()])
+    self.assertEqual([], self.index.get_all('testcase'))
+
+  def test_testcases(self):
+    """Test recording the testcases that resolve to an entry."""
+    self.index.add('key', cache.BUILD, '/builds/key_build')
+    self.index.add_testcase('key', 1234)
+    self.index.add_testcase('key', 5678)
+    self.index.add_testcase('key', 1234)
+
+    self.assertEqual(['1234', '5678'], self.index.get('key').testcase_ids)
+
+  def test_users(self):
+    """Test counting processes, and forgetting the ones that died."""
+    self.index.add('key', cache.BUILD, '/builds/key_build')
+    self.index.acquire('key')
+    self.index.execute('INSERT INTO users VALUES (?, ?)', ('key', 1))
+    self.assertEqual(2, self.index.get('key').refcount)
+
+    self.mock.is_running.side_effect = lambda pid: pid != 1
+    self.assertEqual([os.getpid()], self.index.get('key').users)
+    self.index.release_all()
+    self.assertEqual(0, self.index.get('key').refcount)
+
+  def test_pinned(self):
+    """Test that being pinned survives updating the entry."""
+    self.index.add('key', cache.BUILD, '/builds/key_build', size=10)
+    self.index.set_pinned('key', True)
+    self.index.add('key', cache.BUILD, '/builds/key_build', size=20)
+
+    entry = self.index.get('key')
+    self.assertTrue(entry.pinned)
+    self.assertEqual(20, self.index.get_total_size())
+
+  def test_find(self):
+    """Test finding entries by key prefix and by testcase ID."""
+    self.index.add('abcdef', cache.BUILD, '/builds/abcdef_build')
+    self.index.add('abcxyz', cache.BUILD, '/builds/abcxyz_build')
+    self.index.add('1234_testcase', cache.TESTCASE, '/testcases/1234_testcase')
+    self.index.add_testcase('abcxyz', 1234)
+    self.index.add_testcase('1234_testcase', 1234)
+
+    self.assertEqual(['abcdef', 'abcxyz'],
+                     [entry.key for entry in self.index.find('abc')])
+    self.assertEqual(['1234_testcase', 'abcxyz'],
+                     [entry.key for entry in self.index.find('1234')])
+    self.assertEqual([], self.index.find('a%'))
+
+  def test_remove_if_unused(self):
+    """Test that an entry in use is kept, and one that is not is moved."""
+    path = os.path.join(os.path.dirname(self.index.path), 'key_build')
+    os.makedirs(path)
+    self.index.add('key', cache.BUILD, path)
+    self.index.acquire('key')
+    self.assertIsNone(self.index.remove_if_unused('key'))
+    self.assertTrue(os.path.exists(path))
+
+    self.index.release('key')
+    trash_path = self.index.remove_if_unused('key')
+    self.assertEqual('%s.deleting-%d' % (path, os.getpid()), trash_path)
+    self.assertTrue(os.path.exists(trash_path))
+    self.assertFalse(os.path.exists(path))
+    self.assertIsNone(self.index.get('key'))
+
+  def test_remove(self):
+    """Test removing an entry along with its references."""
+    self.index.add('key', cache.BUILD, '/builds/key_build')
+    self.index.add_testcase('key', 1234)
+    self.index.acquire('key')
+    self.index.remove('key')
+
+    self.assertIsNone(self.index.get('key'))
+    self.assertEqual([], self.index.execute('SELECT * FROM users'))
+    self.assertEqual([], self.index.execute('SELECT * FROM testcases'))
+
+  def test_shas(self):
+    """Test remembering revision and dependency shas."""
+    self.index.add_revision_sha('v8/v8', 1234, 'abcd')
+    self.index.add_dependency_sha('abcd', 'pdfium', 'efgh')
+
+    self.assertEqual('abcd', self.index.get_revision_sha('v8/v8', '1234'))
+    self.assertIsNone(self.index.get_revision_sha('chromium/src', 1234))
+    self.assertEqual('efgh', self.index.get_dependency_sha('abcd', 'pdfium'))
+    self.assertIsNone(self.index.get_dependency_sha('efgh', 'pdfium'))
+
+
+class UseBuildTest(helpers.ExtendedTestCase):
+  """Tests use_build."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.get_index'])
+    self.index = create_index(self)
+    self.mock.get_index.return_value = self.index
+
+  def test_shared(self):
+    """Test that two testcases on one build share an entry."""
+    key = cache.use_build('https://a/b.zip', '/builds/b_build', 1)
+    with mock.patch('time.time', return_value=1e10):
+      self.assertEqual(key, cache.use_build('https://a/b.zip',
+                                            '/builds/b_build', 2))
+
+    entry = self.index.get(key)
+    self.assertEqual(cache.get_build_key('https://a/b.zip'), key)
+    self.assertEqual(['1', '2'], entry.testcase_ids)
+    self.assertEqual(1e10, entry.last_used)
+    self.assertEqual([os.getpid()], entry.users)
+
+
+class EvictTest(helpers.ExtendedTestCase):
+  """Tests evict and find_untracked."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.get_index', 'time.time'])
+    self.mock.time.return_value = 100.0
+    self.index = create_index(self)
+    self.mock.get_index.return_value = self.index
+    self.directory = os.path.dirname(self.index.path)
+
+  def add(self, key, size, last_used):
+    """Adds an entry of size bytes, last used at last_used."""
+    path = os.path.join(self.directory, key)
+    os.makedirs(path)
+    with open(os.path.join(path, 'file'), 'w') as f:
+      f.write('x' * size)
+    self.mock.time.return_value = last_used
+    self.index.add(key, cache.BUILD, path, size=size)
+    return path
+
+  def test_evict_lru(self):
+    """Test that the least recently used entries go first."""
+    oldest = self.add('oldest', 30, 100.0)
+    newer = self.add('newer', 30, 200.0)
+    newest = self.add('newest', 30, 300.0)
+
+    removed = cache.evict(budget=70)
+
+    self.assertEqual(['oldest'], [entry.key for entry in removed])
+    self.assertFalse(os.path.exists(oldest))
+    self.assertEqual(['newer', 'newest'],
+                     [entry.key for entry in self.index.get_all()])
+
+    cache.evict(budget=70, needed=20)
+    self.assertFalse(os.path.exists(newer))
+    self.assertTrue(os.path.exists(newest))
+    self.assertEqual(['index.sqlite', 'newest'],
+                     sorted(os.listdir(self.directory)))
+
+  def test_keep_pinned_and_used(self):
+    """Test that pinned entries and entries in use are kept."""
+    pinned = self.add('pinned', 30, 100.0)
+    used = self.add('used', 30, 200.0)
+    unused = self.add('unused', 30, 300.0)
+    self.index.set_pinned('pinned', True)
+    self.index.acquire('used')
+
+    removed = cache.evict(budget=0)
+
+    self.assertEqual(['unused'], [entry.key for entry in removed])
+    self.assertTrue(os.path.exists(pinned))
+    self.assertTrue(os.path.exists(used))
+    self.assertFalse(os.path.exists(unused))
+
+  def test_find_untracked(self):
+    """Test finding old directories that the index lacks."""
+    builds_dir = os.path.join(self.directory, 'builds')
+    tracked = os.path.join(builds_dir, 'tracked_build')
+    old = os.path.join(builds_dir, '1234_build')
+    recent = os.path.join(builds_dir, 'd8-linux-release')
+    for path in [tracked, old, recent]:
+      os.makedirs(path)
+    self.index.add('tracked', cache.BUILD, tracked)
+    os.utime(old, (0, 0))
+    self.mock.time.return_value = cache.UNTRACKED_MIN_AGE + 1
+
+    with mock.patch('clusterfuzz.common.CLUSTERFUZZ_BUILDS_DIR', builds_dir):
+      with mock.patch('clusterfuzz.common.CLUSTERFUZZ_TESTCASES_DIR',
+                      os.path.join(self.directory, 'testcases')):
+        self.assertEqual([old], cache.find_untracked())
@@ -0,0 +1,80 @@
+"""Test the 'cache' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz import cache as cache_module
+from clusterfuzz.commands import cache
+import helpers
+
+
+def make_entry(key, pinned=False, size=1024):
+  return cache_module.Entry(
+      key, cache_module.BUILD, '/builds/%s_build' % key, 'https://a/b.zip',
+      size, 100.0, 200.0, pinned, testcase_ids=['1234'], users=[])
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests the actions of the cache command."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.evict',
+                         'clusterfuzz.cache.find_untracked',
+                         'clusterfuzz.cache.delete_path',
+                         'clusterfuzz.cache.get_index'])
+    self.index = self.mock.get_index.return_value
+    self.mock.find_untracked.return_value = []
+
+  def test_list(self):
+    """Test listing the entries."""
+    self.index.get_all.return_value = [make_entry('abc', pinned=True)]
+    cache.execute('list')
+    self.index.get_all.assert_called_once_with()
+
+  def test_pin(self):
+    """Test pinning every entry a testcase uses."""
+    self.index.find.return_value = [make_entry('abc'), make_entry('def')]
+    cache.execute('pin', key='1234')
+
+    self.index.find.assert_called_once_with('1234')
+    self.assert_exact_calls(self.index.set_pinned, [
+        mock.call('abc', True), mock.call('def', True)])
+
+  def test_unpin_nothing(self):
+    """Test exiting when nothing matches."""
+    self.index.find.return_value = []
+    with self.assertRaises(SystemExit):
+      cache.execute('unpin', key='1234')
+    self.assertEqual(0, self.index.set_pinned.call_count)
+
+  def test_prune(self):
+    """Test pruning to a budget, along with the untracked directories."""
+    self.mock.evict.return_value = [make_entry('abc')]
+    self.mock.find_untracked.return_value = ['/builds/1234_build']
+
+    cache.execute('prune', budget='1G', untracked=True)
+
+    self.mock.evict.assert_called_once_with(1024 ** 3)
+    self.mock.delete_path.assert_called_once_with('/builds/1234_build')
+
+  def test_prune_default_budget(self):
+    """Test pruning to the configured budget, keeping untracked files."""
+    self.mock_os_environment({'CF_CACHE_BUDGET': '2G'})
+    self.mock.evict.return_value = []
+
+    cache.execute('prune')
+
+    self.mock.evict.assert_called_once_with(2 * 1024 ** 3)
+    self.assertEqual(0, self.mock.find_untracked.call_count)
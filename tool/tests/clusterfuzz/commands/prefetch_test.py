@@ -0,0 +1,114 @@
+"""Test the 'prefetch' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz import binary_providers
+from clusterfuzz.commands import prefetch
+import helpers
+
+
+class PrefetchTest(helpers.ExtendedTestCase):
+  """Tests prefetching one testcase."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.sha_exists',
+        'clusterfuzz.common.execute',
+        'clusterfuzz.commands.reproduce.get_binary_definition',
+        'clusterfuzz.commands.reproduce.get_downloaded_binary',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.testcase.Testcase'])
+    self.testcase = mock.Mock(job_type='linux_asan_d8')
+    self.mock.Testcase.return_value = self.testcase
+    self.definition = self.mock.get_binary_definition.return_value
+    self.definition.source_var = 'V8_SRC'
+    self.builder = self.definition.builder.return_value
+    self.builder.git_sha = 'abcdef'
+    self.builder.source_directory = '/v8'
+    self.builder.get_repository.return_value = (
+        binary_providers.RepositoryState('/v8'))
+    self.mock.sha_exists.return_value = False
+
+  def test_download(self):
+    """Test fetching the testcase and its build."""
+    binary = self.mock.get_downloaded_binary.return_value
+    binary.needed_only = True
+
+    self.assertIsNone(prefetch.prefetch('1234', 'download'))
+
+    self.mock.get_testcase_info.assert_called_once_with('1234')
+    self.testcase.get_testcase_path.assert_called_once_with()
+    self.mock.get_binary_definition.assert_called_once_with(
+        'linux_asan_d8', 'download')
+    binary.download_build_data.assert_called_once_with(True)
+    self.assert_n_calls(0, [self.definition.builder])
+
+  def test_source(self):
+    """Test resolving the revision and fetching its git objects."""
+    self.assertIsNone(prefetch.prefetch('1234', 'standalone', {'id': 1234}))
+
+    self.assert_n_calls(0, [self.mock.get_testcase_info,
+                            self.mock.get_downloaded_binary])
+    self.definition.builder.assert_called_once_with(
+        self.testcase, self.definition, current=False, goma_dir=None,
+        goma_threads=None, edit_mode=False)
+    self.mock.sha_exists.assert_called_once_with('abcdef', '/v8')
+    self.mock.execute.assert_called_once_with(
+        'git', 'fetch origin abcdef', '/v8')
+
+  def test_no_source(self):
+    """Test skipping the fetch when the checkout is unknown."""
+    self.builder.source_directory = None
+    self.assertIsNone(prefetch.prefetch('1234', 'standalone'))
+    self.assert_n_calls(0, [self.mock.sha_exists, self.mock.execute])
+
+  def test_failure(self):
+    """Test that failing, even by exiting, is reported rather than raised."""
+    self.mock.execute.side_effect = SystemExit(1)
+    self.assertEqual('1', prefetch.prefetch('1234', 'standalone'))
+    self.testcase.get_testcase_path.side_effect = IOError('No space left')
+    self.assertEqual('No space left', prefetch.prefetch('1234', 'download'))
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests prefetching testcases concurrently."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.prefetch.prefetch',
+        'clusterfuzz.commands.reproduce.get_testcase_info'])
+    self.mock.get_testcase_info.return_value = {'id': 1}
+
+  def test_execute(self):
+    """Test that the first testcase's information is fetched up front."""
+    self.mock.prefetch.return_value = None
+    prefetch.execute(['1', '2', '3'], 'download', 2)
+
+    self.mock.get_testcase_info.assert_called_once_with('1')
+    self.assertEqual(
+        sorted([mock.call('1', 'download', {'id': 1}),
+                mock.call('2', 'download', None),
+                mock.call('3', 'download', None)]),
+        sorted(self.mock.prefetch.call_args_list))
+
+  def test_failures(self):
+    """Test exiting with an error when a testcase failed."""
+    self.mock.prefetch.side_effect = (
+        lambda testcase_id, build, response: 'error' if testcase_id == '2'
+        else None)
+    with self.assertRaises(SystemExit):
+      prefetch.execute(['1', '2'], 'chromium', None)
+    self.assertEqual(2, self.mock.prefetch.call_count)
@@ -51,6 +51,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
         'clusterfuzz.commands.reproduce.get_testcase_info',
         'clusterfuzz.testcase.Testcase',
         'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.resource_usage.write_summary',
         'clusterfuzz.binary_providers.DownloadedBinary',
         'clusterfuzz.binary_providers.V8Builder',
         'clusterfuzz.binary_providers.ChromiumBuilder'])
@@ -63,7 +64,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
         'metadata': {'build_url': 'chrome_build_url'},
         'crash_stacktrace': {'lines': ['Line 1', 'Line 2']}}
     self.mock.get_testcase_info.return_value = self.response
-    self.mock.ensure_goma.return_value = '/goma/dir'
+    self.goma_start = mock.Mock()
+    self.mock.ensure_goma.return_value = ('/goma/dir', self.goma_start)
 
   def test_gesture_job(self):
     """Ensures an excpetion is thrown when running a job with gestures."""
@@ -75,7 +77,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
       reproduce.execute(testcase_id='1234', current=False, build='standalone',
                         disable_goma=False, j=None, iterations=None,
                         disable_xvfb=False, target_args='--test',
-                        edit_mode=True)
+                        edit_mode=True, gn_check=False, force_sync=False)
 
   def test_unsupported_job(self):
     """Tests to ensure an exception is thrown with an unsupported job type."""
@@ -88,14 +90,15 @@ class ExecuteTest(helpers.ExtendedTestCase):
       reproduce.execute(testcase_id='1234', current=False, build='standalone',
                         disable_goma=False, j=None, iterations=None,
                         disable_xvfb=False, target_args='--test',
-                        edit_mode=True)
+                        edit_mode=True, gn_check=False, force_sync=False)
 
   def test_download_no_defined_binary(self):
     """Test what happens when no binary name is defined."""
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.get_binary_definition'])
     self.mock.get_binary_definition.return_value = mock.Mock(
-        binary_name=None, sanitizer='ASAN')
+        binary_name=None, sanitizer='ASAN',
+        reproducer=mock.Mock(EXTRACT_NEEDED_ONLY=False))
     self.mock.DownloadedBinary.return_value = mock.Mock(symbolizer_path=(
         '/path/to/symbolizer'))
     self.mock.DownloadedBinary.return_value.get_binary_path.return_value = (
@@ -112,13 +115,13 @@ class ExecuteTest(helpers.ExtendedTestCase):
     reproduce.execute(testcase_id='1234', current=False, build='download',
                       disable_goma=False, j=None, iterations=None,
                       disable_xvfb=False, target_args='--test',
-                      edit_mode=True)
+                      edit_mode=True, gn_check=False, force_sync=False)
 
     self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
     self.assert_n_calls(0, [self.mock.ensure_goma])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
-    self.assert_exact_calls(self.mock.DownloadedBinary,
-                            [mock.call(1234, 'chrome_build_url', 'binary')])
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'chrome_build_url', 'binary', needed_only=False)])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(self.mock.DownloadedBinary.return_value, testcase, 'ASAN',
@@ -130,7 +133,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.get_binary_definition'])
     self.mock.get_binary_definition.return_value = mock.Mock(
-        binary_name='binary', sanitizer='ASAN')
+        binary_name='binary', sanitizer='ASAN',
+        reproducer=mock.Mock(EXTRACT_NEEDED_ONLY=True))
     self.mock.DownloadedBinary.return_value = mock.Mock(symbolizer_path=(
         '/path/to/symbolizer'))
     self.mock.DownloadedBinary.return_value.get_binary_path.return_value = (
@@ -146,13 +150,13 @@ class ExecuteTest(helpers.ExtendedTestCase):
     reproduce.execute(testcase_id='1234', current=False, build='download',
                       disable_goma=False, j=None, iterations=None,
                       disable_xvfb=False, target_args='--test',
-                      edit_mode=True)
+                      edit_mode=True, gn_check=False, force_sync=False)
 
     self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
     self.assert_n_calls(0, [self.mock.ensure_goma])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
-    self.assert_exact_calls(self.mock.DownloadedBinary,
-                            [mock.call(1234, 'chrome_build_url', 'binary')])
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'chrome_build_url', 'binary', needed_only=True)])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(self.mock.DownloadedBinary.return_value, testcase, 'ASAN',
@@ -175,22 +179,56 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.mock.Testcase.return_value = testcase
     reproduce.execute(testcase_id='1234', current=False, build='standalone',
                       disable_goma=False, j=22, iterations=None,
-                      disable_xvfb=False, target_args='--test', edit_mode=True)
+                      disable_xvfb=False, target_args='--test', edit_mode=True,
+                      gn_check=False, force_sync=False)
 
     self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
     self.assert_exact_calls(self.mock.ensure_goma, [mock.call()])
+    self.assert_exact_calls(self.goma_start.wait, [mock.call()])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.builder, [
             mock.call(testcase, self.mock.get_binary_definition.return_value,
-                      False, '/goma/dir', 22, True)])
+                      False, '/goma/dir', 22, True, False, False)])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(
             self.mock.get_binary_definition.return_value.builder.return_value,
             testcase, 'ASAN', False, '--test', True)])
+    self.assert_exact_calls(self.mock.write_summary,
+                            [mock.call('linux_asan_d8')])
 
 
+  def test_summary_error(self):
+    """Ensures a failure to write the summary does not hide the reproducer's
+    error, nor fail a run that succeeded."""
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_binary_definition'])
+    definition = mock.Mock(kwargs={}, source_var='V8_SRC', sanitizer='ASAN')
+    self.mock.get_binary_definition.return_value = definition
+    self.mock.Testcase.return_value = mock.Mock(
+        id=1234, build_url='chrome_build_url', revision=123456,
+        job_type='linux_asan_d8', reproducible=True,
+        reproduction_args='--always-opt')
+    self.mock.write_summary.side_effect = IOError('disk full')
+
+    definition.reproducer.return_value.reproduce.side_effect = (
+        ValueError('reproducer failed'))
+    with self.assertRaises(ValueError) as cm:
+      reproduce.execute(testcase_id='1234', current=False, build='download',
+                        disable_goma=False, j=None, iterations=None,
+                        disable_xvfb=False, target_args='--test',
+                        edit_mode=True, gn_check=False, force_sync=False)
+    self.assertEqual('reproducer failed', cm.exception.message)
+
+    definition.reproducer.return_value.reproduce.side_effect = None
+    reproduce.execute(testcase_id='1234', current=False, build='download',
+                      disable_goma=False, j=None, iterations=None,
+                      disable_xvfb=False, target_args='--test',
+                      edit_mode=True, gn_check=False, force_sync=False)
+    self.assert_exact_calls(self.mock.write_summary, [
+        mock.call('linux_asan_d8'), mock.call('linux_asan_d8')])
+
 class GetTestcaseInfoTest(helpers.ExtendedTestCase):
   """Test get_testcase_info."""
 
@@ -391,7 +429,7 @@ class EnsureGomaTest(helpers.ExtendedTestCase):
     self.setup_fake_filesystem()
     self.mock_os_environment(
         {'GOMA_DIR': os.path.expanduser(os.path.join('~', 'goma'))})
-    helpers.patch(self, ['clusterfuzz.common.execute'])
+    helpers.patch(self, ['clusterfuzz.common.execute_async'])
 
   def test_goma_not_installed(self):
     """Tests what happens when GOMA is not installed."""
@@ -410,10 +448,10 @@ class EnsureGomaTest(helpers.ExtendedTestCase):
 
     result = reproduce.ensure_goma()
 
-    self.assert_exact_calls(self.mock.execute, [
+    self.assert_exact_calls(self.mock.execute_async, [
         mock.call('python', 'goma_ctl.py ensure_start', goma_dir)
     ])
-    self.assertEqual(result, goma_dir)
+    self.assertEqual(result, (goma_dir, self.mock.execute_async.return_value))
 
 
 class SuppressOutputTest(helpers.ExtendedTestCase):
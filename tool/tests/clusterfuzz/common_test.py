@@ -13,16 +13,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cStringIO
 import subprocess
 import os
+import signal
 import stat
+import time
+import shutil
+import tempfile
 import mock
 
 from clusterfuzz import common
+from clusterfuzz import resource_usage
 import helpers
 
 
+def create_pipe(content):
+  """Returns a file object from which content can be read like a pipe."""
+  read_fd, write_fd = os.pipe()
+  os.write(write_fd, content)
+  os.close(write_fd)
+  return os.fdopen(read_fd, 'r')
+
+
 class GetVersionTest(helpers.ExtendedTestCase):
   """Tests get_version."""
 
@@ -98,10 +110,11 @@ class ExecuteTest(helpers.ExtendedTestCase):
                          'logging.getLogger',
                          'logging.config.dictConfig',
                          'clusterfuzz.common.check_binary',
-                         'clusterfuzz.common.wait_timeout',
                          'clusterfuzz.common.interpret_ninja_output',
+                         'clusterfuzz.resource_usage.ProcessTreeMonitor',
                          'os.environ.copy'])
     self.mock.copy.return_value = {'OS': 'ENVIRON'}
+    self.mock.check_binary.side_effect = lambda binary, _: '/bin/' + binary
     self.mock.dictConfig.return_value = {}
 
     from clusterfuzz import local_logging
@@ -111,22 +124,25 @@ class ExecuteTest(helpers.ExtendedTestCase):
   def build_popen_mock(self, code):
     """Builds the mocked Popen object."""
     return mock.MagicMock(
-        stdout=cStringIO.StringIO(self.lines),
+        stdout=create_pipe(self.lines),
         returncode=code)
 
   def test_with_ninja(self):
     """Ensure interpret_ninja_output is run when the ninja flag is set."""
 
-    x = mock.Mock()
-    x.read.side_effect = ['part1', 'part2\n']
-    self.mock.Popen.return_value = mock.Mock(stdout=x, returncode=0)
-    common.execute('ninja', 'do this plz', '~/working/directory',
-                   print_output=True, exit_on_error=True,
-                   env={'a': 'b', 1: 2, 'c': None})
-    self.assert_n_calls(1, [self.mock.interpret_ninja_output])
+    self.mock.Popen.return_value = mock.Mock(
+        stdout=create_pipe('part1part2\n[1/2] CXX\n'), returncode=0)
+    result = common.execute('ninja', "do 'this plz'", '~/working/directory',
+                            print_output=True, exit_on_error=True,
+                            env={'a': 'b', 1: 2, 'c': None})
+    self.assertEqual((0, 'part1part2\n[1/2] CXX\n'), result)
+    progress = self.mock.interpret_ninja_output.call_args[0][1]
+    self.assertIsInstance(progress, common.NinjaProgress)
+    self.assert_exact_calls(self.mock.interpret_ninja_output, [
+        mock.call('part1part2', progress), mock.call('[1/2] CXX', progress)])
     self.mock.Popen.assert_called_once_with(
-        'ninja do this plz',
-        shell=True,
+        ['ninja', 'do', 'this plz'],
+        executable='/bin/ninja',
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
@@ -135,6 +151,63 @@ class ExecuteTest(helpers.ExtendedTestCase):
         preexec_fn=os.setsid
     )
 
+  def test_lazy_output(self):
+    """Test returning the output as a CapturedOutput."""
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+
+    _, output = common.execute('cmd', '', '~/working/directory',
+                               lazy_output=True)
+
+    self.assertIsInstance(output, common.CapturedOutput)
+    self.assertEqual(self.lines, output.read())
+
+  def test_execute_argv(self):
+    """Test running a list of arguments as is."""
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+
+    result = common.execute_argv(['cmd', 'a b', '$c'], '/dir',
+                                 env={'E': 'F'})
+
+    self.assertEqual((0, self.lines), result)
+    self.mock.ProcessTreeMonitor.assert_called_once_with(
+        self.mock.Popen.return_value.pid, "cmd 'a b' '$c'", 'other')
+    monitor = self.mock.ProcessTreeMonitor.return_value
+    self.assertIs(monitor, self.mock.Popen.return_value.resource_monitor)
+    monitor.sample.assert_called_with(force=True)
+    self.assert_exact_calls(monitor.finish, [mock.call(0)])
+    self.mock.Popen.assert_called_once_with(
+        ['cmd', 'a b', '$c'],
+        executable='/bin/cmd',
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd='/dir',
+        env={'OS': 'ENVIRON', 'E': 'F'},
+        preexec_fn=os.setsid)
+
+  def test_execute_with_shell_syntax(self):
+    """Test that args using shell syntax are run through a shell."""
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+
+    result = common.execute('ninja', '-C out $TARGETS > log && echo ok',
+                            '/dir', env={'E': 'F'})
+
+    self.assertEqual((0, self.lines), result)
+    self.assert_exact_calls(
+        self.mock.check_binary, [mock.call('ninja', '/dir')])
+    self.mock.ProcessTreeMonitor.assert_called_once_with(
+        self.mock.Popen.return_value.pid,
+        'ninja -C out $TARGETS > log && echo ok', 'ninja')
+    self.mock.Popen.assert_called_once_with(
+        ['/bin/sh', '-c', 'ninja -C out $TARGETS > log && echo ok'],
+        executable='/bin/sh',
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd='/dir',
+        env={'OS': 'ENVIRON', 'E': 'F'},
+        preexec_fn=os.setsid)
+
   def run_execute(self, print_cmd, print_out, exit_on_err):
     return common.execute(
         'cmd', '',
@@ -166,8 +239,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.Popen.return_value.wait, [mock.call()])
     self.assert_exact_calls(self.mock.Popen, [
         mock.call(
-            'cmd',
-            shell=True,
+            ['cmd'],
+            executable='/bin/cmd',
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             stdin=subprocess.PIPE,
@@ -210,27 +283,244 @@ class ExecuteTest(helpers.ExtendedTestCase):
         cm.exception.message)
 
 
+class AsyncResultTest(helpers.ExtendedTestCase):
+  """Tests AsyncResult."""
+
+  def test_result(self):
+    """Test returning the function's result."""
+    result = common.run_async(lambda a, b=0: a + b, 1, b=2)
+    self.assertEqual(3, result.wait())
+    self.assertTrue(result.done())
+
+  def test_exception(self):
+    """Test re-raising the function's exception, including SystemExit."""
+    def fail():
+      raise SystemExit(3)
+
+    with self.assertRaises(SystemExit):
+      common.run_async(fail).wait()
+
+  def test_phase(self):
+    """Test running the function in the caller's resource usage phase."""
+    with resource_usage.phase('goma'):
+      result = common.run_async(resource_usage.current_phase)
+    self.assertEqual('goma', result.wait())
+
+
+class ExecuteAsyncTest(helpers.ExtendedTestCase):
+  """Tests execute_async."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+    self.mock.execute.return_value = (0, 'output')
+
+  def test_execute(self):
+    """Test that execute is run with the same arguments."""
+    result = common.execute_async('git', 'fetch', '/src', print_output=False)
+
+    self.assertEqual((0, 'output'), result.wait())
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'fetch', '/src', print_output=False)])
+
+
+class WaitAllTest(helpers.ExtendedTestCase):
+  """Tests wait_all."""
+
+  def test_results(self):
+    """Test results are returned in order."""
+    results = [common.run_async(time.sleep, 0.1),
+               common.run_async(lambda: 'second')]
+    self.assertEqual([None, 'second'], common.wait_all(results))
+
+  def test_waits_before_raising(self):
+    """Test that every result is waited on before raising."""
+    finished = []
+    def slow():
+      time.sleep(0.1)
+      finished.append(True)
+    def fail():
+      raise common.NotInstalledError('git')
+
+    results = [common.run_async(fail), common.run_async(slow)]
+    with self.assertRaises(common.NotInstalledError):
+      common.wait_all(results)
+    self.assertEqual([True], finished)
+
+
+class LineSplitterTest(helpers.ExtendedTestCase):
+  """Tests LineSplitter."""
+
+  def setUp(self):
+    self.splitter = common.LineSplitter()
+
+  def test_lines_across_chunks(self):
+    """Test lines spanning several chunks are joined."""
+    self.assertEqual([], self.splitter.split('Li'))
+    self.assertEqual([], self.splitter.split('ne'))
+    self.assertEqual(['Line 1', 'Line 2'], self.splitter.split(' 1\nLine 2\nL'))
+    self.assertEqual(['Line 3', ''], self.splitter.split('ine 3\n\n'))
+    self.assertEqual([], self.splitter.flush())
+
+  def test_trailing_line(self):
+    """Test the output not ending with a newline."""
+    self.assertEqual(['a'], self.splitter.split('a\nb'))
+    self.assertEqual(['b'], self.splitter.flush())
+    self.assertEqual([], self.splitter.flush())
+
+
+class CapturedOutputTest(helpers.ExtendedTestCase):
+  """Tests CapturedOutput."""
+
+  def capture(self, lines, ends_with_newline, memory_limit):
+    output = common.CapturedOutput(memory_limit=memory_limit)
+    self.addCleanup(output.close)
+    for line in lines:
+      output.append([line])
+    output.finish(ends_with_newline)
+    return output
+
+  def test_in_memory(self):
+    """Test output that fits in memory."""
+    output = self.capture(['a', 'b', ''], True, 100)
+
+    self.assertFalse(output.spilled)
+    self.assertEqual('a\nb\n\n', output.read())
+    self.assertEqual('a\nb\n\n', output.summary())
+    self.assertEqual(['a', 'b', ''], list(output.iter_lines()))
+    self.assertFalse(output.is_blank())
+
+  def test_spilled(self):
+    """Test output that is spilled to disk keeps a bounded head and tail."""
+    lines = ['line %02d' % i for i in range(20)]
+    output = self.capture(lines, False, 40)
+
+    self.assertTrue(output.spilled)
+    self.assertEqual('\n'.join(lines), output.read())
+    self.assertEqual(lines, list(output.iter_lines()))
+    self.assertEqual(['line 00', 'line 01'], output.head)
+    self.assertEqual(['line 18', 'line 19'], list(output.tail))
+    self.assertEqual(
+        'line 00\nline 01\n... 128 bytes omitted ...\nline 18\nline 19',
+        output.summary())
+    self.assertFalse(output.is_blank())
+
+  def capture_chunks(self, chunks, memory_limit):
+    """Captures chunks the way wait_execute does."""
+    output = common.CapturedOutput(memory_limit=memory_limit)
+    self.addCleanup(output.close)
+    splitter = common.LineSplitter()
+    for chunk in chunks:
+      output.append(splitter.split(chunk))
+    trailing_line = splitter.flush()
+    output.append(trailing_line)
+    output.finish(ends_with_newline=not trailing_line)
+    return output
+
+  def test_spilled_split_lines(self):
+    """Test spilled output whose lines are split across chunks."""
+    output = self.capture_chunks(
+        ['aaaa\nbbbb\ncccc\n', 'dd', 'dd\nee', 'ee\n', 'ff', 'ff\n'], 10)
+
+    self.assertTrue(output.spilled)
+    self.assertEqual('aaaa\nbbbb\ncccc\ndddd\neeee\nffff\n', output.read())
+    self.assertEqual(30, output.size)
+
+  def test_spilled_no_final_newline(self):
+    """Test spilled output that doesn't end with a newline."""
+    output = self.capture_chunks(['aaaa\nbbbb\ncccc\n', 'dd', 'dd\nee', 'ee'],
+                                 10)
+
+    self.assertTrue(output.spilled)
+    self.assertEqual('aaaa\nbbbb\ncccc\ndddd\neeee', output.read())
+    self.assertEqual(['aaaa', 'bbbb', 'cccc', 'dddd', 'eeee'],
+                     list(output.iter_lines()))
+    self.assertEqual(24, output.size)
+
+  def test_blank(self):
+    """Test blank output."""
+    self.assertTrue(self.capture([], False, 100).is_blank())
+    self.assertTrue(self.capture([' '], True, 100).is_blank())
+
+
+class NeedsShellTest(helpers.ExtendedTestCase):
+  """Tests needs_shell."""
+
+  def test_plain(self):
+    """Test args that shlex.split handles the same way a shell would."""
+    for args in ['', '-C out/Release d8', "-w 'dupbuild=err'",
+                 '"http://host/a?b=1&c=2" -O file', "'$HOME' '*.zip'",
+                 r'a\ b \$c \> d', '--flag="a b" \'x\'']:
+      self.assertFalse(common.needs_shell(args), args)
+
+  def test_shell(self):
+    """Test args that need a shell."""
+    for args in ['a | b', 'a && b', 'a; b', '> out', '2>&1', '$VAR',
+                 '"$VAR"', '"`date`"', '*.zip', 'file?', '[ab]', '{a,b}',
+                 '~/dir', '$(cat x)', 'a\nb', "'a' b>c"]:
+      self.assertTrue(common.needs_shell(args), args)
+
+
 class CheckBinaryTest(helpers.ExtendedTestCase):
-  """Test check_binary."""
+  """Test check_binary and find_executable."""
 
   def setUp(self):
-    helpers.patch(self, ['subprocess.check_output'])
+    self.setup_fake_filesystem()
+    self.mock_os_environment({'PATH': '/usr/bin:/bin'})
+    patcher = mock.patch.dict(common.executable_cache, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.create_executable('/bin/test')
+
+  def create_executable(self, path):
+    self.fs.CreateFile(path)
+    os.chmod(path, 0755)
 
   def test_valid(self):
     """Test a valid binary."""
-    common.check_binary('test', 'cwd')
-    self.mock.check_output.assert_called_once_with(['which', 'test'], cwd='cwd')
+    self.assertEqual('/bin/test', common.check_binary('test', 'cwd'))
 
   def test_invalid(self):
     """Test an invalid binary."""
-    self.mock.check_output.side_effect = subprocess.CalledProcessError(1, '')
-    with self.assertRaises(common.NotInstalledError) as cm:
-      common.check_binary('test', 'cwd')
-
-    self.mock.check_output.assert_called_once_with(['which', 'test'], cwd='cwd')
-    self.assertEqual(
-        'test is not found. Please install it or ensure the path is correct.',
-        cm.exception.message)
+    self.fs.CreateFile('/usr/bin/not_executable')
+    for binary in ['missing', 'not_executable']:
+      with self.assertRaises(common.NotInstalledError) as cm:
+        common.check_binary(binary, 'cwd')
+      self.assertEqual(
+          '%s is not found. Please install it or ensure the path is '
+          'correct.' % binary, cm.exception.message)
+
+  def test_path_order(self):
+    """Test that the first match on PATH wins."""
+    self.create_executable('/usr/bin/test')
+    self.assertEqual('/usr/bin/test', common.find_executable('test', 'cwd'))
+
+  def test_relative_to_cwd(self):
+    """Test a binary given relative to the working directory."""
+    self.create_executable('/src/build/script.py')
+    self.assertEqual('/src/build/script.py',
+                     common.find_executable('build/script.py', '/src'))
+    self.assertIsNone(common.find_executable('build/script.py', '/other'))
+
+  def test_cache(self):
+    """Test that lookups are cached per PATH."""
+    self.assertEqual('/bin/test', common.find_executable('test', 'cwd'))
+    self.assertEqual({('/usr/bin:/bin', 'test'): '/bin/test'},
+                     common.executable_cache)
+
+    self.mock_os_environment({'PATH': '/usr/bin'})
+    self.assertIsNone(common.find_executable('test', 'cwd'))
+    self.assertNotIn(('/usr/bin', 'test'), common.executable_cache)
+
+  def test_cache_rechecked(self):
+    """Test that a cached binary is looked up again once it is gone, and that
+    a binary installed after a miss is found."""
+    self.assertEqual('/bin/test', common.find_executable('test', 'cwd'))
+    os.remove('/bin/test')
+    self.assertIsNone(common.find_executable('test', 'cwd'))
+    self.assertEqual({}, common.executable_cache)
+
+    self.create_executable('/usr/bin/test')
+    self.assertEqual('/usr/bin/test', common.find_executable('test', 'cwd'))
 
 
 class StoreAuthHeaderTest(helpers.ExtendedTestCase):
@@ -366,92 +656,75 @@ class BinaryDefinitionTest(helpers.ExtendedTestCase):
       common.BinaryDefinition('builder', 'CHROME_SRC', 'reproducer')
 
 
-class WaitTimeoutTest(helpers.ExtendedTestCase):
-  """Tests the wait_timeout method."""
-
-  def setUp(self):
-    helpers.patch(self, ['time.sleep',
-                         'os.getpgid',
-                         'os.killpg'])
+class ReadOutputTest(helpers.ExtendedTestCase):
+  """Tests the read_output method."""
 
-  def test_kill_not_needed(self):
-    """Tests when the process exits without needing to be killed."""
+  def start(self, script):
+    """Starts a shell script in its own process group."""
+    return subprocess.Popen(
+        ['sh', '-c', script], stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, preexec_fn=os.setsid)
 
-    class ProcMock(object):
-      poll_results = [1, None, None, None]
-      pid = 1234
-      def poll(self):
-        return self.poll_results.pop()
-    proc = ProcMock()
+  def read(self, proc, timeout, kill_grace_period=5):
+    """Returns the output and how long it took to read it."""
+    start_time = time.time()
+    output = ''.join(common.read_output(proc, timeout, kill_grace_period))
+    return output, time.time() - start_time
 
-    common.wait_timeout(proc, 5)
+  def test_exit_before_timeout(self):
+    """Tests that a process exiting cleanly is not waited on."""
+    proc = self.start('echo test; exit 0')
 
-    self.assert_n_calls(0, [self.mock.killpg])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(0.5), mock.call(0.5),
-                                              mock.call(0.5), mock.call(0.5)])
+    output, elapsed = self.read(proc, 30)
 
-  def test_kill_needed(self):
-    """Tests when the process must be killed."""
+    self.assertEqual('test\n', output)
+    self.assertLess(elapsed, 5)
+    self.assertEqual(0, proc.wait())
 
-    self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
-
-    common.wait_timeout(proc, 5)
+  def test_no_timeout(self):
+    """Tests reading until the end when no timeout is specified."""
+    proc = self.start('echo one; sleep 0.2; echo two')
 
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
-    self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(11, [self.mock.sleep])
+    output, _ = self.read(proc, None)
 
-  def test_no_timeout(self):
-    """Tests when no timeout is specified."""
+    self.assertEqual('one\ntwo\n', output)
+    self.assertEqual(0, proc.wait())
 
-    common.wait_timeout(mock.Mock(), None)
+  def test_terminate(self):
+    """Tests that the process group is terminated once the deadline passes,
+      without waiting for the grace period."""
+    proc = self.start('echo test; sleep 30')
 
-    self.assert_n_calls(0, [self.mock.sleep, self.mock.getpgid,
-                            self.mock.killpg])
+    output, elapsed = self.read(proc, 0.2)
 
-  def test_no_process(self):
-    """Tests when process died maturely."""
-    error = OSError()
-    error.errno = 3  # No such process.
-    self.mock.killpg.side_effect = error
+    self.assertEqual('test\n', output)
+    self.assertLess(elapsed, 5)
+    self.assertEqual(-signal.SIGTERM, proc.wait())
 
-    self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
+  def test_kill(self):
+    """Tests that SIGKILL is sent when SIGTERM is ignored."""
+    proc = self.start('trap "" TERM; echo test; sleep 30')
 
-    common.wait_timeout(proc, 5)
+    output, elapsed = self.read(proc, 0.2, kill_grace_period=0.2)
 
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
-    self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(10, [self.mock.sleep])
+    self.assertEqual('test\n', output)
+    self.assertLess(elapsed, 5)
+    self.assertEqual(-signal.SIGKILL, proc.wait())
 
   def test_kill_error(self):
     """Test error when killing."""
+    proc = self.start('sleep 30')
+    self.addCleanup(os.killpg, proc.pid, signal.SIGKILL)
+    helpers.patch(self, ['os.killpg'])
     error = OSError()
     error.errno = 4
     self.mock.killpg.side_effect = error
 
-    self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
-
     with self.assertRaises(OSError):
-      common.wait_timeout(proc, 5)
+      self.read(proc, 0.1)
 
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
-    self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(10, [self.mock.sleep])
+    self.assert_exact_calls(self.mock.killpg, [
+        mock.call(proc.pid, signal.SIGTERM)])
 
 
 class InterpretNinjaOutputTest(helpers.ExtendedTestCase):
@@ -473,16 +746,73 @@ class InterpretNinjaOutputTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.print_progress_bar, [
         mock.call(23, 100, prefix='Ninja progress:')])
 
+  def test_progress(self):
+    """Ensure the rate and ETA are shown when progress is tracked."""
+    progress = mock.Mock(spec_set=common.NinjaProgress)
+    progress.update.return_value = '2.0/s ETA 0:38'
+
+    common.interpret_ninja_output('[24/100] CXX ../file/name', progress)
+
+    progress.update.assert_called_once_with(24, 100)
+    self.assert_exact_calls(self.mock.print_progress_bar, [
+        mock.call(24, 100, prefix='Ninja progress:', suffix='2.0/s ETA 0:38',
+                  length=mock.ANY)])
+
+
+class NinjaProgressTest(helpers.ExtendedTestCase):
+  """Tests NinjaProgress."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+
+  def test_update(self):
+    """Ensure the rate is measured from the first update."""
+    self.mock.time.side_effect = [100, 110, 110]
+    progress = common.NinjaProgress()
+
+    self.assertEqual('', progress.update(10, 1000))
+    self.assertEqual('', progress.update(10, 1000))
+    self.assertEqual('5.0/s ETA 3:08', progress.update(60, 1000))
+
+
+class ByteProgressTest(helpers.ExtendedTestCase):
+  """Tests ByteProgress."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.print_progress_bar', 'time.time'])
+    self.mock.time.return_value = 100.0
+
+  def test_add(self):
+    """Test that updates are throttled, except for the last one."""
+    progress = common.ByteProgress(4096, prefix='Downloading:')
+    progress.add(1024)
+    self.mock.time.return_value = 100.1
+    progress.add(1024)
+    self.mock.time.return_value = 100.2
+    progress.add(2048)
+
+    self.assert_exact_calls(self.mock.print_progress_bar, [
+        mock.call(1024, 4096, prefix='Downloading:',
+                  suffix='1.0KB/4.0KB 0.0B/s', length=mock.ANY),
+        mock.call(4096, 4096, prefix='Downloading:',
+                  suffix='4.0KB/4.0KB 20.0KB/s', length=mock.ANY)])
+
+  def test_hidden(self):
+    """Test counting without printing."""
+    progress = common.ByteProgress(4096, show=False)
+    progress.add(4096)
+    self.assertEqual(4096, progress.done)
+    self.assertEqual(0, self.mock.print_progress_bar.call_count)
+
 
 class PrintProgressBarTest(helpers.ExtendedTestCase):
   """Ensures the print_progress_bar method works properly."""
 
   def setUp(self):
-    helpers.patch(self,
-                  ['__builtin__.print',
-                   'backports.shutil_get_terminal_size.get_terminal_size'])
-    self.mock.get_terminal_size.return_value = mock.Mock(columns=150)
-    reload(common)
+    helpers.patch(self, ['__builtin__.print'])
+    width_patcher = mock.patch('clusterfuzz.common.TERMINAL_WIDTH', 150)
+    width_patcher.start()
+    self.addCleanup(width_patcher.stop)
 
   def test_call(self):
     """Ensures print is called with the correct parameters."""
@@ -517,6 +847,74 @@ class DeleteIfExistsTest(helpers.ExtendedTestCase):
     self.assertFalse(os.path.exists(directory))
 
 
+class CloneDirectoryTest(helpers.ExtendedTestCase):
+  """Tests clone_directory."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute_argv'])
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.source = os.path.join(self.directory, 'out_a')
+    self.destination = os.path.join(self.directory, 'out_b')
+    os.makedirs(os.path.join(self.source, 'obj'))
+    for name in ['obj/d8.o', 'build.ninja', '.ninja_log']:
+      with open(os.path.join(self.source, name), 'w') as f:
+        f.write(name)
+    os.symlink('obj/d8.o', os.path.join(self.source, 'd8.o'))
+
+  def assert_cloned(self):
+    self.assertEqual(['.ninja_log', 'build.ninja', 'd8.o', 'obj'],
+                     sorted(os.listdir(self.destination)))
+    self.assertEqual('obj/d8.o',
+                     os.readlink(os.path.join(self.destination, 'd8.o')))
+    with open(os.path.join(self.destination, 'obj', 'd8.o')) as f:
+      self.assertEqual('obj/d8.o', f.read())
+    self.assertEqual([self.source, self.destination],
+                     sorted(os.path.join(self.directory, name)
+                            for name in os.listdir(self.directory)))
+
+  def test_reflink(self):
+    """Test cloning with copy-on-write copies."""
+    def cp(argv, *unused_args, **unused_kwargs):
+      shutil.copytree(argv[-2], argv[-1], symlinks=True)
+      return 0, ''
+    self.mock.execute_argv.side_effect = cp
+
+    self.assertEqual('reflink', common.clone_directory(
+        self.source, self.destination))
+    self.assert_cloned()
+    self.assertEqual(['cp', '-a', '--reflink=always', self.source],
+                     self.mock.execute_argv.call_args[0][0][:-1])
+
+  def test_copy(self):
+    """Test copying when the filesystem cannot clone files, so that writing
+    through the clone leaves the source unchanged."""
+    def cp(argv, *unused_args, **unused_kwargs):
+      if '--reflink=always' in argv:
+        return 1, 'Operation not supported'
+      return subprocess.call(argv), ''
+    self.mock.execute_argv.side_effect = cp
+
+    self.assertEqual('copy', common.clone_directory(
+        self.source, self.destination))
+    self.assert_cloned()
+
+    with open(os.path.join(self.destination, 'obj', 'd8.o'), 'w') as f:
+      f.write('rebuilt')
+    with open(os.path.join(self.source, 'obj', 'd8.o')) as f:
+      self.assertEqual('obj/d8.o', f.read())
+    self.assertFalse(os.path.samefile(
+        os.path.join(self.source, 'obj', 'd8.o'),
+        os.path.join(self.destination, 'obj', 'd8.o')))
+
+  def test_failure(self):
+    """Test that a directory that cannot be copied leaves nothing behind."""
+    self.mock.execute_argv.return_value = (1, 'No space left on device')
+
+    self.assertIsNone(common.clone_directory(self.source, self.destination))
+    self.assertEqual(['out_a'], os.listdir(self.directory))
+
+
 class GetSourceDirectoryTest(helpers.ExtendedTestCase):
   """Tests the get_source_directory method."""
 
@@ -579,10 +977,26 @@ class ExecuteWithShellTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'os.system', 'clusterfuzz.common.check_binary'
     ])
+    self.mock.system.return_value = 0
 
   def test_execute(self):
     """Test execute."""
-    common.execute_with_shell('test', 'args', '/dir')
+    self.assertEqual(0, common.execute_with_shell('test', 'args', '/dir'))
 
     self.mock.check_binary.assert_called_once_with('test', '/dir')
     self.mock.system.assert_called_once_with('cd /dir && test args')
+
+  def test_failure(self):
+    """Test exiting, or returning the exit code, when the command fails."""
+    self.mock.system.return_value = 3 << 8
+    with self.assertRaises(SystemExit) as cm:
+      common.execute_with_shell('test', 'args', '/dir')
+    self.assertEqual(3, cm.exception.code)
+
+    self.assertEqual(3, common.execute_with_shell('test', 'args', '/dir',
+                                                  exit_on_error=False))
+
+    # Killed by a signal.
+    self.mock.system.return_value = signal.SIGINT
+    self.assertEqual(1, common.execute_with_shell('test', 'args', '/dir',
+                                                  exit_on_error=False))
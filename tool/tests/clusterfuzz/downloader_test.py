@@ -0,0 +1,315 @@
+"""Test the downloader module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import base64
+import shutil
+import zipfile
+import hashlib
+import StringIO
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+import mock
+import requests
+
+from clusterfuzz import downloader
+from clusterfuzz import resource_usage
+import helpers
+
+CONTENT = ''.join(chr(i % 251) for i in range(1000))
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves CONTENT, in byte ranges if the server supports them."""
+
+  def log_message(self, *_):
+    pass
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    server = self.server
+    server.requests.append(self.headers.get('Range'))
+    if server.status != 200:
+      self.send_error(server.status)
+      return
+    match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+    if match and server.supports_ranges:
+      start, end = int(match.group(1)), int(match.group(2))
+      body = server.content[start:end + 1]
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+          start, end, len(server.content)))
+    else:
+      start, body = 0, server.content
+      self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', '"v1"')
+    self.send_header('x-goog-hash', 'crc32c=AAAAAA==,md5=%s' % server.md5)
+    self.end_headers()
+    if start in server.failing_offsets and len(body) > 1:
+      server.failing_offsets.remove(start)
+      body = body[:len(body) / 2]
+    self.wfile.write(body)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Runs Handler on a free local port."""
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+    self.url = 'http://127.0.0.1:%d/build.zip' % self.server_port
+    self.content = CONTENT
+    self.md5 = base64.b64encode(hashlib.md5(CONTENT).digest())
+    self.supports_ranges = True
+    self.status = 200
+    self.failing_offsets = set()
+    self.requests = []
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+class DownloadTest(helpers.ExtendedTestCase):
+  """Tests Download against a local server."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.print_progress_bar'])
+    self.server = Server()
+    self.addCleanup(self.server.stop)
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.path = os.path.join(self.directory, 'build.zip')
+    patcher = mock.patch.object(resource_usage, 'records', [])
+    self.addCleanup(patcher.stop)
+    self.records = patcher.start()
+
+  def download(self, **kwargs):
+    kwargs.setdefault('chunk_size', 300)
+    kwargs.setdefault('connections', 2)
+    return downloader.Download(self.server.url, self.path, **kwargs).start()
+
+  def assert_downloaded(self):
+    with open(self.path, 'rb') as f:
+      self.assertEqual(CONTENT, f.read())
+    self.assertEqual(['build.zip'], os.listdir(self.directory))
+
+  def test_parallel_chunks(self):
+    """Test downloading the chunks, the last one first."""
+    download = self.download(connections=1)
+    self.assertEqual(self.path, download.wait())
+
+    self.assert_downloaded()
+    self.assertEqual(['bytes=0-0', 'bytes=900-999', 'bytes=0-299',
+                      'bytes=300-599', 'bytes=600-899'], self.server.requests)
+    self.assertEqual([('download %s' % self.server.url, 'download', 0)],
+                     [(usage['command'], usage['phase'], usage['returncode'])
+                      for usage in self.records])
+
+  def test_wait_for(self):
+    """Test waiting for the content up to an offset."""
+    download = self.download()
+    download.wait_for_tail()
+    download.wait_for(600)
+    with download.condition:
+      self.assertGreaterEqual(download.get_complete_until(), 600)
+    download.wait()
+    self.assert_downloaded()
+
+  def test_resume(self):
+    """Test that a later download only fetches the missing chunks."""
+    with open(self.path + downloader.PARTIAL_SUFFIX, 'wb') as f:
+      f.write(CONTENT[:600] + '\0' * 400)
+    with open(self.path + downloader.STATE_SUFFIX, 'w') as f:
+      json.dump({'state': {'url': self.server.url, 'size': 1000,
+                           'etag': '"v1"', 'chunk_size': 300},
+                 'done': [0, 1]}, f)
+
+    self.download().wait()
+
+    self.assert_downloaded()
+    self.assertEqual(['bytes=0-0', 'bytes=600-899', 'bytes=900-999'],
+                     sorted(self.server.requests))
+
+  def test_resume_changed(self):
+    """Test starting over when the content changed since."""
+    with open(self.path + downloader.PARTIAL_SUFFIX, 'wb') as f:
+      f.write('\0' * 1000)
+    with open(self.path + downloader.STATE_SUFFIX, 'w') as f:
+      json.dump({'state': {'url': self.server.url, 'size': 1000,
+                           'etag': '"v0"', 'chunk_size': 300},
+                 'done': [0, 1]}, f)
+
+    self.download().wait()
+
+    self.assert_downloaded()
+    self.assertEqual(5, len(self.server.requests))
+
+  def test_retry(self):
+    """Test retrying a chunk that was cut short."""
+    self.server.failing_offsets.add(300)
+    self.download().wait()
+
+    self.assert_downloaded()
+    self.assertEqual(2, self.server.requests.count('bytes=300-599'))
+
+  def test_checksum_error(self):
+    """Test that corrupt content is thrown away."""
+    self.server.md5 = base64.b64encode(hashlib.md5('other').digest())
+    with self.assertRaises(downloader.ChecksumError):
+      self.download().wait()
+    self.assertEqual([], os.listdir(self.directory))
+    self.assertEqual([1], [usage['returncode'] for usage in self.records])
+
+  def test_no_ranges(self):
+    """Test downloading in one go from a server without byte ranges."""
+    self.server.supports_ranges = False
+    self.download().wait()
+
+    self.assert_downloaded()
+    self.assertEqual(['bytes=0-0', None], self.server.requests)
+
+  def test_network_error(self):
+    """Test retrying chunks whose connection failed, and giving up with a
+    DownloadError."""
+    real_get = requests.get
+    failures = ['Connection reset']
+    def get(url, headers, **kwargs):
+      if headers['Range'] == 'bytes=300-599' and failures:
+        raise requests.ConnectionError(failures.pop())
+      return real_get(url, headers=headers, **kwargs)
+
+    with mock.patch('requests.get', side_effect=get):
+      self.download().wait()
+    self.assert_downloaded()
+    self.assertEqual([], failures)
+
+    with mock.patch('requests.get', side_effect=requests.Timeout('Timed out')):
+      with self.assertRaises(downloader.NetworkError):
+        self.download()
+
+  def test_unauthorized(self):
+    """Test that refusals are told apart from other errors."""
+    self.server.status = 403
+    with self.assertRaises(downloader.AuthorizationError):
+      self.download()
+    self.server.status = 404
+    with self.assertRaises(downloader.NotFoundError):
+      self.download()
+    self.server.status = 500
+    with self.assertRaises(downloader.DownloadError):
+      self.download()
+
+
+def create_archive(padding_size):
+  """Returns a zip with a small args.gn after padding_size random bytes."""
+  archive = StringIO.StringIO()
+  with zipfile.ZipFile(archive, 'w') as zipped:
+    zipped.writestr('build/padding', os.urandom(padding_size))
+    zipped.writestr('build/args.gn', 'is_asan = true')
+  return archive.getvalue()
+
+
+class RangeFileTest(helpers.ExtendedTestCase):
+  """Tests RangeFile against a local server."""
+
+  def setUp(self):
+    self.server = Server()
+    self.addCleanup(self.server.stop)
+
+  def test_read(self):
+    """Test seeking and reading across blocks, and reusing them."""
+    remote_file = downloader.RangeFile(self.server.url, block_size=300)
+    self.assertEqual(1000, remote_file.size)
+
+    remote_file.seek(250)
+    self.assertEqual(CONTENT[250:650], remote_file.read(400))
+    self.assertEqual(650, remote_file.tell())
+    remote_file.seek(-100, os.SEEK_END)
+    self.assertEqual(CONTENT[900:], remote_file.read())
+    remote_file.seek(-50, os.SEEK_CUR)
+    self.assertEqual(CONTENT[950:], remote_file.read(500))
+    self.assertEqual('', remote_file.read())
+
+    self.assertEqual(['bytes=0-0', 'bytes=0-899', 'bytes=900-999'],
+                     self.server.requests)
+    self.assertEqual(1000, remote_file.fetched)
+
+  def test_read_archive_member(self):
+    """Test reading one member of an archive without fetching the rest."""
+    self.server.content = create_archive(1024 * 1024)
+    remote_file = downloader.RangeFile(self.server.url, block_size=1024)
+
+    self.assertEqual('is_asan = true',
+                     zipfile.ZipFile(remote_file).read('build/args.gn'))
+    self.assertLess(remote_file.fetched, 4 * 1024)
+
+  def test_no_ranges(self):
+    """Test refusing a server that does not serve byte ranges."""
+    self.server.supports_ranges = False
+    with self.assertRaises(downloader.DownloadError):
+      downloader.RangeFile(self.server.url)
+
+  def test_network_error(self):
+    """Test that failed connections and reads are DownloadErrors."""
+    remote_file = downloader.RangeFile(self.server.url, block_size=300)
+    with mock.patch('requests.get', side_effect=requests.ConnectionError(
+        'Connection refused')):
+      with self.assertRaises(downloader.NetworkError):
+        downloader.RangeFile(self.server.url)
+      with self.assertRaises(downloader.NetworkError):
+        remote_file.read(10)
+
+    response = mock.Mock(status_code=206)
+    type(response).content = mock.PropertyMock(
+        side_effect=requests.exceptions.ChunkedEncodingError('Cut short'))
+    with mock.patch('requests.get', return_value=response):
+      with self.assertRaises(downloader.DownloadError):
+        remote_file.read(10)
+
+
+class GetMd5Test(helpers.ExtendedTestCase):
+  """Tests get_md5."""
+
+  def test_headers(self):
+    """Test reading the MD5 from either header."""
+    md5 = base64.b64encode(hashlib.md5('abc').digest())
+    self.assertEqual(hashlib.md5('abc').hexdigest(), downloader.get_md5(
+        {'x-goog-hash': 'crc32c=AAAAAA==,md5=%s' % md5}))
+    self.assertEqual(hashlib.md5('abc').hexdigest(),
+                     downloader.get_md5({'Content-MD5': md5}))
+    self.assertIsNone(downloader.get_md5({'x-goog-hash': 'crc32c=AAAAAA=='}))
+
+
+class GetGcsUrlTest(helpers.ExtendedTestCase):
+  """Tests get_gcs_url."""
+
+  def test_urls(self):
+    """Test converting Cloud Storage URLs, and leaving others be."""
+    self.assertEqual('https://storage.googleapis.com/bucket/build.zip',
+                     downloader.get_gcs_url('gs://bucket/build.zip'))
+    self.assertEqual(
+        'https://storage.googleapis.com/bucket/build.zip',
+        downloader.get_gcs_url(
+            'https://storage.cloud.google.com/bucket/build.zip'))
+    self.assertEqual('http://example.com/build.zip',
+                     downloader.get_gcs_url('http://example.com/build.zip'))
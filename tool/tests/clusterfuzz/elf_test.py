@@ -0,0 +1,89 @@
+"""Test the elf module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import elf
+import helpers
+
+BASE_ADDRESS = 0x400000
+
+
+def make_elf(needed, is_64=True, endianness='<'):
+  """Returns a minimal ELF file whose dynamic section needs the libraries
+  named in needed."""
+  fmt = elf.Format(is_64, endianness)
+  strings = '\0'
+  name_offsets = []
+  for name in needed:
+    name_offsets.append(len(strings))
+    strings += name + '\0'
+
+  phoff = 16 + fmt.header.size
+  dynamic_offset = phoff + 2 * fmt.program_header.size
+  entries = [(elf.DT_NEEDED, offset) for offset in name_offsets]
+  entries.append((elf.DT_STRTAB, None))
+  entries.append((elf.DT_NULL, 0))
+  dynamic_size = len(entries) * fmt.dynamic_entry.size
+  strings_offset = dynamic_offset + dynamic_size
+  file_size = strings_offset + len(strings)
+  entries[-2] = (elf.DT_STRTAB, BASE_ADDRESS + strings_offset)
+
+  def program_header(p_type, offset, address, size):
+    if is_64:
+      return fmt.program_header.pack(p_type, 4, offset, address, address,
+                                     size, size, 0x1000)
+    return fmt.program_header.pack(p_type, offset, address, address, size,
+                                   size, 4, 0x1000)
+
+  ident = (elf.ELF_MAGIC + chr(elf.ELFCLASS64 if is_64 else 1) +
+           chr(elf.ELFDATA2LSB if endianness == '<' else 2) + '\x01' +
+           '\0' * 9)
+  header = fmt.header.pack(3, 62, 1, 0, phoff, 0, 0, phoff,
+                           fmt.program_header.size, 2, 0, 0, 0)
+  return ''.join(
+      [ident, header,
+       program_header(elf.PT_LOAD, 0, BASE_ADDRESS, file_size),
+       program_header(elf.PT_DYNAMIC, dynamic_offset,
+                      BASE_ADDRESS + dynamic_offset, dynamic_size)] +
+      [fmt.dynamic_entry.pack(tag, value) for tag, value in entries] +
+      [strings])
+
+
+class GetNeededLibrariesTest(helpers.ExtendedTestCase):
+  """Tests get_needed_libraries."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_64_bit(self):
+    """Test reading a little-endian 64-bit binary."""
+    self.fs.CreateFile('/build/d8', contents=make_elf(
+        ['libv8.so', 'libc.so.6']))
+    self.assertEqual(['libv8.so', 'libc.so.6'],
+                     elf.get_needed_libraries('/build/d8'))
+
+  def test_32_bit(self):
+    """Test reading a big-endian 32-bit binary."""
+    self.fs.CreateFile('/build/d8', contents=make_elf(
+        ['libicu.so'], is_64=False, endianness='>'))
+    self.assertEqual(['libicu.so'], elf.get_needed_libraries('/build/d8'))
+
+  def test_not_elf(self):
+    """Test that scripts, binaries without libraries and broken files need
+    nothing."""
+    self.fs.CreateFile('/build/script', contents='#!/bin/sh\n')
+    self.fs.CreateFile('/build/no_libraries', contents=make_elf([]))
+    self.fs.CreateFile('/build/truncated', contents=make_elf(['a.so'])[:100])
+    for name in ['script', 'no_libraries', 'truncated']:
+      self.assertEqual([], elf.get_needed_libraries('/build/' + name))
@@ -26,7 +26,9 @@ class MainTest(unittest.TestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.execute',
-        'clusterfuzz.local_logging.start_loggers'
+        'clusterfuzz.local_logging.start_loggers',
+        'clusterfuzz.tracing.start',
+        'clusterfuzz.tracing.write'
     ])
 
   def test_parse_reproduce(self):
@@ -38,29 +40,78 @@ class MainTest(unittest.TestCase):
     main.execute(['reproduce', '1234', '--build', 'chromium', '-i', '500'])
     main.execute(['reproduce', '1234', '--target-args', '--test --test2'])
     main.execute(['reproduce', '1234', '--edit-mode'])
+    main.execute(['reproduce', '1234', '--gn-check'])
+    main.execute(['reproduce', '1234', '--force-sync'])
 
     self.mock.start_loggers.assert_has_calls([mock.call()])
     self.mock.execute.assert_has_calls([
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=True, target_args='', edit_mode=False),
+                  disable_xvfb=True, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=False),
         mock.call(build='chromium', current=True, disable_goma=False,
                   j=25, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=False),
         mock.call(build='download', current=False, disable_goma=True,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=False),
         mock.call(build='standalone', current=True, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=False),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=500,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=False),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
                   disable_xvfb=False, target_args='--test --test2',
-                  edit_mode=False),
+                  edit_mode=False, gn_check=False, force_sync=False),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=True)
+                  disable_xvfb=False, target_args='', edit_mode=True,
+                  gn_check=False, force_sync=False),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id='1234', iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=True, force_sync=False),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id='1234', iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  gn_check=False, force_sync=True)
     ])
+
+  def test_trace_file(self):
+    """Test recording a trace of the command."""
+    main.execute(['reproduce', '1234', '--trace-file', '/tmp/trace.json'])
+
+    self.mock.start.assert_called_once_with()
+    self.mock.execute.assert_called_once_with(
+        build='chromium', current=False, disable_goma=False, j=None,
+        testcase_id='1234', iterations=10, disable_xvfb=False,
+        target_args='', edit_mode=False, gn_check=False, force_sync=False)
+    self.mock.write.assert_called_once_with('/tmp/trace.json')
+
+  def test_parse_prefetch(self):
+    """Test parse prefetch command."""
+    helpers.patch(self, [('prefetch_execute',
+                          'clusterfuzz.commands.prefetch.execute')])
+    main.execute(['prefetch', '1234', '5678', '-b', 'download', '-j', '2'])
+
+    self.mock.prefetch_execute.assert_called_once_with(
+        testcase_ids=['1234', '5678'], build='download', j=2)
+
+  def test_parse_cache(self):
+    """Test parse cache command."""
+    helpers.patch(self, [('cache_execute',
+                          'clusterfuzz.commands.cache.execute')])
+    main.execute(['cache', 'list'])
+    main.execute(['cache', 'pin', '1234'])
+    main.execute(['cache', 'prune', '--budget', '20G', '--untracked'])
+
+    self.mock.cache_execute.assert_has_calls([
+        mock.call(action='list'),
+        mock.call(action='pin', key='1234'),
+        mock.call(action='prune', budget='20G', untracked=True)])
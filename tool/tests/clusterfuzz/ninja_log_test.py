@@ -0,0 +1,163 @@
+"""Test the 'ninja_log' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+
+from clusterfuzz import ninja_log
+import helpers
+
+# Two builds: a cold one, and one that rebuilt a.o and relinked d8.
+NINJA_LOG = '\n'.join([
+    '# ninja log v5',
+    '0\t100\t0\tobj/a.o\taaa',
+    '0\t300\t0\tobj/b.o\tbbb',
+    '300\t900\t0\td8\tddd',
+    '300\t900\t0\td8.TOC\tddd',
+    '0\t200\t0\tobj/a.o\taaa2',
+    '200\t700\t0\td8\tddd',
+    '200\t700\t0\td8.TOC\tddd',
+    ''])
+
+
+def write_log(build_dir, content=NINJA_LOG):
+  os.makedirs(build_dir)
+  with open(os.path.join(build_dir, '.ninja_log'), 'w') as f:
+    f.write(content)
+
+
+class ParseTest(helpers.ExtendedTestCase):
+  """Tests parse."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_parse(self):
+    """Test splitting the log into builds, grouping outputs into edges."""
+    write_log('/out')
+
+    builds = ninja_log.parse('/out/.ninja_log')
+
+    self.assertEqual([
+        [ninja_log.Edge(0, 100, 'aaa', ['obj/a.o']),
+         ninja_log.Edge(0, 300, 'bbb', ['obj/b.o']),
+         ninja_log.Edge(300, 900, 'ddd', ['d8', 'd8.TOC'])],
+        [ninja_log.Edge(0, 200, 'aaa2', ['obj/a.o']),
+         ninja_log.Edge(200, 700, 'ddd', ['d8', 'd8.TOC'])]], builds)
+
+  def test_unsupported(self):
+    """Test refusing logs in an unknown format."""
+    write_log('/out', '# ninja log v4\n')
+
+    with self.assertRaises(ninja_log.NinjaLogError):
+      ninja_log.parse('/out/.ninja_log')
+
+
+class GetCriticalPathTest(helpers.ExtendedTestCase):
+  """Tests get_critical_path."""
+
+  def test_path(self):
+    """Test walking back from the last edge to finish."""
+    a = ninja_log.Edge(0, 100, 'a', ['a.o'])
+    b = ninja_log.Edge(0, 300, 'b', ['b.o'])
+    c = ninja_log.Edge(100, 250, 'c', ['c.o'])
+    d = ninja_log.Edge(300, 900, 'd', ['d8'])
+    instant = ninja_log.Edge(900, 900, 'e', ['e.stamp'])
+
+    self.assertEqual([b, d, instant],
+                     ninja_log.get_critical_path([a, b, c, d, instant]))
+    self.assertEqual([], ninja_log.get_critical_path([]))
+
+
+class ProfileTest(helpers.ExtendedTestCase):
+  """Tests profile and format_report."""
+
+  def test_profile(self):
+    """Test profiling the last build against the earlier ones."""
+    builds = [
+        [ninja_log.Edge(0, 100, 'aaa', ['obj/a.o']),
+         ninja_log.Edge(0, 300, 'bbb', ['obj/b.o']),
+         ninja_log.Edge(300, 900, 'ddd', ['d8', 'd8.TOC'])],
+        [ninja_log.Edge(0, 200, 'aaa2', ['obj/a.o']),
+         ninja_log.Edge(0, 200, 'gen', ['gen/x.stamp']),
+         ninja_log.Edge(200, 700, 'ddd', ['d8', 'd8.TOC'])]]
+
+    profile = ninja_log.profile(builds, 2)
+
+    self.assertEqual(3, profile['edges_rebuilt'])
+    self.assertEqual(1, profile['edges_up_to_date'])
+    self.assertFalse(profile['cold_out_dir'])
+    self.assertEqual(0.7, profile['wall_seconds'])
+    self.assertEqual(0.9, profile['busy_seconds'])
+    self.assertAlmostEqual(0.9 / 0.7, profile['parallelism'])
+    self.assertAlmostEqual(0.45 / 0.7, profile['utilization'])
+    self.assertEqual(0.7, profile['critical_path_seconds'])
+    self.assertEqual(['gen/x.stamp', 'd8'],
+                     [edge['output'] for edge in profile['critical_path']])
+    self.assertEqual(
+        [{'output': 'obj/a.o', 'kind': 'compile', 'seconds': 0.2}],
+        profile['slowest']['compile'])
+    self.assertEqual(
+        [{'output': 'd8', 'kind': 'link', 'seconds': 0.5}],
+        profile['slowest']['link'])
+
+    report = ninja_log.format_report(profile)
+    self.assertIn('Edges rebuilt: 3, already up to date: 1\n', report)
+    self.assertIn('Effective parallelism: 1.3 of -j 2 (64%)', report)
+
+  def test_nothing_rebuilt(self):
+    """Test profiling a build that found everything up to date."""
+    builds = [[ninja_log.Edge(0, 100, 'aaa', ['obj/a.o'])], []]
+
+    profile = ninja_log.profile(builds, 2)
+
+    self.assertEqual(0, profile['edges_rebuilt'])
+    self.assertEqual(1, profile['edges_up_to_date'])
+    self.assertEqual(0, profile['parallelism'])
+    self.assertEqual([], profile['critical_path'])
+    self.assertIn('Edges rebuilt: 0', ninja_log.format_report(profile))
+
+
+class ReportTest(helpers.ExtendedTestCase):
+  """Tests report."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_report(self):
+    """Test writing the profile of the last build."""
+    write_log('/out')
+
+    profile = ninja_log.report('/out', 4, 0, '/logs/build_profile.json')
+
+    self.assertEqual(2, profile['edges_rebuilt'])
+    with open('/logs/build_profile.json') as f:
+      self.assertEqual(json.loads(json.dumps(profile)), json.load(f))
+
+  def test_up_to_date(self):
+    """Test that an untouched log means nothing was rebuilt."""
+    write_log('/out')
+
+    profile = ninja_log.report(
+        '/out', 4, os.path.getmtime('/out/.ninja_log') + 1,
+        '/logs/build_profile.json')
+
+    self.assertEqual(0, profile['edges_rebuilt'])
+    self.assertEqual(3, profile['edges_up_to_date'])
+
+  def test_no_log(self):
+    """Test that a missing log is not an error."""
+    self.assertIsNone(ninja_log.report('/out', 4, 0, '/logs/profile.json'))
+    self.assertFalse(os.path.exists('/logs/profile.json'))
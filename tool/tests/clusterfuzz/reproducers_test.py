@@ -14,10 +14,12 @@
 # limitations under the License.
 
 import os
+import errno
 import json
 import mock
 
 import helpers
+from clusterfuzz import binary_providers
 from clusterfuzz import reproducers
 from clusterfuzz import common
 
@@ -32,6 +34,14 @@ def patch_stacktrace_info(obj):
   obj.addCleanup(patcher.stop)
 
 
+def create_output(text):
+  """Creates a CapturedOutput holding text."""
+  output = common.CapturedOutput()
+  output.append(text.split('\n'))
+  output.finish(ends_with_newline=False)
+  return output
+
+
 def create_reproducer(klass):
   """Creates a LinuxChromeJobReproducer for use in testing."""
 
@@ -180,7 +190,7 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             '--repro --test %s' % self.testcase_path,
             '/chrome/source/folder',
             env={'ASAN_OPTIONS': 'test-asan'},
-            exit_on_error=False)
+            exit_on_error=False, lazy_output=True)
     ])
 
   def test_base_with_env_args(self):
@@ -208,7 +218,7 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
                                                    self.testcase_path),
             '/chrome/source/folder',
             env={'ASAN_OPTIONS': 'test-asan'},
-            exit_on_error=False)
+            exit_on_error=False, lazy_output=True)
     ])
 
   def test_chromium(self):
@@ -245,7 +255,8 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             })
     ])
     self.assert_exact_calls(self.mock.wait_execute, [mock.call(
-        self.mock.start_execute.return_value, exit_on_error=False, timeout=30)])
+        self.mock.start_execute.return_value, exit_on_error=False, timeout=30,
+        lazy_output=True)])
     self.assert_exact_calls(self.mock.run_gestures, [mock.call(
         reproducer, self.mock.start_execute.return_value, ':display')])
 
@@ -347,7 +358,7 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.get_process_ids',
-        'clusterfuzz.common.execute',
+        'clusterfuzz.common.execute_argv',
         'time.sleep'])
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
@@ -358,18 +369,24 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
     self.mock.get_process_ids.return_value = []
 
     self.reproducer.find_windows_for_process(1234, ':45434')
-    self.assert_n_calls(0, [self.mock.execute])
+    self.assert_n_calls(0, [self.mock.execute_argv])
 
   def test_dedup_pids(self):
     """Tests when duplicate pids are introduced."""
 
     self.mock.get_process_ids.return_value = [1234, 5678]
-    self.mock.execute.side_effect = [(0, '234\n567\nabcd\n890'),
-                                     (0, '123\n567\n345')]
+    self.mock.execute_argv.side_effect = [(0, '234\n567\nabcd\n890'),
+                                          (0, '123\n567\n345')]
 
     result = self.reproducer.find_windows_for_process(1234, ':45434')
     self.assertEqual(result, set(['234', '567', '890', '123', '345']))
     self.assert_exact_calls(self.mock.sleep, [mock.call(20)])
+    self.assert_exact_calls(self.mock.execute_argv, [
+        mock.call(['xdotool', 'search', '--all', '--pid', str(pid),
+                   '--onlyvisible', '--name', '.*'], '.',
+                  env={'DISPLAY': ':45434'}, exit_on_error=False,
+                  print_command=False, print_output=False)
+        for pid in [1234, 5678]])
 
 
 class GetProcessIdsTest(helpers.ExtendedTestCase):
@@ -572,7 +589,7 @@ class ReproduceTest(helpers.ExtendedTestCase):
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.post_run_symbolize',
         'requests.post',
         'time.sleep'])
-    self.mock.reproduce_crash.return_value = (0, ['stuff'])
+    self.mock.reproduce_crash.return_value = (0, create_output('stuff'))
     self.mock.post_run_symbolize.return_value = 'stuff'
     self.reproducer.crash_type = 'original_type'
     self.reproducer.crash_state = ['original', 'state']
@@ -607,6 +624,44 @@ class ReproduceTest(helpers.ExtendedTestCase):
     self.assertTrue(result)
     self.assert_exact_calls(self.mock.reproduce_crash, [
         mock.call(self.reproducer), mock.call(self.reproducer)])
+    self.assert_n_calls(
+        0, [self.reproducer.binary_provider.extract_remaining])
+
+  def test_extract_remaining(self):
+    """Tests pulling in the rest of a partly extracted build after a miss."""
+    self.reproducer.EXTRACT_NEEDED_ONLY = True
+    self.mock.post.side_effect = [
+        mock.Mock(text=json.dumps({'crash_type': 'wrong type',
+                                   'crash_state': 'incorrect'})),
+        mock.Mock(text=json.dumps({'crash_type': 'original_type',
+                                   'crash_state': 'original\nstate'}))]
+
+    self.assertTrue(self.reproducer.reproduce(10))
+    self.assert_exact_calls(
+        self.reproducer.binary_provider.extract_remaining, [mock.call()])
+
+  def test_builder_never_extracts(self):
+    """Tests that a built binary is never extracted into, even when a partly
+    extracted download of its build is around."""
+    helpers.patch(self, ['clusterfuzz.archive.extract',
+                         'clusterfuzz.binary_providers.sha_from_revision'])
+    self.setup_fake_filesystem()
+    builder = binary_providers.V8Builder(
+        mock.Mock(id=1234, build_url='https://storage/abc.zip', revision=5,
+                  gn_args=None),
+        mock.Mock(source_var='V8_SRC'), False, None, None, False)
+    partial_archive = os.path.join(builder.build_dir_name(),
+                                   binary_providers.PARTIAL_BUILD_ARCHIVE)
+    self.fs.CreateFile(partial_archive)
+    self.reproducer.binary_provider = builder
+    self.reproducer.EXTRACT_NEEDED_ONLY = True
+    self.mock.post.return_value = mock.Mock(text=json.dumps(
+        {'crash_type': 'wrong type', 'crash_state': 'incorrect'}))
+
+    with self.assertRaises(SystemExit):
+      self.reproducer.reproduce(2)
+    self.assert_n_calls(0, [self.mock.extract])
+    self.assertTrue(os.path.exists(partial_archive))
 
 
 class PostRunSymbolizeTest(helpers.ExtendedTestCase):
@@ -616,24 +671,23 @@ class PostRunSymbolizeTest(helpers.ExtendedTestCase):
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
     self.reproducer.source_directory = '/path/to/chromium'
     helpers.patch(self, ['clusterfuzz.common.start_execute',
+                         'clusterfuzz.common.wait_execute',
                          'clusterfuzz.common.get_resource'])
     self.mock.get_resource.return_value = 'asan_sym_proxy.py'
-    (self.mock.start_execute.return_value.
-     communicate.return_value) = ('symbolized', 0)
+    self.stdin = mock.Mock()
+    self.mock.start_execute.return_value = mock.Mock(stdin=self.stdin)
+    self.mock.wait_execute.return_value = (0, 'symbolized')
 
   def test_symbolize_no_output(self):
     """Test to ensure no symbolization is done with no output."""
-    output = ' '
-    result = self.reproducer.post_run_symbolize(output)
+    result = self.reproducer.post_run_symbolize(create_output(' '))
 
     self.assert_exact_calls(self.mock.start_execute, [])
-    self.assertEqual(result, '')
+    self.assertEqual(result.read(), '')
 
   def test_symbolize_output(self):
     """Test to ensure the correct symbolization call are made."""
-    output = 'output_lines'
-
-    result = self.reproducer.post_run_symbolize(output)
+    result = self.reproducer.post_run_symbolize(create_output('output_lines'))
 
     self.assert_exact_calls(self.mock.start_execute, [
         mock.call(
@@ -642,11 +696,31 @@ class PostRunSymbolizeTest(helpers.ExtendedTestCase):
             env={'LLVM_SYMBOLIZER_PATH': 'asan_sym_proxy.py',
                  'CHROMIUM_SRC': '/path/to/chromium'})
     ])
-    self.assert_exact_calls(self.mock.start_execute.return_value.communicate,
-                            [mock.call(input='output_lines\x00')])
+    self.assert_exact_calls(self.mock.wait_execute, [
+        mock.call(self.mock.start_execute.return_value, exit_on_error=False,
+                  print_output=False, lazy_output=True)
+    ])
+    self.assert_exact_calls(self.stdin.write, [
+        mock.call('output_lines'), mock.call('\0')])
+    self.assert_exact_calls(self.stdin.close, [mock.call()])
     self.assertEqual(result, 'symbolized')
 
 
+class WriteSymbolizerInputTest(helpers.ExtendedTestCase):
+  """Tests write_symbolizer_input."""
+
+  def test_broken_pipe(self):
+    """Test the symbolizer exiting before reading all of its input."""
+    error = IOError()
+    error.errno = errno.EPIPE
+    stdin = mock.Mock()
+    stdin.write.side_effect = error
+
+    reproducers.write_symbolizer_input(stdin, create_output('output'))
+
+    self.assert_exact_calls(stdin.close, [mock.call()])
+
+
 class StripHtmlTest(helpers.ExtendedTestCase):
   """Test strip_html."""
 
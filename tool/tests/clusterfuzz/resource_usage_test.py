@@ -0,0 +1,175 @@
+"""Test the 'resource_usage' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import subprocess
+import mock
+
+from clusterfuzz import resource_usage
+import helpers
+
+
+def mock_records(testcase_obj):
+  """Gives the test its own list of recorded commands."""
+  patcher = mock.patch.object(resource_usage, 'records', [])
+  testcase_obj.addCleanup(patcher.stop)
+  return patcher.start()
+
+
+class GetPhaseTest(helpers.ExtendedTestCase):
+  """Tests get_phase and the phase context manager."""
+
+  def test_binary(self):
+    """Test deriving the phase from the binary."""
+    self.assertEqual('ninja', resource_usage.get_phase('ninja'))
+    self.assertEqual('symbolize', resource_usage.get_phase(
+        '/src/tools/valgrind/asan/asan_symbolize.py'))
+    self.assertEqual('other', resource_usage.get_phase('python'))
+
+  def test_phase(self):
+    """Test overriding the phase, and restoring it after."""
+    with resource_usage.phase('reproduce'):
+      self.assertEqual('reproduce', resource_usage.get_phase('ninja'))
+      with resource_usage.phase('symbolize'):
+        self.assertEqual('symbolize', resource_usage.get_phase('ninja'))
+      self.assertEqual('reproduce', resource_usage.current_phase())
+    self.assertIsNone(resource_usage.current_phase())
+
+
+class ProcessTreeMonitorTest(helpers.ExtendedTestCase):
+  """Tests ProcessTreeMonitor."""
+
+  def setUp(self):
+    self.records = mock_records(self)
+
+  def test_sample(self):
+    """Test sampling a process along with its children."""
+    proc = subprocess.Popen(['sh', '-c', 'sleep 1 & sleep 1; wait'])
+    self.addCleanup(proc.wait)
+    self.addCleanup(proc.kill)
+    monitor = resource_usage.ProcessTreeMonitor(proc.pid, 'sh', 'other')
+
+    while len(monitor.cpu_seconds) < 3:
+      monitor.sample(force=True)
+
+    self.assertIn(proc.pid, monitor.cpu_seconds)
+    self.assertGreater(monitor.peak_rss, 0)
+
+  def test_sample_throttled(self):
+    """Test that samples are only taken every SAMPLE_INTERVAL seconds."""
+    monitor = resource_usage.ProcessTreeMonitor(os.getpid(), 'cmd', 'other')
+    monitor.sample()
+    monitor.cpu_seconds.clear()
+
+    monitor.sample()
+    self.assertEqual({}, monitor.cpu_seconds)
+    monitor.sample(force=True)
+    self.assertIn(os.getpid(), monitor.cpu_seconds)
+
+  def test_sample_gone(self):
+    """Test sampling a process which no longer exists."""
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    monitor = resource_usage.ProcessTreeMonitor(proc.pid, 'true', 'other')
+
+    monitor.sample()
+
+    self.assertEqual(0, monitor.peak_rss)
+    self.assertEqual({}, monitor.cpu_seconds)
+
+  def test_finish(self):
+    """Test recording the usage of a finished command."""
+    monitor = resource_usage.ProcessTreeMonitor(1234, 'ninja -C out', 'ninja')
+    monitor.cpu_seconds = {1234: 1.5, 1235: 2.5}
+    monitor.io_bytes = {1234: 100, 1235: 20}
+    monitor.peak_rss = 4096
+
+    usage = monitor.finish(0)
+
+    self.assertEqual([usage], self.records)
+    self.assertEqual('ninja -C out', usage['command'])
+    self.assertEqual('ninja', usage['phase'])
+    self.assertEqual(0, usage['returncode'])
+    self.assertEqual(4.0, usage['cpu_seconds'])
+    self.assertEqual(120, usage['io_bytes'])
+    self.assertEqual(4096, usage['peak_rss_bytes'])
+
+
+class InProcessTest(helpers.ExtendedTestCase):
+  """Tests in_process."""
+
+  def setUp(self):
+    self.records = mock_records(self)
+
+  def test_record(self):
+    """Test recording work done in this process under its phase."""
+    with resource_usage.in_process('unzip', 'extract build.zip'):
+      sum(xrange(100000))
+
+    usage, = self.records
+    self.assertEqual('extract build.zip', usage['command'])
+    self.assertEqual('unzip', usage['phase'])
+    self.assertEqual(0, usage['returncode'])
+    self.assertGreaterEqual(usage['cpu_seconds'], 0)
+    self.assertGreater(usage['peak_rss_bytes'], 0)
+
+  def test_phase(self):
+    """Test that a phase set by the caller wins."""
+    with resource_usage.phase('reproduce'):
+      with resource_usage.in_process('unzip', 'extract build.zip'):
+        pass
+    self.assertEqual('reproduce', self.records[0]['phase'])
+
+  def test_error(self):
+    """Test recording work that failed."""
+    with self.assertRaises(IOError):
+      with resource_usage.in_process('unzip', 'extract build.zip'):
+        raise IOError('No space left on device')
+    self.assertEqual(1, self.records[0]['returncode'])
+
+
+class WriteSummaryTest(helpers.ExtendedTestCase):
+  """Tests write_summary."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.records = mock_records(self)
+    self.records.extend([
+        {'command': 'gn gen', 'phase': 'gn', 'returncode': 0,
+         'wall_seconds': 2, 'cpu_seconds': 1, 'peak_rss_bytes': 10,
+         'io_bytes': 5},
+        {'command': 'ninja a', 'phase': 'ninja', 'returncode': 0,
+         'wall_seconds': 10, 'cpu_seconds': 50, 'peak_rss_bytes': 300,
+         'io_bytes': 7},
+        {'command': 'ninja b', 'phase': 'ninja', 'returncode': 1,
+         'wall_seconds': 5, 'cpu_seconds': 20, 'peak_rss_bytes': 200,
+         'io_bytes': 3}])
+
+  def test_write(self):
+    """Test totalling the usage by phase, and writing it as JSON."""
+    path = os.path.join('/logs', 'resource_usage.json')
+
+    summary = resource_usage.write_summary('linux_asan_d8', path)
+
+    with open(path) as f:
+      self.assertEqual(json.loads(json.dumps(summary)), json.load(f))
+    self.assertEqual('linux_asan_d8', summary['job_type'])
+    self.assertEqual(['gn', 'ninja'], summary['phases'].keys())
+    self.assertEqual(
+        {'commands': 2, 'wall_seconds': 15, 'cpu_seconds': 70,
+         'peak_rss_bytes': 300, 'io_bytes': 10},
+        summary['phases']['ninja'])
+    self.assertEqual(3, len(summary['commands']))
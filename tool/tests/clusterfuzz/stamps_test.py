@@ -0,0 +1,91 @@
+"""Test the stamps module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mock
+
+from clusterfuzz import stamps
+import helpers
+
+
+class RunTest(helpers.ExtendedTestCase):
+  """Tests run."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fn = mock.Mock()
+
+  def test_unchanged(self):
+    """Test running a step once while its inputs stay the same."""
+    self.assertTrue(stamps.run('sync', '/src', {'sha': 'a'}, self.fn))
+    self.assertFalse(stamps.run('sync', '/src', {'sha': 'a'}, self.fn))
+    self.assertEqual(1, self.fn.call_count)
+
+  def test_changed(self):
+    """Test running a step again for other inputs, steps or directories."""
+    stamps.run('sync', '/src', {'sha': 'a'}, self.fn)
+    stamps.run('sync', '/src', {'sha': 'b'}, self.fn)
+    stamps.run('runhooks', '/src', {'sha': 'b'}, self.fn)
+    stamps.run('sync', '/other_src', {'sha': 'b'}, self.fn)
+    self.assertEqual(4, self.fn.call_count)
+
+  def test_forced(self):
+    """Test running a step regardless of its stamp."""
+    stamps.run('sync', '/src', {'sha': 'a'}, self.fn)
+    self.assertTrue(stamps.run('sync', '/src', {'sha': 'a'}, self.fn,
+                               force=True))
+    self.assertEqual(2, self.fn.call_count)
+
+  def test_failure(self):
+    """Test that a step that fails is not recorded."""
+    self.fn.side_effect = SystemExit
+    with self.assertRaises(SystemExit):
+      stamps.run('sync', '/src', {'sha': 'a'}, self.fn)
+    self.assertFalse(stamps.is_current('sync', '/src', {'sha': 'a'}))
+
+  def test_outputs(self):
+    """Test running a step again when what it outputs is gone."""
+    stamps.run('clang', '/src', {}, self.fn, outputs=['/src/llvm-build'])
+    stamps.run('clang', '/src', {}, self.fn, outputs=['/src/llvm-build'])
+    self.assertEqual(2, self.fn.call_count)
+    self.fs.CreateDirectory('/src/llvm-build')
+    stamps.run('clang', '/src', {}, self.fn, outputs=['/src/llvm-build'])
+    self.assertEqual(2, self.fn.call_count)
+
+  def test_clear(self):
+    """Test running a step again after its stamp is cleared."""
+    stamps.run('sync', '/src', {'sha': 'a'}, self.fn)
+    stamps.clear('sync', '/src')
+    stamps.clear('sync', '/src')
+    stamps.run('sync', '/src', {'sha': 'a'}, self.fn)
+    self.assertEqual(2, self.fn.call_count)
+
+  def test_broken_stamp(self):
+    """Test that an unreadable stamp is not current."""
+    self.fs.CreateFile(stamps.get_stamp_path('sync', '/src'), contents='{')
+    self.assertFalse(stamps.is_current('sync', '/src', {'sha': 'a'}))
+
+
+class HashFileTest(helpers.ExtendedTestCase):
+  """Tests hash_file."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_hash(self):
+    """Test hashing files, and missing ones."""
+    self.fs.CreateFile('/src/DEPS', contents='deps = {}')
+    self.assertEqual(40, len(stamps.hash_file('/src/DEPS')))
+    self.assertIsNone(stamps.hash_file(os.path.join('/src', 'missing')))
@@ -17,6 +17,7 @@ import os
 import mock
 
 import helpers
+from clusterfuzz import artifact_store
 from clusterfuzz import common
 from clusterfuzz import testcase
 
@@ -100,6 +101,7 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
   def setUp(self):
     self.setup_fake_filesystem()
     helpers.patch(self, [
+        'clusterfuzz.cache.use_testcase',
         'clusterfuzz.common.get_stored_auth_header',
         'clusterfuzz.common.execute',
         'clusterfuzz.common.delete_if_exists',
@@ -132,10 +134,27 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
             'wget',
             '--content-disposition --header="Authorization: %s" "%s"' % (
                 self.mock.get_stored_auth_header.return_value,
-                testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345)),
+                artifact_store.CLUSTERFUZZ_TESTCASE_URL % str(12345)),
             self.testcase_dir)
     ])
+    self.assert_exact_calls(self.mock.use_testcase, [
+        mock.call('12345', self.testcase_dir)])
     self.assertTrue(os.path.exists(self.testcase_dir))
+    with open(os.path.join(self.testcase_dir, testcase.DOWNLOADED_MARKER)) as f:
+      self.assertEqual(file_path, f.read())
+
+  def test_downloaded_before(self):
+    """Tests reusing a testcase that was downloaded completely before."""
+    file_path = os.path.join(self.testcase_dir, 'testcase.js')
+    self.fs.CreateFile(file_path)
+    self.fs.CreateFile(
+        os.path.join(self.testcase_dir, testcase.DOWNLOADED_MARKER),
+        contents=file_path)
+
+    self.assertEqual(file_path, self.test.get_testcase_path())
+    self.assert_n_calls(0, [self.mock.execute, self.mock.delete_if_exists])
+    self.assert_exact_calls(self.mock.use_testcase, [
+        mock.call('12345', self.testcase_dir, update=False)])
 
 
 class GetTrueTestcasePathTest(helpers.ExtendedTestCase):
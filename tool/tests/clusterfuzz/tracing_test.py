@@ -0,0 +1,119 @@
+"""Test the 'tracing' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import tracing
+import helpers
+
+
+class TracingTest(helpers.ExtendedTestCase):
+  """Tests recording spans and writing them out."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    patcher = mock.patch.object(tracing, 'events', None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    helpers.patch(self, ['clusterfuzz.tracing.now'])
+    self.mock.now.side_effect = [10, 15, 20, 40]
+
+  def read_trace(self):
+    tracing.write('/trace.json')
+    with open('/trace.json') as f:
+      return json.load(f)
+
+  def test_disabled(self):
+    """Test that nothing is recorded unless tracing is started."""
+    with tracing.span('gclient'):
+      pass
+
+    self.assertIsNone(tracing.events)
+    self.assert_n_calls(0, [self.mock.now])
+
+  def test_span(self):
+    """Test recording nested spans, with their arguments."""
+    tracing.start()
+    with tracing.span('build'):
+      with tracing.span('ninja', 'command', args='-C out'):
+        pass
+
+    events = self.read_trace()['traceEvents']
+    self.assertEqual('M', events[0]['ph'])
+    self.assertEqual(threading.current_thread().name,
+                     events[0]['args']['name'])
+    self.assertEqual(
+        [('ninja', 'command', 15, 5, {'args': '-C out'}),
+         ('build', 'clusterfuzz', 10, 30, {})],
+        [(e['name'], e['cat'], e['ts'], e['dur'], e['args'])
+         for e in events[1:]])
+    self.assertIsNone(tracing.events)
+
+  def test_redacted(self):
+    """Test that commands with auth headers don't put the token in the
+    trace."""
+    helpers.patch(self, ['clusterfuzz.common.start_execute',
+                         'clusterfuzz.common.start_execute_argv',
+                         'clusterfuzz.common.wait_execute'])
+    tracing.start()
+    common.execute(
+        'wget', '--content-disposition --header="Authorization: Bearer '
+        'secret-token" "https://clusterfuzz.com/testcase?id=1"', '/dir')
+    common.execute_argv(
+        ['curl', '-H', 'authorization: Bearer secret-token', 'url'], '/dir')
+
+    trace = json.dumps(self.read_trace())
+    self.assertNotIn('secret-token', trace)
+    events = [e for e in json.loads(trace)['traceEvents'] if e['ph'] == 'X']
+    self.assertEqual(
+        [{'args': '--content-disposition --header="Authorization: '
+                  '<redacted>" "https://clusterfuzz.com/testcase?id=1"',
+          'cwd': '/dir'},
+         {'argv': ['curl', '-H', 'authorization: <redacted>', 'url'],
+          'cwd': '/dir'}],
+        [e['args'] for e in events])
+
+  def test_span_exception(self):
+    """Test that a span is recorded even when the block raises."""
+    tracing.start()
+    with self.assertRaises(ValueError):
+      with tracing.span('build'):
+        raise ValueError()
+
+    self.assertEqual(['build'],
+                     [e['name'] for e in self.read_trace()['traceEvents']
+                      if e['ph'] == 'X'])
+
+  def test_traced(self):
+    """Test decorating functions, with and without arguments."""
+    @tracing.traced
+    def add(a, b):
+      return a + b
+
+    @tracing.traced(name='fetch', category='http')
+    def get():
+      return 'body'
+
+    tracing.start()
+    self.assertEqual(3, add(1, 2))
+    self.assertEqual('body', get())
+
+    self.assertEqual(
+        [('add', 'clusterfuzz'), ('fetch', 'http')],
+        [(e['name'], e['cat']) for e in self.read_trace()['traceEvents']
+         if e['ph'] == 'X'])